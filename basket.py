@@ -0,0 +1,158 @@
+"""
+Basket mode: several items on the tray, scanned in one shot.
+
+The detector tells how many instances of each product are on the tray,
+but not which weight variant each one is (Parachute 44 g or 55 g), and
+an occluded instance may be missed. solve_basket() picks the variants,
+and corrects the counts by at most `count_slack` per product, so that the
+catalog weights add up to the weight on the scale.
+
+It is a bounded knapsack over integer gram weights: the multisets of
+variants of each product are enumerated once, and combined product by
+product keeping, for every reachable total weight, only the cheapest way
+to reach it. The cost of a combination is
+
+    0.5 * (residual / sigma)^2 + count_penalty * |count - detected|
+
+where the residual is measured minus catalog weight and sigma combines
+the scale's and every item's packaging tolerance, i.e. its negative
+log likelihood under gaussian weighing/packaging error plus a fixed price
+for every instance the detector is assumed to have miscounted.
+"""
+import logging
+from itertools import combinations_with_replacement
+
+MAX_INSTANCES = 30  # per product; larger counts are not enumerated
+
+
+class BasketSolution:
+    """
+    The most likely contents of the tray.
+
+    lines([(CatalogEntry, int)]): variant and how many of it.
+    expected_weight(float): sum of the catalog weights of `lines`.
+    residual(float): measured weight minus `expected_weight`, in grams.
+    cost(float): see the module docstring; lower is more likely.
+    recounted(dict): product name -> count used, for products whose count
+        differs from the detected one.
+    ambiguous(bool): True if another combination with a different price is
+        almost as likely, so the basket should be split and scanned again.
+    """
+
+    def __init__(self, lines, expected_weight, residual, cost, recounted, ambiguous=False):
+        self.lines = lines
+        self.expected_weight = expected_weight
+        self.residual = residual
+        self.cost = cost
+        self.recounted = recounted
+        self.ambiguous = ambiguous
+
+    def price(self):
+        """
+        Returns: float sum of the unit prices of the lines.
+        """
+        return sum(entry.price * count for entry, count in self.lines)
+
+    def __repr__(self):
+        items = ', '.join(f"{count} x {entry.name} {entry.weight} g" for entry, count in self.lines)
+        return f"BasketSolution([{items}], residual {self.residual:+.1f} g)"
+
+
+def _product_options(variants, detected, count_slack, count_penalty):
+    """
+    Returns: dict total weight -> (penalty, count, [(CatalogEntry, int)]) of
+        every way to pick the instances of one product, cheapest per weight.
+    """
+    options = {}
+    entries = variants.entries
+    for count in range(max(1, detected - count_slack), min(detected + count_slack, MAX_INSTANCES) + 1):
+        penalty = count_penalty * abs(count - detected)
+        for combo in combinations_with_replacement(range(len(entries)), count):
+            weight = sum(entries[i].weight for i in combo)
+            if weight in options and options[weight][0] <= penalty:
+                continue
+            lines = [(entries[i], combo.count(i)) for i in sorted(set(combo))]
+            options[weight] = (penalty, count, lines)
+    return options
+
+
+def solve_basket(counts, weight, catalog, count_slack=1, count_penalty=2.0,
+                 tolerance=2.0, item_tolerance=2.0, max_sigma=3.0, ambiguity_margin=2.0):
+    """
+    solve_basket finds the variant combination of the detected products
+    whose catalog weights best explain the measured weight.
+
+    Products sold by weight have no fixed unit weight, so they are not
+    part of a basket and have to be weighed on their own.
+
+    Args:
+        counts(dict): product name -> instances detected.
+        weight(float): measured weight on the tray in grams.
+        catalog(PriceCatalog): price list.
+        count_slack(int): how far a product's count may be corrected.
+        count_penalty(float): cost of each corrected instance.
+        tolerance(float): grams of weighing error (one sigma) of the scale.
+        item_tolerance(float): grams of packaging error (one sigma) per item;
+            independent, so n items add sqrt(n) * item_tolerance.
+        max_sigma(float): residuals beyond this many sigmas are rejected.
+        ambiguity_margin(float): a runner-up within this much cost of the
+            best combination, at a different price, makes it ambiguous.
+
+    Raises:
+        ValueError: if a product is not in the catalog, is sold by weight
+            or was detected more than MAX_INSTANCES + count_slack times
+
+    Returns: BasketSolution, or None if no combination is within max_sigma.
+    """
+    items = sum(counts.values())
+    sigma = (tolerance ** 2 + items * item_tolerance ** 2) ** 0.5
+    low, high = weight - max_sigma * sigma, weight + max_sigma * sigma
+
+    products = []
+    for name, detected in sorted(counts.items(), key=lambda item: item[0]):
+        variants = catalog.variants(name)
+        if variants is None:
+            raise ValueError(f'Product "{name}" is not in the catalog.')
+        if any(entry.sold_by_weight for entry in variants.entries):
+            raise ValueError(f'Product "{name}" is sold by weight and has to be weighed on its own.')
+        if detected - count_slack > MAX_INSTANCES:
+            raise ValueError(f'More than {MAX_INSTANCES} of product "{name}" on the tray.')
+        products.append((name, detected, _product_options(variants, detected, count_slack, count_penalty)))
+    # heaviest the products after each one can still add, to drop totals that stay too light
+    headroom = [0] * (len(products) + 1)
+    for i in range(len(products) - 1, -1, -1):
+        headroom[i] = headroom[i + 1] + max(products[i][2])
+
+    best = {0: (0.0, [], {})}  # total weight -> (penalty, lines, recounted)
+    for i, (name, detected, options) in enumerate(products):
+        combined = {}
+        for total, (penalty, lines, recounted) in best.items():
+            for option_weight, (option_penalty, count, option_lines) in options.items():
+                new_total = total + option_weight
+                if new_total > high or new_total + headroom[i + 1] < low:
+                    continue
+                new_penalty = penalty + option_penalty
+                if new_total in combined and combined[new_total][0] <= new_penalty:
+                    continue
+                new_recounted = dict(recounted, **{name: count}) if count != detected else recounted
+                combined[new_total] = (new_penalty, lines + option_lines, new_recounted)
+        best = combined
+        if not best:
+            break
+
+    candidates = []
+    for total, (penalty, lines, recounted) in best.items():
+        if not low <= total <= high:
+            continue
+        residual = weight - total
+        cost = 0.5 * (residual / sigma) ** 2 + penalty
+        candidates.append(BasketSolution(lines, float(total), residual, cost, recounted))
+    if not candidates:
+        logging.warning(f"No combination of {dict(counts)} weighs {weight:.0f} g")
+        return None
+    solution = min(candidates, key=lambda candidate: candidate.cost)
+    price = solution.price()
+    solution.ambiguous = any(candidate.cost < solution.cost + ambiguity_margin
+                             and abs(candidate.price() - price) > 0.005
+                             for candidate in candidates)
+    return solution
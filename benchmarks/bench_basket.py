@@ -0,0 +1,102 @@
+"""
+Basket mode solver at realistic basket sizes.
+
+Builds a synthetic catalog of packaged products with 1 to --max-variants
+weight variants each, draws random baskets of --items items from --products distinct
+products, weighs them with packaging and load cell noise, and has the
+detector miss an instance with probability --miss. Reports how often
+basket.solve_basket recovers the product counts and the exact variants,
+how many baskets it flags as ambiguous (to be split and scanned again),
+the mean price error of the baskets it accepts and how long it takes:
+
+    python3 benchmarks/bench_basket.py --items 1 3 6 10 15
+    python3 benchmarks/bench_basket.py --products 15 --max-variants 2
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from basket import solve_basket  # noqa: E402
+from catalog import CatalogEntry, PriceCatalog  # noqa: E402
+
+
+def make_catalog(products, max_variants, rng):
+    entries = []
+    for i in range(products):
+        for weight in rng.sample(range(40, 1200, 5), rng.randint(1, max_variants)):
+            entries.append(CatalogEntry(f"Product {i}", weight, round(rng.uniform(10, 300), 2), False))
+    return PriceCatalog(entries)
+
+
+def draw_basket(catalog, items, distinct, rng):
+    names = rng.sample(sorted(catalog.products()), distinct)
+    basket = Counter()
+    for i in range(items):
+        name = names[i % distinct]
+        basket[rng.choice(catalog.variants(name).entries)] += 1
+    return basket
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[1, 3, 6, 10, 15])
+    parser.add_argument('--products', type=int, default=3, help='distinct products per basket (at most)')
+    parser.add_argument('--catalog', type=int, default=500, help='products in the catalog')
+    parser.add_argument('--max-variants', type=int, default=4, help='weight variants per product (at most)')
+    parser.add_argument('--baskets', type=int, default=300)
+    parser.add_argument('--noise', type=float, default=2.0, help='grams std of weighing error per item')
+    parser.add_argument('--miss', type=float, default=0.1, help='chance the detector misses one instance')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    catalog = make_catalog(args.catalog, args.max_variants, rng)
+    print(f"{'items':>5} {'counts':>7} {'exact':>7} {'ambiguous':>9} {'price err':>9} {'no fit':>7} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+    for items in args.items:
+        exact = counted = unsolved = ambiguous = 0
+        price_error = 0.0
+        timings = []
+        for _ in range(args.baskets):
+            basket = draw_basket(catalog, items, min(items, args.products), rng)
+            weight = sum(entry.weight * n for entry, n in basket.items())
+            weight += sum(rng.gauss(0.0, args.noise) for _ in range(items))
+            counts = Counter()
+            for entry, n in basket.items():
+                counts[entry.name] += n
+            true_counts = Counter(counts)
+            price = sum(entry.price * n for entry, n in basket.items())
+            if rng.random() < args.miss:
+                missed = rng.choice(sorted(name for name, n in counts.items() if n > 1) or [None])
+                if missed:
+                    counts[missed] -= 1
+            start = time.perf_counter()
+            solution = solve_basket(counts, weight, catalog)
+            timings.append(time.perf_counter() - start)
+            if solution is None:
+                unsolved += 1
+                continue
+            solved = Counter()
+            for entry, n in solution.lines:
+                solved[entry] += n
+            exact += solved == basket
+            counted += Counter({name: sum(n for e, n in solved.items() if e.name == name)
+                                for name in true_counts}) == true_counts
+            if solution.ambiguous:
+                ambiguous += 1
+            else:
+                price_error += abs(solution.price() - price)
+        timings.sort()
+        accepted = max(1, args.baskets - unsolved - ambiguous)
+        print(f"{items:5d} {100 * counted / args.baskets:6.1f}% {100 * exact / args.baskets:6.1f}% "
+              f"{100 * ambiguous / args.baskets:8.1f}% {price_error / accepted:9.2f} {unsolved:7d} "
+              f"{1000 * timings[len(timings) // 2]:7.2f} {1000 * timings[int(len(timings) * 0.99)]:7.2f} "
+              f"{1000 * timings[-1]:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Catalog load and nearest-variant lookup at store scale.
+
+Generates synthetic items.xml files with 10k and 100k SKUs and compares the
+original list-of-dicts + min() scan with catalog.PriceCatalog, and the
+cold (parse + write snapshot) with the warm (snapshot) catalog load:
+
+    python3 benchmarks/bench_catalog.py --skus 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import PriceCatalog, load_catalog_snapshot  # noqa: E402
+
+
+def write_catalog(path, skus, variants_per_product, rng):
+    root = ET.Element('items')
+    for i in range(skus // variants_per_product):
+        name = f"Product {i}_Flavour {i % 7}"
+        for weight in rng.sample(range(10, 5000), variants_per_product):
+            ET.SubElement(root, 'item', name=name, weight=str(weight),
+                          price=f"{rng.uniform(5, 500):.2f}", sold_by_weight='False')
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def legacy_load(path):
+    prices = defaultdict(list)
+    for item in ET.parse(path).getroot().findall('item'):
+        prices[item.get('name')].append({
+            "weight": int(item.get('weight')),
+            "price": float(item.get('price')),
+            "sold_by_weight": item.get('sold_by_weight', 'false').lower() == 'true',
+        })
+    return prices
+
+
+def legacy_nearest(prices, name, weight):
+    return min(prices[name], key=lambda x: abs(x['weight'] - weight))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--skus', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--variants', type=int, default=20, help='weight variants per product')
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for skus in args.skus:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'items.xml')
+            write_catalog(path, skus, args.variants, rng)
+            legacy, legacy_load_s = timed(legacy_load, path)
+            catalog, catalog_load_s = timed(PriceCatalog.from_xml, path)
+            (_, warm), cold_s = timed(load_catalog_snapshot, path)
+            assert not warm
+            (cached, warm), warm_s = timed(load_catalog_snapshot, path)
+            assert warm and len(cached) == len(catalog)
+
+        names = list(legacy)
+        queries = [(rng.choice(names), rng.randint(0, 5000)) for _ in range(args.lookups)]
+        for name, weight in queries[:1000]:
+            expected = legacy_nearest(legacy, name, weight)['weight']
+            got = catalog.nearest(name, weight).weight
+            assert abs(expected - weight) == abs(got - weight), (name, weight, expected, got)
+            assert cached.nearest(name, weight).weight == got
+
+        _, legacy_lookup_s = timed(lambda: [legacy_nearest(legacy, n, w) for n, w in queries])
+        _, catalog_lookup_s = timed(lambda: [catalog.nearest(n, w) for n, w in queries])
+        print(f"{skus} SKUs ({args.variants} variants/product)")
+        print(f"  load    legacy {legacy_load_s * 1000:8.1f} ms   catalog {catalog_load_s * 1000:8.1f} ms")
+        print(f"  start   cold   {cold_s * 1000:8.1f} ms   warm    {warm_s * 1000:8.1f} ms   "
+              f"({cold_s / warm_s:.1f}x)")
+        print(f"  lookup  legacy {legacy_lookup_s / args.lookups * 1e6:8.2f} us   "
+              f"catalog {catalog_lookup_s / args.lookups * 1e6:8.2f} us   "
+              f"({legacy_lookup_s / catalog_lookup_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Load test of the checkout loop on simulated hardware.
+
+Runs the real HX711 driver, sampling engine, scale monitor, load trigger
+and frame pipeline against the simulated scale, camera and detector from
+hardware.py, and acts as the operator: every settled load is detected and
+added to a cart. Reports per-item latency, CPU use and HX711 read counters:
+
+    python3 benchmarks/bench_checkout_sim.py --seconds 60
+    python3 benchmarks/bench_checkout_sim.py --profile checkout.prof
+"""
+import argparse
+import cProfile
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['RETAIL_HARDWARE'] = 'sim'
+os.environ.setdefault('RETAIL_SIM_TRACE', os.path.join(ROOT, 'sim_traces', 'basic_checkout.csv'))
+
+import hardware  # noqa: E402
+from detector import load_detector  # noqa: E402
+from frame_pipeline import FramePipeline  # noqa: E402
+from hx711 import HX711  # noqa: E402
+from hx711_sampler import RPiGPIOBackend, SamplingEngine  # noqa: E402
+from scale_monitor import ScaleMonitor  # noqa: E402
+from scale_trigger import LoadChangeTrigger  # noqa: E402
+
+
+def run(seconds, latency, sps):
+    load_cell = hardware.attach_simulated_scale(27, 17, rate=sps)
+    hx = HX711(dout_pin=27, pd_sck_pin=17)
+    sampler = SamplingEngine(RPiGPIOBackend(hx)).start()
+    hx.set_sampler(sampler)
+    hx.zero(10)
+    hx.set_scale_ratio(load_cell.ratio)
+
+    cap = hardware.open_camera()
+    model = load_detector('trace', hardware.SIM_TRACE, latency=latency)
+    pipeline = FramePipeline(cap, model, on_demand=True).start()
+    monitor = ScaleMonitor(hx).start()
+
+    settled = []
+    trigger = LoadChangeTrigger(
+        monitor, lambda weight: settled.append((time.perf_counter(), weight))).start()
+    cart = []
+    item_latencies = []
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+
+    handled = 0
+    while time.perf_counter() - wall_start < seconds:
+        if handled == len(settled):
+            time.sleep(0.01)
+            continue
+        settled_at, weight = settled[handled]
+        handled += 1
+        if weight < 5:
+            continue  # tray emptied
+        result = pipeline.wait_for_result(pipeline.request_inference())
+        if result is None:
+            continue
+        cart.append((result.detections.class_names(), round(weight)))
+        item_latencies.append(time.perf_counter() - settled_at)
+
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    trigger.stop()
+    monitor.stop()
+    pipeline.stop()
+    sampler.stop()
+
+    print(f"wall {wall:.1f} s, CPU {cpu:.2f} s ({100 * cpu / wall:.0f}% of one core)")
+    print(f"items {len(cart)}, inferences {pipeline.inference_count}")
+    if item_latencies:
+        item_latencies.sort()
+        print(f"settle -> detection: median {1000 * item_latencies[len(item_latencies) // 2]:.0f} ms, "
+              f"max {1000 * item_latencies[-1]:.0f} ms")
+    print(f"pipeline {pipeline.stats()}")
+    print(f"hx711 sampler {sampler.stats()}")
+    for labels, weight in cart:
+        print(f"  {', '.join(labels) or '?'} {weight} g")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=35.0)
+    parser.add_argument('--latency', type=float, default=0.15, help='simulated inference seconds')
+    parser.add_argument('--sps', type=int, default=10, help='HX711 samples per second (10 or 80)')
+    parser.add_argument('--profile', help='write cProfile stats to this file')
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        threading.setprofile(lambda *a: None)
+        profiler.runcall(run, args.seconds, args.latency, args.sps)
+        profiler.dump_stats(args.profile)
+    else:
+        run(args.seconds, args.latency, args.sps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the HX711 filter + mean path.
+
+Compares the original statistics-module implementation of
+HX711.outliers_filter + statistics.mean with the array based filters in
+hx711_filters, on batches of noisy readings with occasional spikes:
+
+    python3 benchmarks/bench_hx711_filters.py --readings 30
+"""
+import argparse
+import os
+import random
+import statistics as stat
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hx711_filters import (ExponentialFilter, KalmanFilter, MedianOfN,  # noqa: E402
+                           OutliersMean, TrimmedMean)
+
+
+def statistics_outliers_mean(data_list, stdev_thresh=1.0):
+    # the original HX711.outliers_filter followed by stat.mean
+    data = [num for num in data_list if (num != -1 and num != False and num != True)]
+    if not data:
+        return None
+    median = stat.median(data)
+    dists_from_median = [(abs(measurement - median)) for measurement in data]
+    stdev = stat.stdev(dists_from_median)
+    if stdev:
+        ratios_to_stdev = [(dist / stdev) for dist in dists_from_median]
+    else:
+        return median
+    filtered_data = []
+    for i in range(len(data)):
+        if ratios_to_stdev[i] < stdev_thresh:
+            filtered_data.append(data[i])
+    return stat.mean(filtered_data)
+
+
+def make_batch(readings, rng):
+    batch = [int(rng.gauss(84000, 40)) for _ in range(readings)]
+    for i in rng.sample(range(readings), max(1, readings // 10)):
+        batch[i] += rng.choice((-1, 1)) * rng.randint(2000, 20000)
+    return batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--readings', type=int, default=30)
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    batches = [make_batch(args.readings, rng) for _ in range(args.batches)]
+    arrays = [np.asarray(b, dtype=np.float64) for b in batches]
+
+    outliers_mean = OutliersMean()
+    for batch, values in zip(batches, arrays):
+        expected, got = statistics_outliers_mean(batch), outliers_mean(values)
+        assert abs(expected - got) < 1e-6, (expected, got)
+
+    candidates = [
+        ('statistics outliers + mean', lambda: [statistics_outliers_mean(b) for b in batches]),
+        ('OutliersMean', lambda: [outliers_mean(v) for v in arrays]),
+        ('MedianOfN', lambda f=MedianOfN(): [f(v) for v in arrays]),
+        ('TrimmedMean(0.2)', lambda f=TrimmedMean(0.2): [f(v) for v in arrays]),
+        ('ExponentialFilter(0.3)', lambda f=ExponentialFilter(0.3): [f(v) for v in arrays]),
+        ('KalmanFilter', lambda f=KalmanFilter(): [f(v) for v in arrays]),
+    ]
+    baseline = None
+    print(f"{args.readings} readings per batch, {args.batches} batches")
+    for name, fn in candidates:
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat)) / args.batches
+        baseline = baseline or best
+        print(f"{name:<28}{best * 1e6:>10.1f} us/batch{baseline / best:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
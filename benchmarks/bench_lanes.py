@@ -0,0 +1,78 @@
+"""
+Throughput of the checkout server's shared detector as lanes are added.
+
+Runs 1, 2, 4 ... lanes on simulated cameras, each with a FramePipeline in
+continuous mode (every frame inferred, the heaviest load a lane can put on
+the detector), all sharing one detector.TraceDetector through
+inference_batcher.MicroBatcher. For every lane count it is run once with
+micro-batching and once with --max-batch 1 (one frame per forward pass,
+i.e. lanes just taking turns), and reports total inferences per second
+and the worst lane's p95 latency against the SLO:
+
+    python3 benchmarks/bench_lanes.py --lanes 1 2 4 8 --seconds 10
+    python3 benchmarks/bench_lanes.py --latency 0.15 --batch-cost 0.25
+
+The simulated detector costs latency * (1 + batch_cost * (N - 1)) per
+batch of N; measure batch_cost for your model and CPU with
+detector.infer_batch() on an export with a dynamic batch size.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['RETAIL_HARDWARE'] = 'sim'
+os.environ.setdefault('RETAIL_SIM_TRACE', os.path.join(ROOT, 'sim_traces', 'basic_checkout.csv'))
+
+import hardware  # noqa: E402
+from detector import load_detector  # noqa: E402
+from frame_pipeline import FramePipeline  # noqa: E402
+from inference_batcher import MicroBatcher  # noqa: E402
+
+
+def run(lanes, seconds, model, max_batch, slo):
+    batcher = MicroBatcher(model, max_batch=max_batch, slo=slo).start()
+    cameras = [hardware.open_camera(i) for i in range(lanes)]
+    pipelines = [FramePipeline(cap, batcher.client(str(i + 1))).start()
+                 for i, cap in enumerate(cameras)]
+    time.sleep(seconds)
+    for pipeline in pipelines:
+        pipeline.stop()
+    batcher.stop()
+    for cap in cameras:
+        cap.release()
+    stats = batcher.stats()
+    worst = max(stats['lanes'].values(), key=lambda summary: summary['p95_ms'])
+    return {
+        'fps': sum(summary['calls'] for summary in stats['lanes'].values()) / seconds,
+        'per_lane_fps': min(summary['calls'] for summary in stats['lanes'].values()) / seconds,
+        'mean_batch': stats['mean_batch'],
+        'p95_ms': worst['p95_ms'],
+        'missed': sum(summary['violations'] for summary in stats['lanes'].values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lanes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--latency', type=float, default=0.15, help='simulated seconds per single-frame inference')
+    parser.add_argument('--batch-cost', type=float, default=0.25,
+                        help='cost of each extra frame in a batch, as a share of a single inference')
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--slo', type=float, default=0.3, help='per-lane latency target in seconds')
+    args = parser.parse_args()
+
+    model = load_detector('trace', hardware.SIM_TRACE, latency=args.latency, batch_cost=args.batch_cost)
+    print(f"{'lanes':>5} {'mode':>9} {'infer/s':>8} {'per lane':>8} {'batch':>6} {'p95 ms':>7} {'SLO missed':>10}")
+    for lanes in args.lanes:
+        for mode, max_batch in (('turns', 1), ('batched', args.max_batch)):
+            r = run(lanes, args.seconds, model, max_batch, args.slo)
+            print(f"{lanes:5d} {mode:>9} {r['fps']:8.1f} {r['per_lane_fps']:8.1f} {r['mean_batch']:6.1f} "
+                  f"{r['p95_ms']:7.0f} {r['missed']:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Latency / accuracy trade-off of input resolution and tray ROI cropping.
+
+Evaluates each model directory on a labelled image folder, with and without
+the ROI, and prints one row per configuration:
+
+    python3 benchmarks/bench_resolution.py --images val/images \
+        --models models/best_openvino_model models/best_416_openvino_model \
+                 models/best_320_openvino_model --roi 160 80 320 320
+
+Labels are in full-frame coordinates; ROI detections are mapped back to
+the full frame before scoring, so the rows are directly comparable.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detector import load_detector  # noqa: E402
+from evaluation import evaluate, list_images  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--images', required=True, help='folder of labelled images')
+    parser.add_argument('--models', nargs='+', required=True, help='OpenVINO model directories or .onnx files')
+    parser.add_argument('--roi', type=int, nargs=4, metavar=('X', 'Y', 'W', 'H'))
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--json', help='also write the raw results here')
+    args = parser.parse_args()
+
+    images = list_images(args.images)
+    rows = []
+    for model_path in args.models:
+        backend = 'onnxruntime' if model_path.endswith('.onnx') else 'openvino'
+        for roi in ([None, args.roi] if args.roi else [None]):
+            detector = load_detector(backend, model_path, roi=roi, num_threads=args.threads)
+            report = evaluate(detector, images)
+            report.update(model=model_path, roi=roi)
+            rows.append(report)
+
+    print(f"{'model':<40}{'roi':>6}{'mean ms':>10}{'p95 ms':>10}{'mAP50':>8}{'mAP50-95':>10}")
+    for row in rows:
+        print(f"{os.path.basename(os.path.normpath(row['model'])):<40}"
+              f"{'yes' if row['roi'] else 'no':>6}"
+              f"{row['mean_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row.get('map50', float('nan')):>8.3f}{row.get('map50_95', float('nan')):>10.3f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+End-of-day reporting over months of sales: transactions.log vs the SQLite
+transaction store.
+
+Generates a transactions.log with --days days of --per-day sales, imports
+it into transaction_store.TransactionStore and compares the daily report
+computed by re-parsing the log with the store's queries:
+
+    python3 benchmarks/bench_transactions.py --days 180 --per-day 400
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transaction_store import TransactionStore  # noqa: E402
+
+PRODUCTS = [('Thumsup', 40.0), ('Parachute', 20.0), ('Cup Noodles_Tomato', 50.0), ('Milk', 28.0)]
+METHODS = ['Cash', 'Credit Card', 'Mobile Payment']
+
+
+def write_log(path, days, per_day, rng):
+    start = datetime(2024, 1, 1, 9)
+    with open(path, 'w') as f:
+        for day in range(days):
+            for i in range(per_day):
+                when = start + timedelta(days=day, seconds=i * 30)
+                items = []
+                for name, price in rng.sample(PRODUCTS, rng.randint(1, 3)):
+                    count = rng.randint(1, 3)
+                    items.append({'name': name, 'detected_weight': 100, 'count': count,
+                                  'price_per_item': price, 'total_price': count * price,
+                                  'sold_by_weight': False})
+                if rng.random() < 0.3:
+                    grams = rng.randint(100, 1000)
+                    items.append({'name': 'Apple', 'weight': grams, 'count': 1,
+                                  'price_per_gram': 0.2, 'total_price': grams * 0.2,
+                                  'sold_by_weight': True})
+                f.write(json.dumps({'datetime': when.isoformat(),
+                                    'total_price': sum(item['total_price'] for item in items),
+                                    'payment_method': rng.choice(METHODS), 'items': items}) + '\n')
+
+
+def legacy_daily_sales(path, first_day, last_day):
+    totals = defaultdict(lambda: [0, 0.0])
+    with open(path) as f:
+        for line in f:
+            transaction = json.loads(line)
+            day = transaction['datetime'][:10]
+            if first_day <= day <= last_day:
+                totals[day][0] += 1
+                totals[day][1] += transaction['total_price']
+    return sorted((day, n, revenue) for day, (n, revenue) in totals.items())
+
+
+def timed(fn, *args, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--per-day', type=int, default=400)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, 'transactions.log')
+        write_log(log, args.days, args.per_day, random.Random(0))
+        store = TransactionStore(os.path.join(tmp, 'transactions.db'))
+        (imported, _), import_s = timed(store.import_log, log)
+        (again, _), _ = timed(store.import_log, log)
+        assert imported == args.days * args.per_day and again == 0
+
+        last = (datetime(2024, 1, 1) + timedelta(days=args.days - 1)).date().isoformat()
+        first = '2024-01-01'
+        legacy_day, legacy_day_s = timed(legacy_daily_sales, log, last, last)
+        legacy_range, legacy_range_s = timed(legacy_daily_sales, log, first, last)
+        day, day_s = timed(store.daily_sales, last, last, repeat=20)
+        rng, range_s = timed(store.daily_sales, first, last, repeat=20)
+        _, items_s = timed(store.item_sales, first, last, repeat=20)
+        for expected, got in ((legacy_day, day), (legacy_range, rng)):
+            assert [(d, n) for d, n, _ in expected] == [(d, n) for d, n, _ in got]
+            assert all(abs(a[2] - b[2]) < 1e-6 * max(1.0, a[2]) for a, b in zip(expected, got))
+
+        start = time.perf_counter()
+        for i in range(1000):
+            store.record({'datetime': f"{last}T20:00:00", 'total_price': 10.0,
+                          'payment_method': 'Cash', 'items': []}, key=f"bench-{i}")
+        record_s = (time.perf_counter() - start) / 1000
+        store.flush()
+        store.close()
+
+    total = args.days * args.per_day
+    print(f"{total} transactions over {args.days} days")
+    print(f"  import          {import_s:8.2f} s")
+    print(f"  one day         log {legacy_day_s * 1000:9.1f} ms   store {day_s * 1000:7.3f} ms")
+    print(f"  {args.days} day range   log {legacy_range_s * 1000:9.1f} ms   store {range_s * 1000:7.3f} ms")
+    print(f"  item ranking    store {items_s * 1000:7.3f} ms")
+    print(f"  record()        {record_s * 1e6:8.1f} us per sale (batched commit)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+WhatsApp outbox against a local stub of the Twilio Messages API.
+
+The stub (tests/twilio_stub.py) fails a share of the requests with HTTP
+500, rate limits with 429 and Retry-After, and drops some connections
+after accepting the message (a lost response). The benchmark checks
+that every receipt is delivered exactly once and reports the enqueue
+latency seen by the payment UI, the delivery time and how many HTTP
+connections were opened:
+
+    python3 benchmarks/bench_whatsapp_outbox.py --messages 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from twilio_stub import StubTwilio  # noqa: E402
+from whatsapp_outbox import Outbox, OutboxWorker, TwilioSender  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--fail-rate', type=float, default=0.2, help='share of requests answered 500')
+    parser.add_argument('--drop-rate', type=float, default=0.1, help='share of accepted requests without response')
+    parser.add_argument('--rate-limit', type=int, default=10, help='requests per second before 429')
+    args = parser.parse_args()
+
+    server = StubTwilio(args.fail_rate, args.drop_rate, args.rate_limit).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = Outbox(os.path.join(tmp, 'outbox.db'))
+        sender = TwilioSender('AC' + '0' * 32, 'token', 'whatsapp:+10000000000',
+                              base_url=server.base_url(), timeout=2.0)
+        worker = OutboxWorker(outbox, sender, backoff=0.2, max_backoff=2.0, min_interval=0.0).start()
+
+        start = time.perf_counter()
+        enqueue_s = []
+        for i in range(args.messages):
+            t = time.perf_counter()
+            outbox.enqueue(f"+9190000{i:05d}", f"Receipt {i}", f"receipt-{i}")
+            enqueue_s.append(time.perf_counter() - t)
+        # enqueueing the same receipt again (e.g. a rerun of the page) is a no-op
+        assert not outbox.enqueue("+919000000000", "Receipt 0", "receipt-0")
+
+        deadline = time.monotonic() + 120
+        while outbox.counts().get('pending') and time.monotonic() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        worker.stop()
+        counts = outbox.counts()
+        outbox.close()
+
+    server.shutdown()
+    duplicates = sum(1 for n in server.delivered.values() if n > 1)
+    print(f"{args.messages} messages: {counts}")
+    print(f"  enqueue     {sum(enqueue_s) / len(enqueue_s) * 1000:6.2f} ms mean   "
+          f"{max(enqueue_s) * 1000:6.2f} ms max")
+    print(f"  delivered   {len(server.delivered)} in {elapsed:.1f} s, duplicates {duplicates}")
+    print(f"  responses   {dict(server.requests)}")
+    print(f"  connections {server.connections} for {sum(server.requests.values())} requests")
+    print(f"  worker      {worker.counters}")
+    assert counts.get('sent') == args.messages and duplicates == 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Persistent HX711 calibration.
+
+The offset and scale ratio of every channel/gain (HX711._offset_* and
+_scale_ratio_*) are kept in a JSON file together with when they were
+measured and the board temperature at the time, e.g.
+
+    {
+      "version": 1,
+      "channels": {
+        "A_128": {"offset": 84012.4, "scale_ratio": 419.8,
+                  "offset_at": "2024-06-01T09:12:40", "ratio_at": "2024-05-20T18:03:11",
+                  "temperature_c": 47.2}
+      }
+    }
+
+so the checkout can start without the interactive calibration, and only
+re-tares itself (see auto_tare) when the empty tray has drifted.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+import hardware
+
+CALIBRATION_VERSION = 1
+
+
+def _key(channel, gain_A):
+    return f"A_{gain_A}" if channel == 'A' else 'B'
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class CalibrationStore:
+    """
+    CalibrationStore reads and writes the calibration file. It is shared by
+    auto_tare on the checkout thread and ZeroTracker, so record() and
+    save() are serialised.
+    """
+
+    def __init__(self, path, channels=None):
+        """
+        Args:
+            path(str): JSON file holding the calibration.
+            channels(dict): Optional. Entries keyed 'A_128', 'A_64' or 'B'.
+        """
+        self.path = path
+        self.channels = channels or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """
+        load reads the calibration file. A missing or unreadable file gives
+        an empty store, so the scale has to be calibrated interactively.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Ignoring unreadable calibration file {path}: {e}")
+            return cls(path)
+        if data.get('version') != CALIBRATION_VERSION:
+            logging.error(f"Ignoring calibration file {path} with version {data.get('version')}")
+            return cls(path)
+        return cls(path, data.get('channels', {}))
+
+    def save(self):
+        with self._lock:
+            # a tmp file of its own, so a save can never pick up another's writes
+            f = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.path)),
+                                            prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                                            delete=False)
+            try:
+                with f:
+                    json.dump({'version': CALIBRATION_VERSION, 'channels': self.channels}, f, indent=2)
+                os.replace(f.name, self.path)  # never leave a half written calibration behind
+            except BaseException:
+                os.unlink(f.name)
+                raise
+
+    def get(self, channel, gain_A=128):
+        """
+        Returns: dict entry for the channel and gain, or None if not calibrated.
+        """
+        return self.channels.get(_key(channel, gain_A))
+
+    def apply(self, hx):
+        """
+        apply loads every stored offset and scale ratio into `hx`.
+
+        Returns: bool True if the channel/gain `hx` reads from is calibrated.
+        """
+        for key, entry in self.channels.items():
+            channel, _, gain = key.partition('_')
+            gain_A = int(gain) if gain else 0
+            hx.set_offset(int(round(entry['offset'])), channel, gain_A)
+            hx.set_scale_ratio(entry['scale_ratio'], channel, gain_A)
+        entry = self.get(hx.get_current_channel() or 'A', hx.get_current_gain_A())
+        if entry is None:
+            return False
+        logging.info(f"Loaded calibration: offset {entry['offset']:.1f}, ratio {entry['scale_ratio']:.3f} "
+                     f"(tared {entry.get('offset_at')}, calibrated {entry.get('ratio_at')})")
+        return True
+
+    def record(self, hx, ratio=True):
+        """
+        record stores the offset, and with `ratio` the scale ratio, that
+        `hx` currently uses, stamped with the time and board temperature.
+
+        Returns: dict the updated entry.
+        """
+        channel = hx.get_current_channel() or 'A'
+        gain_A = hx.get_current_gain_A()
+        temperature = hardware.read_temperature()
+        with self._lock:
+            entry = self.channels.setdefault(_key(channel, gain_A), {})
+            entry['offset'] = float(hx.get_current_offset(channel, gain_A))
+            entry['offset_at'] = _now()
+            if ratio or 'scale_ratio' not in entry:
+                entry['scale_ratio'] = float(hx.get_current_scale_ratio(channel, gain_A))
+                entry['ratio_at'] = entry['offset_at']
+            entry['temperature_c'] = temperature
+            return dict(entry)
+
+
+def auto_tare(hx, monitor, store=None, tolerance=2.0, max_drift=50.0, timeout=3.0):
+    """
+    auto_tare checks the empty tray and re-tares only if it has drifted.
+
+    The settled weight comes from the running ScaleMonitor and the new
+    offset from the samples already in its ring buffer, so no extra HX711
+    conversions are needed.
+
+    Args:
+        hx(HX711): calibrated scale with a running sampler.
+        monitor(ScaleMonitor): running monitor of `hx`.
+        store(CalibrationStore): Optional. Saved after a re-tare.
+        tolerance(float): grams the empty tray may read before re-taring.
+        max_drift(float): grams above which the tray is taken to be loaded
+            and nothing is changed.
+        timeout(float): seconds to wait for a stable reading.
+
+    Returns: float grams corrected (0.0 if within tolerance), or None if
+        the tray was unstable or loaded.
+    """
+    reading = monitor.wait_stable(timeout=timeout)
+    if reading is None:
+        logging.warning("Scale not stable, skipping the zero check")
+        return None
+    drift = reading.weight
+    if abs(drift) <= tolerance:
+        return 0.0
+    if abs(drift) > max_drift:
+        logging.warning(f"Empty tray reads {drift:.1f} g, is something on it? Not re-taring")
+        return None
+    offset = monitor.raw_mean(monitor.window)
+    hx.set_offset(int(round(offset)), hx.get_current_channel(), hx.get_current_gain_A())
+    logging.info(f"Zero drifted by {drift:.1f} g, re-tared to offset {offset:.1f}")
+    if store is not None:
+        store.record(hx, ratio=False)
+        store.save()
+    return drift
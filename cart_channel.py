@@ -0,0 +1,518 @@
+"""
+Cart handoff between the checkout (final.py) and the payment UI.
+
+The checkout publishes cart snapshots on a Unix socket; the UI subscribes
+and has every snapshot pushed to it as soon as it is published, instead of
+re-reading receipt.json. Messages are newline delimited JSON objects:
+
+    checkout -> UI  {"type": "delta", "version": 6, "session": "...",
+                     "key": "Apple|250", "line": {...}, "total_price": ...}
+    checkout -> UI  {"type": "cart", "version": 7, "session": "...",
+                     "status": "pending", "total_price": ..., "items": [...],
+                     "catalog_version": 3}
+    UI -> checkout  {"type": "paid", "session": "...", ...}
+
+While a customer is scanning, each added or changed receipt line is sent
+as a delta (with "line": null for a line taken off the cart); the cart
+is then in status 'scanning' and holds its `lines` by key. When the
+customer is done the full receipt follows with status 'pending'.
+
+`version` increases with every message the publisher sends. Carts stay
+open until the UI reports them paid, and a subscriber that (re)connects
+is sent every open cart in full first, so a restarted UI picks up where
+it was.
+
+Where Unix sockets are not available, or the socket cannot be created,
+both ends fall back to files, each written by one side only and replaced
+atomically: the publisher keeps every open cart in `fallback_file`
+
+    {"version": 7, "carts": [{"session": "...", "status": "pending", ...}, ...]}
+
+and the subscriber polls its mtime. Payments are reported in
+`fallback_file`.paid, {"paid": [{"type": "paid", "session": "...", ...}]},
+which the publisher reads before each write to drop the paid carts, so
+the next customer's scan never replaces a receipt still being paid.
+
+The paid file is also where a payment goes when the socket breaks while
+it is reported. The publisher reads it before every message it sends and
+before it resends the open carts to a subscriber that connects, even on
+the socket, and confirms each cart it drops with a
+{"type": "cart", "session": "...", "status": "paid"} message, after which
+the subscriber stops reporting it.
+"""
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'retail_checkout.sock')
+DEFAULT_FILE = 'receipt.json'
+PAID_SUFFIX = '.paid'
+
+
+def _encode(message):
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def _write_file(path, message):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(message, f, indent=2)
+    os.replace(tmp, path)  # readers never see a half written file
+
+
+def _read_file(path):
+    """
+    Returns: the JSON object in `path`, or {} if it is missing or unreadable.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _file_carts(content):
+    """
+    Returns: list of the carts in a fallback file, also from the single
+        cart files written before several carts were kept.
+    """
+    if 'carts' in content:
+        return content['carts']
+    return [content] if content.get('session') else []
+
+
+class CartPublisher:
+    """
+    CartPublisher is the checkout end of the channel. It accepts any number
+    of subscribers and pushes every published cart to all of them.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, fallback_file=DEFAULT_FILE, on_message=None):
+        """
+        Args:
+            socket_path(str): path of the Unix socket.
+            fallback_file(str): file the open carts are written to when there is no socket.
+            on_message(callable): Optional. Called with every message a
+                subscriber sends, on the connection's thread.
+        """
+        self.socket_path = socket_path
+        self.fallback_file = fallback_file
+        self._on_message = on_message
+        self._server = None
+        self._clients = []
+        self._open = OrderedDict()  # session -> full snapshot of the carts not yet paid
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.version = 0
+
+    @property
+    def fallback(self):
+        return self._server is None
+
+    def start(self):
+        try:
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)  # left over from a previous run
+            server.bind(self.socket_path)
+            server.listen(4)
+            server.settimeout(0.5)
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Cannot open cart socket {self.socket_path} ({e}), "
+                            f"handing carts over in {self.fallback_file}")
+            return self
+        self._server = server
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._accept, name='cart-publisher', daemon=True)
+        self._thread.start()
+        logging.info(f"Publishing carts on {self.socket_path}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2.0)
+            self._thread = None
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            client.settimeout(1.0)  # a stuck UI must not block the checkout
+            with self._lock:
+                # payments the UI could not send on its last connection
+                paid = self._take_paid()
+                try:
+                    for cart in self._open.values():
+                        client.sendall(_encode(cart))
+                except OSError:
+                    connected = False
+                else:
+                    connected = True
+                    self._clients.append(client)
+            self._notify_paid(paid)
+            if not connected:
+                client.close()
+                continue
+            threading.Thread(target=self._receive, args=(client,), name='cart-client',
+                             daemon=True).start()
+
+    def _receive(self, client):
+        buffer = b''
+        while not self._stop.is_set():
+            try:
+                chunk = client.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    logging.warning("Ignoring malformed message on the cart socket")
+                    continue
+                self._handle(message)
+        self._drop(client)
+
+    def _handle(self, message):
+        if message.get('type') == 'paid':
+            with self._lock:
+                self._open.pop(message.get('session'), None)
+        if self._on_message:
+            try:
+                self._on_message(message)
+            except Exception:
+                logging.exception("Cart message handler failed")
+
+    def _drop(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+        client.close()
+
+    def publish(self, cart):
+        """
+        publish pushes a cart snapshot to every subscriber.
+
+        Args:
+            cart(dict): with at least 'session' and 'status'.
+
+        Returns: int version of the snapshot.
+        """
+        with self._lock:
+            paid = self._take_paid()
+            self.version += 1
+            message = dict(cart, type='cart', version=self.version)
+            self._open[message['session']] = message
+            self._open.move_to_end(message['session'])
+            self._send(message)
+            version = self.version
+        self._notify_paid(paid)
+        return version
+
+    def publish_delta(self, session, key, line, total_price):
+        """
+        publish_delta pushes one added or changed line of the cart being
+        scanned, with the new running total. A `line` of None removes it.
+
+        Returns: int version of the message.
+        """
+        with self._lock:
+            paid = self._take_paid()
+            self.version += 1
+            cart = self._open.get(session)
+            if cart is None or cart.get('status') != 'scanning':
+                cart = self._open[session] = {'type': 'cart', 'session': session,
+                                              'status': 'scanning', 'lines': {}}
+            if line is None:
+                cart['lines'].pop(key, None)
+            else:
+                cart['lines'][key] = line
+            cart['total_price'] = total_price
+            cart['version'] = self.version
+            cart['changed'] = key
+            # the file only ever holds whole carts
+            self._send({'type': 'delta', 'version': self.version, 'session': session,
+                        'key': key, 'line': line, 'total_price': total_price})
+            version = self.version
+        self._notify_paid(paid)
+        return version
+
+    def _take_paid(self):
+        """
+        _take_paid drops the open carts the UI reported paid in the paid
+        file and, on the socket, confirms them to the subscribers. Called
+        with the lock held.
+
+        Returns: list of the paid messages of the dropped carts.
+        """
+        paid = []
+        for message in _read_file(self.fallback_file + PAID_SUFFIX).get('paid', []):
+            if self._open.pop(message.get('session'), None) is not None:
+                paid.append(message)
+                if self._server is not None:
+                    self.version += 1
+                    self._send({'type': 'cart', 'version': self.version,
+                                'session': message.get('session'), 'status': 'paid'})
+        return paid
+
+    def _notify_paid(self, paid):
+        for message in paid:
+            if self._on_message:
+                try:
+                    self._on_message(message)
+                except Exception:
+                    logging.exception("Cart message handler failed")
+
+    def _send(self, message):
+        # called with the lock held
+        if self._server is None:
+            _write_file(self.fallback_file, {'version': self.version, 'carts': list(self._open.values())})
+            return
+        line = _encode(message)
+        for client in list(self._clients):
+            try:
+                client.sendall(line)
+            except OSError as e:
+                logging.warning(f"Dropping cart subscriber: {e}")
+                self._clients.remove(client)
+                client.close()
+
+
+class CartSubscriber:
+    """
+    CartSubscriber is the payment UI end of the channel. A background
+    thread receives the pushed snapshots and keeps the open carts in the
+    order they were handed over.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, fallback_file=DEFAULT_FILE, poll_interval=0.5):
+        """
+        Args:
+            socket_path(str): path of the publisher's Unix socket.
+            fallback_file(str): file polled while the socket is not there.
+            poll_interval(float): seconds between file polls and reconnects.
+        """
+        self.socket_path = socket_path
+        self.fallback_file = fallback_file
+        self._poll_interval = poll_interval
+        self._carts = OrderedDict()  # session -> latest snapshot
+        self._paid = {}  # session -> paid message reported in the paid file
+        self._cond = threading.Condition()
+        self._sock = None
+        self._file_mtime = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.seq = 0  # counts received snapshots, for wait()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cart-subscriber', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # close() alone does not wake the blocked recv()
+            except OSError:
+                pass
+        if self._thread:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            sock = self._connect()
+            if sock is None:
+                self._poll_file()
+                self._stop.wait(self._poll_interval)
+                continue
+            self._sock = sock
+            try:
+                self._read(sock)
+            finally:
+                self._sock = None
+                sock.close()
+
+    def _connect(self):
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(self.socket_path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return None
+        with self._cond:
+            # the publisher resends every open cart on connect
+            self._carts.clear()
+        return sock
+
+    def _read(self, sock):
+        buffer = b''
+        while not self._stop.is_set():
+            try:
+                chunk = sock.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                try:
+                    self._received(json.loads(line))
+                except ValueError:
+                    logging.warning("Ignoring malformed cart snapshot")
+
+    def _poll_file(self):
+        try:
+            mtime = os.stat(self.fallback_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        self._file_mtime = mtime
+        content = _read_file(self.fallback_file)
+        if not content:
+            return
+        carts = _file_carts(content)
+        sessions = {cart.get('session') for cart in carts}
+        with self._cond:
+            # the file holds every open cart; paid ones stay in it until the
+            # checkout writes it again
+            self._carts.clear()
+            for cart in carts:
+                if cart.get('session') not in self._paid:
+                    self._carts[cart.get('session', '')] = cart
+            pruned = {session: message for session, message in self._paid.items() if session in sessions}
+            if len(pruned) != len(self._paid):
+                # the checkout has dropped them, they need not be reported any more
+                self._paid = pruned
+                self._write_paid()
+            self.seq += 1
+            self._cond.notify_all()
+
+    def _received(self, cart):
+        session = cart.get('session', '')
+        with self._cond:
+            if session in self._paid:
+                if cart.get('status') == 'paid':
+                    # the checkout has dropped it, it need not be reported any more
+                    del self._paid[session]
+                    self._write_paid()
+                # else resent before the checkout read the payment: not to be paid twice
+            elif cart.get('type') == 'delta':
+                current = self._carts.get(session)
+                if current is None or current.get('status') != 'scanning':
+                    current = self._carts[session] = {'session': session, 'status': 'scanning',
+                                                      'lines': {}}
+                if cart['line'] is None:
+                    current['lines'].pop(cart['key'], None)
+                else:
+                    current['lines'][cart['key']] = cart['line']
+                current['total_price'] = cart['total_price']
+                current['version'] = cart['version']
+                current['changed'] = cart['key']
+            elif cart.get('status', 'pending') == 'paid':
+                self._carts.pop(session, None)
+            else:
+                self._carts[session] = cart
+            self.seq += 1
+            self._cond.notify_all()
+
+    def pending(self):
+        """
+        Returns: the oldest cart waiting for payment, or None.
+        """
+        with self._cond:
+            for cart in self._carts.values():
+                if cart.get('status', 'pending') == 'pending':
+                    return cart
+        return None
+
+    def scanning(self):
+        """
+        Returns: a copy of the cart being scanned, with its `lines` by key
+            and the key of the last `changed` line, or None.
+        """
+        with self._cond:
+            for cart in reversed(self._carts.values()):
+                if cart.get('status') == 'scanning':
+                    return dict(cart, lines=dict(cart['lines']))
+        return None
+
+    def wait(self, seq, timeout):
+        """
+        wait blocks until a snapshot newer than `seq` arrives.
+
+        Returns: bool True if one arrived before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.seq <= seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def paid(self, cart):
+        """
+        paid reports a cart as paid and forgets it.
+
+        Args:
+            cart(dict): the paid cart, with the final items and total.
+        """
+        message = dict(cart, type='paid', status='paid')
+        with self._cond:
+            self._carts.pop(message.get('session'), None)
+            self.seq += 1
+            self._cond.notify_all()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.sendall(_encode(message))
+                return
+            except OSError as e:
+                logging.warning(f"Cannot report payment on the cart socket: {e}")
+        self._mark_file_paid(message)
+
+    def _mark_file_paid(self, message):
+        # the cart file is the checkout's; payments go to a file only the UI writes
+        with self._cond:
+            self._paid[message.get('session')] = message
+            self._write_paid()
+
+    def _write_paid(self):
+        # called with the condition held, so the UI's threads never write the file at once
+        _write_file(self.fallback_file + PAID_SUFFIX, {'paid': list(self._paid.values())})
@@ -0,0 +1,435 @@
+"""
+Indexed price catalog built from items.xml.
+
+Each product keeps its weight variants sorted, so the variant nearest to a
+measured weight is found with a binary search instead of a scan over every
+variant.
+
+items.xml is read with a streaming parser and the result is cached in a
+binary snapshot next to it (items.xml.snapshot). The snapshot is keyed on
+the XML's mtime, size and SHA-256, so a warm start skips XML parsing.
+
+CatalogService keeps the catalog loaded for the life of the checkout and
+swaps in a rebuilt one when items.xml changes.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = '.snapshot'
+
+
+class CatalogEntry:
+    """
+    One <item> of items.xml: a product variant with its weight and price.
+    For products sold by weight `price` is per gram.
+    """
+    __slots__ = ('name', 'weight', 'price', 'sold_by_weight')
+
+    def __init__(self, name, weight, price, sold_by_weight):
+        self.name = name
+        self.weight = weight
+        self.price = price
+        self.sold_by_weight = sold_by_weight
+
+    def __repr__(self):
+        return (f"CatalogEntry({self.name!r}, {self.weight}, {self.price}, "
+                f"{self.sold_by_weight})")
+
+
+class ProductVariants:
+    """
+    The variants of one product, sorted by weight.
+    """
+    __slots__ = ('weights', 'entries')
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda entry: entry.weight)
+        self.weights = [entry.weight for entry in entries]
+        self.entries = entries
+
+    def nearest(self, weight):
+        """
+        nearest returns the variant whose weight is closest to `weight`;
+        on a tie the lighter one.
+
+        Returns: CatalogEntry
+        """
+        weights = self.weights
+        i = bisect.bisect_left(weights, weight)
+        if i == 0:
+            return self.entries[0]
+        if i == len(weights):
+            return self.entries[-1]
+        if weight - weights[i - 1] <= weights[i] - weight:
+            return self.entries[i - 1]
+        return self.entries[i]
+
+
+class PriceCatalog:
+    """
+    PriceCatalog maps product names to their ProductVariants.
+    """
+
+    def __init__(self, entries=()):
+        """
+        Args:
+            entries([CatalogEntry]): catalog rows in any order.
+        """
+        grouped = {}
+        for entry in entries:
+            grouped.setdefault(entry.name, []).append(entry)
+        self._products = {name: ProductVariants(group) for name, group in grouped.items()}
+        self._size = sum(len(v.entries) for v in self._products.values())
+        self.source = None  # {'mtime_ns', 'size', 'sha256'} of the XML it was built from
+        self.version = 0  # set by CatalogService, 0 if not loaded by one
+
+    @classmethod
+    def from_xml(cls, xml_file):
+        """
+        from_xml parses an items.xml file without building its DOM.
+
+        Raises:
+            ET.ParseError, OSError, ValueError: if the file cannot be read.
+        """
+        return cls(iter_entries(xml_file))
+
+    def to_columns(self):
+        """
+        to_columns flattens the catalog into compact arrays, product by
+        product with variants in weight order.
+
+        Returns: dict with 'names', 'counts', 'weights', 'prices', 'sold_by_weight'
+        """
+        names, counts = [], array('I')
+        weights, prices, sold_by_weight = array('i'), array('d'), bytearray()
+        for name, variants in self._products.items():
+            names.append(name)
+            counts.append(len(variants.entries))
+            for entry in variants.entries:
+                weights.append(entry.weight)
+                prices.append(entry.price)
+                sold_by_weight.append(entry.sold_by_weight)
+        return {'names': names, 'counts': counts, 'weights': weights,
+                'prices': prices, 'sold_by_weight': bytes(sold_by_weight)}
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        from_columns rebuilds a catalog written by to_columns(), without
+        sorting again.
+        """
+        catalog = cls()
+        products = catalog._products
+        weights, prices, flags = columns['weights'], columns['prices'], columns['sold_by_weight']
+        new_variants = ProductVariants.__new__
+        i = 0
+        for name, count in zip(columns['names'], columns['counts']):
+            variants = new_variants(ProductVariants)
+            variants.weights = weights[i:i + count].tolist()
+            variants.entries = [CatalogEntry(name, weights[j], prices[j], bool(flags[j]))
+                                for j in range(i, i + count)]
+            products[name] = variants
+            i += count
+        catalog._size = i
+        return catalog
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, name):
+        return name in self._products
+
+    def products(self):
+        """
+        Returns: the product names.
+        """
+        return self._products.keys()
+
+    def variants(self, name):
+        """
+        Returns: ProductVariants of a product, or None if it is not listed.
+        """
+        return self._products.get(name)
+
+    def nearest(self, name, weight):
+        """
+        nearest looks up the variant of `name` closest to `weight` grams.
+
+        Returns: CatalogEntry, or None if the product is not listed.
+        """
+        variants = self._products.get(name)
+        if variants is None:
+            return None
+        return variants.nearest(weight)
+
+
+def _open_xml(xml_file):
+    """
+    _open_xml opens the file positioned at its first '<', skipping notes
+    written above the XML declaration such as the header of items.xml.
+    """
+    f = open(xml_file, 'rb')
+    offset = 0
+    while True:
+        chunk = f.read(4096)
+        if not chunk:
+            break
+        start = chunk.find(b'<')
+        if start >= 0:
+            offset += start
+            break
+        offset += len(chunk)
+    f.seek(offset)
+    return f
+
+
+def iter_entries(xml_file):
+    """
+    iter_entries streams the <item> elements of items.xml as CatalogEntry
+    records, freeing each element once it has been read.
+
+    Raises:
+        ET.ParseError, OSError, ValueError: if the file cannot be read.
+    """
+    with _open_xml(xml_file) as f:
+        root = None
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == 'item':
+                yield _entry_from_attrib(elem.attrib)
+                root.clear()
+
+
+def _entry_from_attrib(attrib):
+    return CatalogEntry(
+        attrib['name'],
+        int(attrib['weight']),
+        float(attrib['price']),
+        attrib.get('sold_by_weight', 'false').lower() == 'true',
+    )
+
+
+def _source_key(xml_file, with_hash):
+    st = os.stat(xml_file)
+    key = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(xml_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        key['sha256'] = digest.hexdigest()
+    return key
+
+
+def _write_snapshot(path, source, catalog):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump({'version': SNAPSHOT_VERSION, 'source': source,
+                     'columns': catalog.to_columns()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)  # readers never see a half written snapshot
+
+
+def load_catalog_snapshot(xml_file, snapshot_file=None):
+    """
+    load_catalog_snapshot returns the catalog for `xml_file`, from its
+    snapshot when the snapshot matches the file and by parsing otherwise
+    (refreshing the snapshot).
+
+    The snapshot is trusted when mtime and size match; if only the mtime
+    changed (e.g. the file was copied) the SHA-256 decides.
+
+    Raises:
+        ET.ParseError, OSError, ValueError: if the XML has to be parsed and cannot be.
+
+    Returns: (PriceCatalog, bool True if it came from the snapshot)
+    """
+    snapshot_file = snapshot_file or xml_file + SNAPSHOT_SUFFIX
+    source = _source_key(xml_file, with_hash=False)
+    snapshot = None
+    try:
+        with open(snapshot_file, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            snapshot = None
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable catalog snapshot {snapshot_file}: {e}")
+
+    if snapshot is not None:
+        cached = snapshot['source']
+        if cached['mtime_ns'] == source['mtime_ns'] and cached['size'] == source['size']:
+            catalog = PriceCatalog.from_columns(snapshot['columns'])
+            catalog.source = cached
+            return catalog, True
+        source = _source_key(xml_file, with_hash=True)
+        if cached.get('sha256') == source['sha256']:
+            catalog = PriceCatalog.from_columns(snapshot['columns'])
+            catalog.source = source
+            _try_write_snapshot(snapshot_file, source, catalog)
+            return catalog, True
+
+    if 'sha256' not in source:
+        source = _source_key(xml_file, with_hash=True)
+    catalog = PriceCatalog.from_xml(xml_file)
+    catalog.source = source
+    _try_write_snapshot(snapshot_file, source, catalog)
+    return catalog, False
+
+
+def _try_write_snapshot(path, source, catalog):
+    try:
+        _write_snapshot(path, source, catalog)
+    except OSError as e:
+        logging.warning(f"Cannot write catalog snapshot {path}: {e}")
+
+
+def load_catalog(xml_file, use_snapshot=True):
+    """
+    load_catalog reads items.xml into a PriceCatalog, logging instead of
+    raising on errors like load_prices_from_xml always did.
+
+    Args:
+        xml_file(str): path of items.xml.
+        use_snapshot(bool): Optional, by default True. Use and refresh the
+            binary snapshot next to the XML.
+
+    Returns: PriceCatalog, empty if the file could not be read.
+    """
+    try:
+        if use_snapshot:
+            catalog, warm = load_catalog_snapshot(xml_file)
+        else:
+            catalog, warm = PriceCatalog.from_xml(xml_file), False
+        logging.info(f"Loaded {len(catalog)} prices for {len(catalog.products())} products"
+                     + (" from snapshot" if warm else ""))
+        return catalog
+    except Exception as e:
+        logging.error(f"Error reading XML file: {e}")
+        return PriceCatalog()
+
+
+class CatalogService:
+    """
+    CatalogService owns the price catalog of a running checkout. A
+    background thread polls the mtime and size of items.xml, rebuilds the
+    catalog off the checkout thread when they change, and swaps it in with
+    a single reference assignment. Readers take current() once per receipt,
+    so a receipt is always priced against one catalog version, which is
+    increased on every swap.
+
+    If a rebuild fails (e.g. the file is being written) the current
+    catalog stays in place and the rebuild is retried on the next change.
+    """
+
+    def __init__(self, xml_file, poll_interval=2.0, on_reload=None, use_snapshot=True):
+        """
+        Args:
+            xml_file(str): path of items.xml.
+            poll_interval(float): seconds between checks of the file.
+            on_reload(callable): Optional. Called with the new catalog after a swap.
+            use_snapshot(bool): Optional, by default True. Load through the
+                binary snapshot next to the XML.
+        """
+        self.xml_file = xml_file
+        self._poll_interval = poll_interval
+        self._on_reload = on_reload
+        self._use_snapshot = use_snapshot
+        self._catalog = PriceCatalog()
+        self._seen = None  # (mtime_ns, size) of the last file looked at
+        self._lock = threading.Lock()  # serialises rebuilds, readers never take it
+        self._stop = threading.Event()
+        self._thread = None
+        self.reloads = 0
+        self.errors = 0
+
+    def start(self):
+        """
+        start loads the catalog, then watches the file in the background.
+        """
+        self.reload()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='catalog-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def current(self):
+        """
+        Returns: the PriceCatalog in use; its `version` identifies it.
+        """
+        return self._catalog
+
+    @property
+    def version(self):
+        return self._catalog.version
+
+    def _stat(self):
+        try:
+            st = os.stat(self.xml_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload(self, force=False):
+        """
+        reload rebuilds the catalog if items.xml changed since the last
+        look, or unconditionally with `force`.
+
+        Returns: bool True if a new catalog was swapped in.
+        """
+        with self._lock:
+            seen = self._stat()
+            if seen is None:
+                if self._seen is not None or not self._catalog.version:
+                    logging.error(f"Catalog {self.xml_file} not found, keeping version "
+                                  f"{self._catalog.version}")
+                self._seen = None
+                return False
+            if seen == self._seen and not force:
+                return False
+            self._seen = seen
+            try:
+                if self._use_snapshot:
+                    catalog, _ = load_catalog_snapshot(self.xml_file)
+                else:
+                    catalog = PriceCatalog.from_xml(self.xml_file)
+                    catalog.source = _source_key(self.xml_file, with_hash=True)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Error reading XML file: {e}; keeping catalog version "
+                              f"{self._catalog.version}")
+                return False
+            old = self._catalog
+            if old.source and catalog.source and old.source.get('sha256') == catalog.source.get('sha256'):
+                return False  # touched, not changed
+            catalog.version = old.version + 1
+            self._catalog = catalog
+            self.reloads += 1
+        logging.info(f"Catalog version {catalog.version}: {len(catalog)} prices for "
+                     f"{len(catalog.products())} products")
+        if self._on_reload:
+            try:
+                self._on_reload(catalog)
+            except Exception:
+                logging.exception("Catalog reload listener failed")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self._poll_interval):
+            self.reload()
@@ -0,0 +1,561 @@
+"""
+Detector backends for the checkout camera.
+
+Every backend is a callable taking a BGR frame and returning a Detections
+object, so final.py does not care which runtime is underneath. Backends
+also have infer_batch(frames), which runs several frames (e.g. one per
+checkout lane) through the model in one forward pass where the runtime
+and the exported model allow it:
+
+    'openvino'     native OpenVINO runtime on an exported *_openvino_model dir
+    'onnxruntime'  ONNX Runtime CPU session on an exported .onnx file
+    'ultralytics'  the full ultralytics/torch stack (any format it accepts)
+    'trace'        simulated detections replayed from a hardware trace CSV
+
+The OpenVINO and ONNX Runtime paths only need numpy and cv2: letterboxing,
+YOLOv8 output decoding and NMS are done here instead of in ultralytics.
+cv2 is imported where frames are resized or drawn, so Detections and the
+voting over them work without OpenCV.
+"""
+import ast
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import yaml
+
+MAX_WH = 7680  # box offset per class so a single NMS pass stays class-aware
+
+
+def load_metadata(path):
+    """
+    load_metadata reads the metadata.yaml written by the ultralytics exporter.
+
+    Args:
+        path(str): the metadata.yaml file or the directory holding it.
+
+    Returns: dict with 'names' ({int: str}), 'stride' (int) and 'imgsz' ([h, w]).
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'metadata.yaml')
+    with open(path) as f:
+        metadata = yaml.safe_load(f)
+    return _normalize_metadata(metadata)
+
+
+def _normalize_metadata(metadata):
+    names = metadata.get('names', {})
+    if isinstance(names, str):
+        names = ast.literal_eval(names)
+    if isinstance(names, list):
+        names = dict(enumerate(names))
+    imgsz = metadata.get('imgsz', [640, 640])
+    if isinstance(imgsz, str):
+        imgsz = ast.literal_eval(imgsz)
+    if isinstance(imgsz, int):
+        imgsz = [imgsz, imgsz]
+    return {
+        'names': {int(k): v for k, v in names.items()},
+        'stride': int(metadata.get('stride', 32)),
+        'imgsz': [int(x) for x in imgsz],
+    }
+
+
+def letterbox(image, new_shape=(640, 640), color=(114, 114, 114)):
+    """
+    letterbox resizes `image` to fit `new_shape` keeping its aspect ratio
+    and pads the remainder, the same way ultralytics does for export.
+
+    Args:
+        image(numpy.ndarray): HxWx3 BGR image.
+        new_shape((int, int)): target (height, width).
+        color((int, int, int)): padding colour.
+
+    Returns: (padded image, scale ratio, (pad_x, pad_y))
+    """
+    import cv2
+
+    h, w = image.shape[:2]
+    ratio = min(new_shape[0] / h, new_shape[1] / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_x = (new_shape[1] - new_w) / 2
+    pad_y = (new_shape[0] - new_h) / 2
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right,
+                               cv2.BORDER_CONSTANT, value=color)
+    return image, ratio, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    nms is a plain greedy non-maximum suppression.
+
+    Args:
+        boxes(numpy.ndarray): Nx4 xyxy boxes.
+        scores(numpy.ndarray): N scores.
+        iou_threshold(float): boxes overlapping a kept box above this are dropped.
+
+    Returns: numpy.ndarray indices of the kept boxes, best first.
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode_yolov8(output, conf_threshold=0.25, iou_threshold=0.7, max_det=300):
+    """
+    decode_yolov8 turns the raw (1, 4 + num_classes, anchors) YOLOv8 head
+    output into boxes in network input coordinates.
+
+    Returns: (Nx4 xyxy boxes, N scores, N class ids)
+    """
+    pred = output[0]
+    if pred.shape[0] > pred.shape[1]:  # (anchors, 4 + nc) layout
+        pred = pred.T
+    class_scores = pred[4:]
+    class_ids = class_scores.argmax(axis=0)
+    scores = class_scores[class_ids, np.arange(class_scores.shape[1])]
+    mask = scores > conf_threshold
+    if not mask.any():
+        return (np.zeros((0, 4), np.float32), np.zeros(0, np.float32),
+                np.zeros(0, np.int64))
+    cx, cy, w, h = pred[:4, mask]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    scores = scores[mask]
+    class_ids = class_ids[mask]
+    keep = nms(boxes + class_ids[:, None] * MAX_WH, scores, iou_threshold)[:max_det]
+    return boxes[keep], scores[keep], class_ids[keep]
+
+
+class Detections:
+    """
+    Detections holds the boxes found in one frame, in frame pixel coordinates.
+    """
+
+    def __init__(self, xyxy, conf, cls, names, orig_img=None, roi=None):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.names = names
+        self.orig_img = orig_img
+        self.roi = roi
+
+    def __len__(self):
+        return len(self.cls)
+
+    def class_names(self):
+        """
+        Returns: list of class names, one per box.
+        """
+        return [self.names[int(c)] for c in self.cls]
+
+    def plot(self, img=None):
+        """
+        plot draws the boxes and labels on a copy of the original frame,
+        or on `img` in place if given.
+
+        Returns: numpy.ndarray annotated BGR image.
+        """
+        import cv2
+
+        if img is None:
+            img = self.orig_img.copy()
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            cv2.rectangle(img, (x, y), (x + w, y + h), (255, 255, 255), 1)
+        for (x1, y1, x2, y2), conf, cls in zip(self.xyxy.astype(int), self.conf, self.cls):
+            color = _color(int(cls))
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+            label = f"{self.names[int(cls)]} {conf:.2f}"
+            cv2.putText(img, label, (x1, max(y1 - 5, 10)), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5, color, 1, cv2.LINE_AA)
+        return img
+
+
+def _color(class_id):
+    # deterministic, well spread BGR colour per class
+    return ((37 * class_id + 50) % 256, (17 * class_id + 150) % 256, (29 * class_id + 100) % 256)
+
+
+class _NumpyDetector:
+    """
+    Shared letterbox -> runtime -> decode -> rescale path for the native backends.
+    Subclasses implement _infer(blob) returning the raw head output.
+    """
+
+    def __init__(self, metadata, conf_threshold=0.25, iou_threshold=0.7):
+        self.names = metadata['names']
+        self.stride = metadata['stride']
+        self.imgsz = metadata['imgsz']
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.dynamic_batch = False  # True if the model takes batches of any size
+        self._lock = threading.Lock()  # one inference request, shared by the pipeline and the cart
+
+    def preprocess(self, frame):
+        """
+        Returns: (1x3xHxW float32 RGB blob in 0..1, ratio, (pad_x, pad_y))
+        """
+        import cv2
+
+        padded, ratio, pad = letterbox(frame, self.imgsz)
+        blob = cv2.dnn.blobFromImage(padded, scalefactor=1 / 255.0, swapRB=True)
+        return blob, ratio, pad
+
+    def postprocess(self, output, frame, ratio, pad):
+        boxes, scores, class_ids = decode_yolov8(
+            output, self.conf_threshold, self.iou_threshold)
+        boxes[:, [0, 2]] -= pad[0]
+        boxes[:, [1, 3]] -= pad[1]
+        boxes /= ratio
+        h, w = frame.shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        return Detections(boxes, scores, class_ids, self.names, frame)
+
+    def __call__(self, frame):
+        blob, ratio, pad = self.preprocess(frame)
+        with self._lock:
+            return self.postprocess(self._infer(blob), frame, ratio, pad)
+
+    def infer_batch(self, frames):
+        """
+        infer_batch runs `frames` through the model as one Nx3xHxW batch.
+
+        Returns: list of Detections, one per frame.
+        """
+        prepared = [self.preprocess(frame) for frame in frames]
+        with self._lock:
+            outputs = self._infer_batch(np.concatenate([blob for blob, _, _ in prepared]))
+            return [self.postprocess(outputs[i:i + 1], frame, ratio, pad)
+                    for i, (frame, (_, ratio, pad)) in enumerate(zip(frames, prepared))]
+
+    def _infer(self, blob):
+        raise NotImplementedError
+
+    def _infer_batch(self, blob):
+        if self.dynamic_batch:
+            return self._infer(blob)
+        # the model was exported with a fixed batch of 1; copy, as the
+        # runtime may reuse its output buffer on the next call
+        return np.concatenate([np.array(self._infer(blob[i:i + 1])) for i in range(len(blob))])
+
+
+class OpenVINODetector(_NumpyDetector):
+    """
+    OpenVINODetector runs an exported *_openvino_model directory
+    (model .xml/.bin + metadata.yaml) on the OpenVINO CPU plugin.
+
+    With dynamic_batch=True the input is reshaped to a dynamic batch size
+    before compiling, so infer_batch() is a single inference even on a
+    model exported with batch 1.
+    """
+
+    def __init__(self, model_dir, device='CPU', num_threads=None, dynamic_batch=False, **kwargs):
+        import openvino as ov
+
+        xml_files = [f for f in os.listdir(model_dir) if f.endswith('.xml')]
+        if not xml_files:
+            raise FileNotFoundError(f"No OpenVINO .xml model in {model_dir}")
+        super().__init__(load_metadata(model_dir), **kwargs)
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if num_threads:
+            config['INFERENCE_NUM_THREADS'] = num_threads
+        core = ov.Core()
+        model = core.read_model(os.path.join(model_dir, xml_files[0]))
+        if dynamic_batch:
+            model.reshape({model.input(0).get_any_name(): ov.PartialShape([-1, 3] + self.imgsz)})
+        compiled = core.compile_model(model, device, config)
+        self.dynamic_batch = compiled.input(0).get_partial_shape()[0].is_dynamic
+        self._request = compiled.create_infer_request()
+        logging.info(f"Loaded OpenVINO model {xml_files[0]} on {device}"
+                     + (" with dynamic batch" if self.dynamic_batch else ""))
+
+    def _infer(self, blob):
+        self._request.infer({0: blob})
+        return self._request.get_output_tensor(0).data
+
+
+class OnnxRuntimeDetector(_NumpyDetector):
+    """
+    OnnxRuntimeDetector runs an exported .onnx model with the ONNX Runtime
+    CPU execution provider. Class names come from the metadata ultralytics
+    embeds in the model, or from a metadata.yaml next to it.
+    """
+
+    def __init__(self, model_path, num_threads=None, dynamic_batch=False, **kwargs):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self._session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'])
+        self._input_name = self._session.get_inputs()[0].name
+
+        sidecar = os.path.join(os.path.dirname(model_path), 'metadata.yaml')
+        if os.path.exists(sidecar):
+            metadata = load_metadata(sidecar)
+        else:
+            metadata = _normalize_metadata(
+                self._session.get_modelmeta().custom_metadata_map)
+        super().__init__(metadata, **kwargs)
+        # the batch size is fixed at export: with export_models.py --dynamic
+        # the batch dimension is symbolic, `dynamic_batch` cannot change it here
+        self.dynamic_batch = not isinstance(self._session.get_inputs()[0].shape[0], int)
+        logging.info(f"Loaded ONNX model {model_path} with ONNX Runtime")
+
+    def _infer(self, blob):
+        return self._session.run(None, {self._input_name: blob})[0]
+
+
+class UltralyticsDetector:
+    """
+    UltralyticsDetector wraps ultralytics.YOLO so its results come back as
+    Detections like the native backends.
+    """
+
+    def __init__(self, model_path, conf_threshold=0.25, iou_threshold=0.7, imgsz=None,
+                 dynamic_batch=False, **kwargs):
+        from ultralytics import YOLO
+
+        self._model = YOLO(model_path, task='detect')
+        self.names = self._model.names
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.imgsz = imgsz
+        self.dynamic_batch = True  # ultralytics batches lists of frames itself
+        self._lock = threading.Lock()
+
+    def __call__(self, frame):
+        return self.infer_batch([frame])[0]
+
+    def infer_batch(self, frames):
+        extra = {'imgsz': self.imgsz} if self.imgsz else {}
+        with self._lock:
+            results = self._model(list(frames), conf=self.conf_threshold, iou=self.iou_threshold,
+                                  verbose=False, **extra)
+        return [Detections(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy(),
+                           r.boxes.cls.cpu().numpy().astype(np.int64), self.names, frame)
+                for r, frame in zip(results, frames)]
+
+
+class TraceDetector:
+    """
+    TraceDetector is the simulated backend: it reports the product that
+    the trace (see hardware.Trace) has on the tray at the current simulation
+    time as one centred box, after sleeping `latency` seconds to cost about
+    as much wall time as a real inference.
+    """
+
+    def __init__(self, trace_path, latency=0.15, conf_threshold=0.25, **kwargs):
+        import hardware
+
+        self._clock = hardware.sim_clock
+        self._trace = hardware.Trace.load(trace_path)
+        self._latency = latency
+        self.names = dict(enumerate(self._trace.labels()))
+        self._ids = {name: i for i, name in self.names.items()}
+
+    def __call__(self, frame):
+        time.sleep(self._latency)
+        _, label = self._trace.at(self._clock())
+        if not label:
+            return Detections(np.zeros((0, 4), np.float32), np.zeros(0, np.float32),
+                              np.zeros(0, np.int64), self.names, frame)
+        h, w = frame.shape[:2]
+        box = np.array([[w * 0.3, h * 0.3, w * 0.7, h * 0.7]], np.float32)
+        return Detections(box, np.array([0.9], np.float32),
+                          np.array([self._ids[label]], np.int64), self.names, frame)
+
+
+class RoiDetector:
+    """
+    RoiDetector runs a detector on a fixed region of interest (the weighing
+    tray) instead of the whole camera frame and maps the boxes back to full
+    frame coordinates for display.
+    """
+
+    def __init__(self, detector, roi):
+        """
+        Args:
+            detector(callable): any backend from this module.
+            roi((int, int, int, int)): x, y, width, height in frame pixels.
+        """
+        self._detector = detector
+        self.roi = tuple(int(v) for v in roi)
+        self.names = detector.names
+        self.dynamic_batch = getattr(detector, 'dynamic_batch', False)
+
+    def crop(self, frame):
+        x, y, w, h = self.roi
+        return frame[y:y + h, x:x + w]
+
+    def __call__(self, frame):
+        return self._to_frame(self._detector(self.crop(frame)), frame)
+
+    def infer_batch(self, frames):
+        crops = [self.crop(frame) for frame in frames]
+        return [self._to_frame(detections, frame)
+                for detections, frame in zip(infer_batch(self._detector, crops), frames)]
+
+    def _to_frame(self, detections, frame):
+        x, y = self.roi[:2]
+        xyxy = detections.xyxy + np.array([x, y, x, y], dtype=detections.xyxy.dtype)
+        return Detections(xyxy, detections.conf, detections.cls, self.names, frame, self.roi)
+
+
+def infer_batch(detector, frames):
+    """
+    infer_batch runs several frames through `detector`, batched if the
+    backend supports it and one by one otherwise.
+
+    Returns: list of Detections, one per frame.
+    """
+    batched = getattr(detector, 'infer_batch', None)
+    if batched is not None:
+        return batched(frames)
+    return [detector(frame) for frame in frames]
+
+
+class VotedDetections(Detections):
+    """
+    VotedDetections are the detections that survived temporal voting over
+    several frames of the same tray (see vote_detections). The boxes are
+    those of the newest frame each accepted class was seen in.
+
+    votes(dict): class name -> (frames it was detected in, mean confidence
+        over all frames, counting a miss as 0), for every class seen.
+    frames(int): number of frames voted over.
+    """
+
+    def __init__(self, xyxy, conf, cls, names, orig_img, roi, votes, frames):
+        super().__init__(xyxy, conf, cls, names, orig_img, roi)
+        self.votes = votes
+        self.frames = frames
+
+
+def vote_detections(results, min_ratio=0.5, min_confidence=0.0):
+    """
+    vote_detections combines the detections of consecutive frames of the
+    same scene: a class is kept if it was detected in at least `min_ratio`
+    of the frames and its confidence, averaged over all frames, reaches
+    `min_confidence`. A one-frame miss or a one-frame false positive does
+    not change the outcome.
+
+    Args:
+        results([Detections]): one per frame, oldest first.
+        min_ratio(float): share of the frames a class must be detected in.
+        min_confidence(float): min mean confidence of a kept class.
+
+    Raises:
+        ValueError: if results is empty
+
+    Returns: VotedDetections on the newest frame
+    """
+    if not results:
+        raise ValueError('Parameter "results" has to hold at least one Detections.')
+    frames = len(results)
+    seen = {}  # class id -> [frames, confidence sum, newest frame index]
+    for i, detections in enumerate(results):
+        best = {}
+        for class_id, conf in zip(detections.cls, detections.conf):
+            best[int(class_id)] = max(best.get(int(class_id), 0.0), float(conf))
+        for class_id, conf in best.items():
+            entry = seen.setdefault(class_id, [0, 0.0, i])
+            entry[0] += 1
+            entry[1] += conf
+            entry[2] = i
+
+    newest = results[-1]
+    names = newest.names
+    xyxy, conf, cls = [], [], []
+    for class_id, (count, conf_sum, last) in seen.items():
+        if count < min_ratio * frames or conf_sum / frames < min_confidence:
+            continue
+        source = results[last]
+        mask = source.cls == class_id
+        xyxy.append(source.xyxy[mask])
+        conf.append(source.conf[mask])
+        cls.append(source.cls[mask])
+    votes = {names[class_id]: (count, conf_sum / frames) for class_id, (count, conf_sum, _) in seen.items()}
+    if xyxy:
+        xyxy, conf, cls = np.concatenate(xyxy), np.concatenate(conf), np.concatenate(cls)
+    else:
+        xyxy, conf, cls = np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+    return VotedDetections(xyxy, conf, cls, names, newest.orig_img, newest.roi, votes, frames)
+
+
+def detect_voted(detector, frames, min_ratio=0.5, min_confidence=0.0):
+    """
+    detect_voted runs `frames` through `detector` in one batch and votes
+    over the results, so several frames cost about one batched inference
+    instead of one inference each.
+
+    Args:
+        detector(callable): any backend from this module.
+        frames([numpy.ndarray]): consecutive BGR frames, oldest first.
+        min_ratio(float): see vote_detections.
+        min_confidence(float): see vote_detections.
+
+    Returns: VotedDetections
+    """
+    return vote_detections(infer_batch(detector, frames), min_ratio, min_confidence)
+
+
+BACKENDS = {
+    'openvino': OpenVINODetector,
+    'onnxruntime': OnnxRuntimeDetector,
+    'ultralytics': UltralyticsDetector,
+    'trace': TraceDetector,
+}
+
+
+def load_detector(backend, model_path, roi=None, **kwargs):
+    """
+    load_detector builds the detector for a backend name.
+
+    The input resolution of the native backends is the `imgsz` the model was
+    exported with (see export_models.py); point `model_path` at e.g. a 320
+    export to infer on fewer pixels.
+
+    Args:
+        backend(str): one of 'openvino', 'onnxruntime', 'ultralytics', 'trace'.
+        model_path(str): model directory (openvino) or file (trace CSV for 'trace').
+        roi((int, int, int, int)): Optional. x, y, width, height of the
+            region to run detection on. None uses the whole frame.
+        kwargs: passed to the backend, e.g. conf_threshold, num_threads,
+            dynamic_batch (a warning is logged if the model cannot batch).
+
+    Raises:
+        ValueError: if backend is unknown
+
+    Returns: detector callable
+    """
+    if backend not in BACKENDS:
+        raise ValueError('Parameter "backend" has to be one of {}. '
+                         'Received: {}'.format(sorted(BACKENDS), backend))
+    detector = BACKENDS[backend](model_path, **kwargs)
+    if kwargs.get('dynamic_batch') and not getattr(detector, 'dynamic_batch', False):
+        logging.warning(f"The {backend} model has a fixed batch size: infer_batch() runs one inference "
+                        f"per frame. Export it with export_models.py --dynamic to batch.")
+    if roi is not None:
+        detector = RoiDetector(detector, roi)
+    return detector
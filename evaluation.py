@@ -0,0 +1,201 @@
+"""
+Accuracy and latency evaluation of a detector on a folder of images.
+
+Images are read from a flat folder the same way Yolo_Inference.py iterates
+over its test images. Ground truth is optional and uses the YOLO label
+format (`class cx cy w h`, normalised), looked up as `<stem>.txt` next to
+the image or in a sibling `labels/` folder.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def list_images(folder):
+    """
+    Returns: sorted list of image paths in `folder`.
+    """
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def label_path(image_path):
+    """
+    Returns: path of the YOLO label file for an image, or None if there is none.
+    """
+    folder, name = os.path.split(image_path)
+    stem = os.path.splitext(name)[0] + '.txt'
+    for candidate in (os.path.join(folder, stem),
+                      os.path.join(os.path.dirname(folder), 'labels', stem)):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def load_labels(path, width, height):
+    """
+    load_labels reads a YOLO label file into pixel xyxy boxes.
+
+    Returns: (Nx4 float boxes, N int class ids)
+    """
+    data = np.loadtxt(path, ndmin=2) if os.path.getsize(path) else np.zeros((0, 5))
+    cls = data[:, 0].astype(np.int64)
+    cx, cy, w, h = data[:, 1] * width, data[:, 2] * height, data[:, 3] * width, data[:, 4] * height
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    return boxes, cls
+
+
+def box_iou(a, b):
+    """
+    Returns: NxM IoU matrix between xyxy boxes `a` (N) and `b` (M).
+    """
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(br - tl, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls):
+    """
+    match_predictions marks each prediction as a true positive at every IoU
+    threshold in IOU_THRESHOLDS, matching each ground truth box at most once.
+
+    Returns: NxT bool array
+    """
+    tp = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return tp
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_cls[:, None] == pred_cls[None, :])
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if not len(gt_idx):
+            continue
+        order = iou[gt_idx, pred_idx].argsort()[::-1]
+        gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+        _, first = np.unique(pred_idx, return_index=True)
+        gt_idx, pred_idx = gt_idx[first], pred_idx[first]
+        _, first = np.unique(gt_idx, return_index=True)
+        tp[pred_idx[first], t] = True
+    return tp
+
+
+def average_precision(tp, conf, n_gt):
+    """
+    average_precision computes COCO-style 101-point AP for one class.
+
+    Args:
+        tp(numpy.ndarray): NxT true-positive flags of the class predictions.
+        conf(numpy.ndarray): N confidences.
+        n_gt(int): number of ground truth boxes of the class.
+
+    Returns: numpy.ndarray T APs, one per IoU threshold.
+    """
+    if n_gt == 0 or not len(tp):
+        return np.zeros(tp.shape[1])
+    order = conf.argsort()[::-1]
+    tpc = tp[order].cumsum(axis=0)
+    fpc = (~tp[order]).cumsum(axis=0)
+    recall = tpc / n_gt
+    precision = tpc / (tpc + fpc)
+    x = np.linspace(0, 1, 101)
+    ap = np.zeros(tp.shape[1])
+    for t in range(tp.shape[1]):
+        # precision envelope sampled at the first recall >= x, as pycocotools does
+        envelope = np.flip(np.maximum.accumulate(np.flip(precision[:, t])))
+        idx = np.searchsorted(recall[:, t], x, side='left')
+        sampled = np.where(idx < len(envelope), envelope[np.minimum(idx, len(envelope) - 1)], 0.0)
+        ap[t] = sampled.mean()
+    return ap
+
+
+def rss_mb():
+    """
+    Returns: float resident set size of this process in MB (Linux only).
+    """
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+def peak_rss_mb():
+    """
+    Returns: float peak resident set size of this process in MB.
+    """
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def evaluate(detector, images, warmup=3):
+    """
+    evaluate runs `detector` over `images` and collects latency and, for
+    images that have labels, per-class AP.
+
+    Args:
+        detector(callable): returns a detector.Detections for a BGR frame.
+        images([str]): image paths.
+        warmup(int): untimed runs on the first image.
+
+    Returns: dict with latency ('mean_ms', 'p50_ms', 'p95_ms'), 'rss_mb',
+        'peak_rss_mb' and, if labels were found, 'map50', 'map50_95' and
+        'per_class' ({name: {'ap50', 'ap50_95', 'instances'}}).
+    """
+    if images and warmup:
+        first = cv2.imread(images[0])
+        for _ in range(warmup):
+            detector(first)
+
+    latencies = []
+    stats = []  # (tp, conf, pred_cls) per labelled image
+    gt_classes = []
+    for path in images:
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        start = time.perf_counter()
+        detections = detector(frame)
+        latencies.append(time.perf_counter() - start)
+
+        labels = label_path(path)
+        if labels is None:
+            continue
+        gt_boxes, gt_cls = load_labels(labels, frame.shape[1], frame.shape[0])
+        tp = match_predictions(detections.xyxy, detections.cls, gt_boxes, gt_cls)
+        stats.append((tp, detections.conf, detections.cls))
+        gt_classes.append(gt_cls)
+
+    latencies = np.asarray(latencies) * 1000.0
+    report = {
+        'images': int(len(latencies)),
+        'mean_ms': float(latencies.mean()) if len(latencies) else None,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else None,
+        'rss_mb': rss_mb(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if not stats:
+        return report
+
+    tp = np.concatenate([s[0] for s in stats])
+    conf = np.concatenate([s[1] for s in stats])
+    pred_cls = np.concatenate([s[2] for s in stats])
+    gt_cls = np.concatenate(gt_classes)
+    per_class = {}
+    for class_id in np.unique(gt_cls):
+        mask = pred_cls == class_id
+        ap = average_precision(tp[mask], conf[mask], int((gt_cls == class_id).sum()))
+        per_class[detector.names[int(class_id)]] = {
+            'ap50': float(ap[0]),
+            'ap50_95': float(ap.mean()),
+            'instances': int((gt_cls == class_id).sum()),
+        }
+    report['per_class'] = per_class
+    report['map50'] = float(np.mean([c['ap50'] for c in per_class.values()]))
+    report['map50_95'] = float(np.mean([c['ap50_95'] for c in per_class.values()]))
+    return report
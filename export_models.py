@@ -0,0 +1,77 @@
+"""
+Re-export the trained checkout detector at smaller input resolutions.
+
+Runs on a development machine with ultralytics installed (not on the till):
+
+    python3 export_models.py --weights best.pt --imgsz 320 416
+    python3 export_models.py --weights best.pt --imgsz 320 --format onnx
+    python3 export_models.py --weights best.pt --imgsz 320 --format onnx --dynamic
+
+--dynamic exports a dynamic batch size, so the checkout server
+(lane_server.py) can run the frames of all lanes in one forward pass.
+
+Each export lands in models/ as best_<imgsz>_openvino_model/ or
+best_<imgsz>.onnx, ready to be used as MODEL_PATH in final.py.
+"""
+import argparse
+import logging
+import os
+import shutil
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+
+def export(weights, imgsz, fmt='openvino', output_dir=MODELS_DIR, dynamic=False):
+    """
+    export writes one model for one input size.
+
+    Args:
+        weights(str): trained .pt weights.
+        imgsz(int): square input size, a multiple of the model stride (32).
+        fmt(str): 'openvino' or 'onnx'.
+        output_dir(str): where the export is moved to.
+        dynamic(bool): Optional, by default False. Export a dynamic batch size.
+
+    Raises:
+        ValueError: if imgsz is not a multiple of 32
+
+    Returns: str path of the exported model
+    """
+    from ultralytics import YOLO
+
+    if imgsz % 32:
+        raise ValueError('imgsz has to be a multiple of 32. '
+                         'Received: {}'.format(imgsz))
+    exported = YOLO(weights, task='detect').export(format=fmt, imgsz=imgsz, simplify=True,
+                                                   dynamic=dynamic)
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    if fmt == 'openvino':
+        target = os.path.join(output_dir, f"{stem}_{imgsz}_openvino_model")
+    else:
+        target = os.path.join(output_dir, f"{stem}_{imgsz}.onnx")
+    if os.path.exists(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        else:
+            os.remove(target)
+    shutil.move(exported, target)
+    logging.info(f"Exported {weights} at {imgsz}x{imgsz} to {target}")
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--weights', required=True, help='trained .pt weights')
+    parser.add_argument('--imgsz', type=int, nargs='+', default=[320, 416])
+    parser.add_argument('--format', choices=['openvino', 'onnx'], default='openvino')
+    parser.add_argument('--output', default=MODELS_DIR)
+    parser.add_argument('--dynamic', action='store_true', help='export a dynamic batch size')
+    args = parser.parse_args()
+    for imgsz in args.imgsz:
+        export(args.weights, imgsz, args.format, args.output, args.dynamic)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,100 @@
 import time
-import cv2
-from ultralytics import YOLO
 from collections import defaultdict
-import RPi.GPIO as GPIO
+import hardware
+from hardware import GPIO
 from hx711 import HX711
-import xml.etree.ElementTree as ET
+from hx711_sampler import SamplingEngine, BACKENDS as SAMPLER_BACKENDS
+from frame_pipeline import FramePipeline
+from detector import load_detector, detect_voted
+from scale_trigger import LoadChangeTrigger
+from scale_monitor import ScaleMonitor
+from catalog import CatalogService, load_catalog
+from calibration import CalibrationStore, auto_tare
+from zero_tracker import ZeroTracker
+from basket import solve_basket
+from item_tracker import TrayRegistrar
+from weight_index import HistoryRefresher, WeightIndex, load_weight_history
+from cart_channel import CartPublisher, DEFAULT_SOCKET
+import argparse
 import subprocess
 import json
 import logging
 import os
+from datetime import datetime
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load the YOLO model
-MODEL_PATH = '/home/rpi/tflite-custom-object-bookworm-main/best_AR.onnx'  # Replace with your model path
-model = YOLO(MODEL_PATH, task="detect")
-
-def initialize_hx711():
+# Load the detector
+DETECTOR_BACKEND = 'openvino'  # 'openvino', 'onnxruntime' or 'ultralytics'
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'models', 'best_openvino_model')  # Replace with your model path
+DETECTOR_THREADS = 4  # CPU threads for the native backends, None to let the runtime decide
+DETECTION_ROI = None  # (x, y, width, height) of the weighing tray in camera pixels, None for the full frame
+CAMERA_INDEX = 0  # Replace with your camera index if different
+
+# Inference scheduling: 'continuous' runs the detector on every camera frame,
+# 'on_demand' only when the scale settles on a new load or 'r' is pressed, and
+# 'tracking' on every frame, adding and removing items hands-free (see item_tracker.py)
+INFERENCE_MODE = 'on_demand'
+PREVIEW_INTERVAL = 2.0  # seconds between preview inferences in on-demand mode, None to disable
+
+# Adding an item runs the detector over the last VOTE_FRAMES frames in one batch and
+# keeps the classes seen in at least VOTE_MIN_RATIO of them; 1 trusts the newest frame
+VOTE_FRAMES = 5
+VOTE_MIN_RATIO = 0.5
+
+# Basket mode counts every item on the tray and works out the variants from the weight
+# (see basket.py), so several items are scanned at once; False takes one product at a time
+BASKET_MODE = True
+
+# HX711 sampling: 'rpi' bit-bangs with RPi.GPIO, 'pigpio' lets pigpiod generate the clock
+HX711_BACKEND = 'rpi'
+HX711_REALTIME_PRIORITY = 50  # SCHED_FIFO priority of the sampling thread, None to disable
+
+CATALOG_XML = "items.xml"  # Replace with your price list
+CATALOG_POLL_INTERVAL = 2.0  # seconds between checks of the price list for changes
+
+# Scans whose weight does not fit the detected product are flagged (see weight_index.py);
+# the plausible weights are learned from the sales of the last WEIGHT_HISTORY_DAYS days
+WEIGHT_CHECK = True
+TRANSACTIONS_DB = "transactions.db"  # Replace with the transaction store of the payment UI
+WEIGHT_HISTORY_DAYS = 90
+WEIGHT_HISTORY_REFRESH = 3600.0  # seconds between reloads of the sales history
+
+# Calibration is saved here and reused on the next start; run with --recalibrate to redo it
+CALIBRATION_FILE = "calibration.json"
+ZERO_TOLERANCE = 2.0  # grams the empty tray may read before it is re-tared
+AUTO_TARE_MAX = 50.0  # grams above which the tray is taken to be loaded, not drifted
+ZERO_TRACKING = True  # follow the drift of the empty tray in the background
+
+# The payment UI is started once and picks up each receipt as it is handed over
+PAYMENT_UI = ["streamlit", "run", "streamlit_receipt_app.py", "--server.headless", "true"]
+CART_SOCKET = DEFAULT_SOCKET  # Unix socket the receipts are pushed on
+RECEIPT_FILE = "receipt.json"  # used instead where the socket cannot be opened
+
+def initialize_hx711(dout_pin=27, pd_sck_pin=17):  # Replace with your DOUT_PIN / PD_SCK_PIN if different
     GPIO.setwarnings(False)
     GPIO.setmode(GPIO.BCM)
-    dout_pin = 27  # Replace with your DOUT_PIN if different
-    pd_sck_pin = 17  # Replace with your PD_SCK_PIN if different
-    return HX711(dout_pin=dout_pin, pd_sck_pin=pd_sck_pin)
+    hardware.attach_simulated_scale(dout_pin, pd_sck_pin)  # no-op on the Pi
+    hx = HX711(dout_pin=dout_pin, pd_sck_pin=pd_sck_pin)
+    sampler = SamplingEngine(SAMPLER_BACKENDS[HX711_BACKEND](hx),
+                             realtime_priority=HX711_REALTIME_PRIORITY).start()
+    hx.set_sampler(sampler)
+    return hx
+
+def load_model():
+    if hardware.is_simulated() and hardware.SIM_TRACE:
+        # replay the detections that belong to the simulated scale trace
+        return load_detector('trace', hardware.SIM_TRACE)
+    # a dynamic batch lets the VOTE_FRAMES frames of a scan run as one inference
+    return load_detector(DETECTOR_BACKEND, MODEL_PATH, roi=DETECTION_ROI, num_threads=DETECTOR_THREADS,
+                         dynamic_batch=True)
 
 def round_to_nearest_five(x):
     return 5 * round(x / 5)
 
-def calibrate_sensor(hx):
+def calibrate_sensor(hx, store=None):
     try:
         logging.info("Taring the scale (zeroing)...")
         hx.zero()
@@ -41,6 +108,10 @@ def calibrate_sensor(hx):
             ratio = reading / known_weight_grams
             hx.set_scale_ratio(ratio)
             logging.info(f"Calibration successful! Ratio is set to {ratio}")
+            if store is not None:
+                store.record(hx)
+                store.save()
+                logging.info(f"Calibration saved to {store.path}")
             return ratio
         else:
             logging.error("Failed to read mean value. Calibration aborted.")
@@ -50,43 +121,32 @@ def calibrate_sensor(hx):
         return None
 
 def load_prices_from_xml(xml_file):
-    prices = defaultdict(list)
-    try:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        for item in root.findall('item'):
-            name = item.get('name')
-            weight = int(item.get('weight'))
-            price = float(item.get('price'))
-            sold_by_weight = item.get('sold_by_weight', 'false').lower() == 'true'
-            prices[name].append({
-                "weight": weight,
-                "price": price,
-                "sold_by_weight": sold_by_weight
-            })
-        logging.info(f"Loaded prices: {dict(prices)}")
-    except Exception as e:
-        logging.error(f"Error reading XML file: {e}")
-    return prices
+    return load_catalog(xml_file)
+
+def calculate_total_price_with_nearest_weight(object_data, prices, weight_index=None):
+    """
+    calculate_total_price_with_nearest_weight prices the cart, each line
+    with the catalog variant nearest to its weight.
 
-def calculate_total_price_with_nearest_weight(object_data, prices):
+    Args:
+        weight_index(WeightIndex): Optional. Lines whose weight is
+            implausible for their variant get a 'weight_warning'.
+
+    Returns: (float total, list of receipt lines)
+    """
     total_price = 0.0
     receipt = []
-    for object_key, data in object_data.items():
-        object_name, detected_weight = object_key.rsplit('_', 1)
-        detected_weight = int(detected_weight)
+    for (object_name, detected_weight), data in object_data.items():
         matched = False
 
         logging.info(f"Processing {object_name} with detected weight {detected_weight}g")
 
-        if object_name in prices:
-            # Get the list of available weights for the item from the XML
-            weight_price_list = prices[object_name]
-            # Find the price data with the nearest weight
-            nearest_price_data = min(weight_price_list, key=lambda x: abs(x['weight'] - detected_weight))
-            actual_weight = nearest_price_data["weight"]
-            object_price = nearest_price_data["price"]
-            sold_by_weight = nearest_price_data.get('sold_by_weight', False)
+        # Find the catalog variant with the nearest weight
+        nearest_price_data = prices.nearest(object_name, detected_weight)
+        if nearest_price_data is not None:
+            actual_weight = nearest_price_data.weight
+            object_price = nearest_price_data.price
+            sold_by_weight = nearest_price_data.sold_by_weight
 
             if sold_by_weight:
                 # For items sold by weight
@@ -111,10 +171,17 @@ def calculate_total_price_with_nearest_weight(object_data, prices):
                     "count": object_count,
                     "price_per_item": object_price,
                     "total_price": item_total,
-                    "sold_by_weight": False
+                    "sold_by_weight": False,
+                    "weighed": data.get('weighed', True)
                 })
                 logging.info(f"Matched {object_name} to weight {actual_weight}g with price {object_price} Rs")
 
+            if weight_index is not None and not weight_index.plausible(nearest_price_data, detected_weight):
+                low, high = weight_index.band(nearest_price_data)
+                receipt[-1]["weight_warning"] = (f"{detected_weight} g is not a plausible weight for "
+                                                 f"{object_name} ({low:.0f} to {high:.0f} g)")
+                logging.warning(receipt[-1]["weight_warning"])
+
             total_price += item_total
             matched = True
 
@@ -131,100 +198,423 @@ def calculate_total_price_with_nearest_weight(object_data, prices):
 
     return total_price, receipt
 
-def save_receipt_as_json(receipt, total_price):
+def new_session_id():
+    return datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+def publish_cart_line(publisher, session, object_data, unique_key, prices, cart_totals):
+    """
+    publish_cart_line prices one cart entry and pushes it to the payment
+    UI as a delta, so the customer sees the cart grow while scanning.
+
+    Args:
+        cart_totals(dict): line totals by key, updated with this line.
+    """
+    object_name, weight = unique_key
+    line_total, lines = calculate_total_price_with_nearest_weight(
+        {unique_key: object_data[unique_key]}, prices)
+    key = f"{object_name}|{weight}"
+    cart_totals[key] = line_total
+    publisher.publish_delta(session, key, lines[0], sum(cart_totals.values()))
+
+def count_detections(detections):
+    """
+    count_detections turns the detections of the tray into item counts.
+
+    Returns: dict class name -> count, or None if different objects are on the tray.
+    """
+    detection_counts = defaultdict(int)
+    for class_name in detections.class_names():
+        detection_counts[class_name] = 1  # Count all detections of the same class as 1 item
+
+    if len(detection_counts) > 1:
+        logging.warning("Two or more different objects detected. Remove one to add to the cart and continue.")
+        return None
+    return detection_counts
+
+def count_instances(detections):
+    """
+    Returns: dict class name -> number of boxes of that class.
+    """
+    counts = defaultdict(int)
+    for class_name in detections.class_names():
+        counts[class_name] += 1
+    return dict(counts)
+
+def is_basket(instance_counts, prices):
+    """
+    is_basket tells whether the tray holds more than a single item, not
+    counting several pieces of one product sold by weight (e.g. apples).
+    """
+    if len(instance_counts) != 1:
+        return len(instance_counts) > 1
+    name, count = next(iter(instance_counts.items()))
+    variants = prices.variants(name)
+    loose = variants is not None and variants.entries[0].sold_by_weight
+    return count > 1 and not loose
+
+def check_weight(detections, weight, prices, weight_index):
+    """
+    check_weight takes the item on the tray to be the class that passed
+    the vote and whose catalog weight fits the weight on the tray. If
+    several classes passed, the weight settles which one it is, but only
+    if it fits exactly one of them; classes that failed the vote are never
+    considered.
+
+    Args:
+        detections(VotedDetections): from detect_voted().
+        weight(int): weight on the tray in grams, rounded.
+
+    Returns: dict class name -> count to add, or None if the weight does
+        not tell what the item is.
+    """
+    passed = sorted(set(detections.class_names()), key=lambda name: detections.votes[name][1], reverse=True)
+    if not passed:
+        return {}
+    fitting = []
+    for name in passed:
+        entry = prices.nearest(name, weight)
+        # a product missing from the catalog is added and priced as not found, as before
+        if (entry is None and len(passed) == 1) or (entry is not None and weight_index.plausible(entry, weight)):
+            fitting.append(name)
+    if len(fitting) == 1:
+        if len(passed) > 1:
+            logging.warning(f"{weight} g only fits {fitting[0]} of {passed}, taking {fitting[0]}")
+        return {fitting[0]: 1}
+    if len(passed) > 1:
+        logging.warning("Two or more different objects detected. Remove one to add to the cart and continue.")
+    else:
+        logging.warning(f"{weight} g does not fit {passed[0]}. Make sure it is the only item on the tray "
+                        f"and scan again.")
+    return None
+
+def add_basket_to_cart(instance_counts, weight, object_data, publisher, session, prices, cart_totals):
+    """
+    add_basket_to_cart solves which catalog variants the items on the tray
+    are from their total weight, and adds them all to the cart.
+
+    Args:
+        instance_counts(dict): from count_instances().
+        weight(float): settled weight on the tray in grams.
+
+    Returns: basket.BasketSolution, or None if the basket could not be added.
+    """
+    try:
+        solution = solve_basket(instance_counts, weight, prices)
+    except ValueError as e:
+        logging.warning(f"{e} Scan it separately.")
+        return None
+    if solution is None:
+        logging.warning("The weight does not match the items detected. Spread them out and scan again.")
+        return None
+    if solution.ambiguous:
+        logging.warning(f"Cannot tell the variants apart by weight ({solution}). Scan fewer items at once.")
+        return None
+    if solution.recounted:
+        logging.info(f"Counts corrected from the weight: {solution.recounted}")
+    for entry, count in solution.lines:
+        unique_key = (entry.name, entry.weight)
+        object_data[unique_key]['count'] += count
+        object_data[unique_key]['total_weight'] += entry.weight * count
+        object_data[unique_key]['weighed'] = False  # keyed on the catalog weight, not a reading
+        publish_cart_line(publisher, session, object_data, unique_key, prices, cart_totals)
+    logging.info(f"Basket added: {solution}, weight: {weight:.0f} grams")
+    return solution
+
+def add_to_cart(detection_counts, weight, object_data, publisher, session, prices, cart_totals):
+    """
+    add_to_cart adds the detected object to the cart as one item and
+    publishes the changed line.
+
+    Args:
+        detection_counts(dict): from count_detections().
+        weight(int): weight on the tray in grams, rounded.
+        object_data(dict): the cart, (name, weight) -> {'count', 'total_weight'} and
+            'weighed': False if the weight of the key is a catalog weight.
+    """
+    for class_name, count in detection_counts.items():
+        unique_key = (class_name, weight)
+        if object_data[unique_key]['count'] == 0:
+            object_data[unique_key]['count'] = 1  # Consider multiple detections of same class as 1 item
+        object_data[unique_key]['total_weight'] = weight
+        publish_cart_line(publisher, session, object_data, unique_key, prices, cart_totals)
+
+    logging.info(f"Detected objects: {dict(detection_counts)}, weight: {weight} grams")
+
+def tracked_key(track):
+    """
+    Returns: (name, weight) cart key of an item registered by the TrayRegistrar.
+    """
+    if track.entry.sold_by_weight:
+        return track.entry.name, round_to_nearest_five(track.weight)
+    return track.entry.name, track.entry.weight
+
+def add_tracked_item(track, object_data, publisher, session, prices, cart_totals):
+    """
+    add_tracked_item adds one item the TrayRegistrar saw put on the tray.
+    """
+    unique_key = tracked_key(track)
+    object_data[unique_key]['count'] += 1
+    object_data[unique_key]['total_weight'] += track.weight
+    if not track.entry.sold_by_weight:
+        object_data[unique_key]['weighed'] = False  # keyed on the catalog weight, not a reading
+    publish_cart_line(publisher, session, object_data, unique_key, prices, cart_totals)
+    logging.info(f"Item #{track.id} added: {track.name}, {track.weight:.0f} grams")
+
+def remove_from_cart(unique_key, weight, object_data, publisher, session, prices, cart_totals):
+    """
+    remove_from_cart takes one item off the cart and publishes the changed
+    line, or its removal if it was the last one.
+
+    Args:
+        unique_key(tuple): (name, weight) key of the item in object_data.
+        weight(float): grams the item was added with.
+    """
+    data = object_data.get(unique_key)
+    if data is None or data['count'] == 0:
+        return
+    data['count'] -= 1
+    data['total_weight'] -= weight
+    if data['count'] > 0:
+        publish_cart_line(publisher, session, object_data, unique_key, prices, cart_totals)
+        return
+    del object_data[unique_key]
+    key = f"{unique_key[0]}|{unique_key[1]}"
+    cart_totals.pop(key, None)
+    publisher.publish_delta(session, key, None, sum(cart_totals.values()))
+
+def hand_over_receipt(publisher, receipt, total_price, catalog_version=None, session=None):
+    """
+    hand_over_receipt pushes a receipt to the payment UI over the cart
+    channel. The UI reports the session back once it is paid.
+
+    Returns: str session id of the receipt.
+    """
+    session = session or new_session_id()
     receipt_data = {
+        "session": session,
+        "status": "pending",
         "total_price": total_price,
-        "items": receipt
+        "items": receipt,
+        "catalog_version": catalog_version
     }
-    with open("receipt.json", "w") as f:
-        json.dump(receipt_data, f, indent=2)
-    logging.info(f"Receipt saved to receipt.json")
-
-def run_streamlit_app():
-    """Function to run the Streamlit app synchronously."""
-    subprocess.run(["streamlit", "run", "streamlit_receipt_app.py"])
-    # The main program will continue after the Streamlit app is closed
-
-def main():
-    while True:
-        # Step 1: Initialize the weight sensor and calibrate
-        hx = initialize_hx711()
-        logging.info("Calibrating the weight sensor...")
-        ratio = calibrate_sensor(hx)
+    version = publisher.publish(receipt_data)
+    logging.info(f"Receipt {session} handed over (cart version {version})")
+    return session
+
+def on_cart_message(message):
+    if message.get('type') == 'paid':
+        logging.info(f"Receipt {message.get('session')} paid: {message.get('total_price', 0.0):.2f} Rs")
+
+def start_payment_ui():
+    """
+    start_payment_ui launches the Streamlit payment app in the background.
+    It stays up for the life of the checkout and shows each receipt that
+    is handed over.
+
+    Returns: subprocess.Popen, or None if it could not be started.
+    """
+    try:
+        return subprocess.Popen(PAYMENT_UI)
+    except OSError as e:
+        logging.error(f"Cannot start the payment UI: {e}")
+        return None
 
-        if not ratio:
+def load_calibration(hx, store, recalibrate=False):
+    """
+    load_calibration applies the saved calibration, or calibrates
+    interactively if there is none (or `recalibrate` is set).
+
+    Returns: bool True if the scale is calibrated.
+    """
+    if not recalibrate and store.apply(hx):
+        return True
+    logging.info("Calibrating the weight sensor...")
+    return bool(calibrate_sensor(hx, store))
+
+def main(recalibrate=False):
+    import cv2  # the checkout window only; the cart helpers above are shared with lane_server.py
+
+    model = load_model()
+    # Prices are loaded once and reloaded in the background when the XML changes;
+    # the weight bands are rebuilt along with them, and whenever the sales history is reloaded
+    weight_index = history_refresher = None
+    if WEIGHT_CHECK:
+        weight_index = WeightIndex(load_weight_history(TRANSACTIONS_DB, WEIGHT_HISTORY_DAYS))
+        history_refresher = HistoryRefresher(weight_index, TRANSACTIONS_DB, WEIGHT_HISTORY_DAYS,
+                                             WEIGHT_HISTORY_REFRESH).start()
+    catalog_service = CatalogService(CATALOG_XML, poll_interval=CATALOG_POLL_INTERVAL,
+                                     on_reload=weight_index.rebuild if weight_index else None).start()
+
+    # The weight sensor is set up and calibrated once and stays sampling between customers
+    hx = initialize_hx711()
+    monitor = ScaleMonitor(hx).start()
+    store = CalibrationStore.load(CALIBRATION_FILE)
+    tracker = None
+    payment_ui = None
+    publisher = CartPublisher(CART_SOCKET, RECEIPT_FILE, on_message=on_cart_message).start()
+    try:
+        if not load_calibration(hx, store, recalibrate):
             logging.error("Calibration failed. Exiting.")
             return
-
-        # Step 2: Load item prices from XML
-        prices = load_prices_from_xml("items.xml")
-        
-        # Step 3: Open the camera for object detection
-        cap = cv2.VideoCapture(0)
+        if ZERO_TRACKING:
+            tracker = ZeroTracker(hx, monitor, store).start()
+        payment_ui = start_payment_ui()
+        serve_customers(model, catalog_service, hx, monitor, store, publisher, tracker, weight_index)
+    finally:
+        if payment_ui:
+            payment_ui.terminate()
+        publisher.stop()
+        cv2.destroyAllWindows()
+        if tracker:
+            tracker.stop()
+        monitor.stop()
+        logging.info(f"HX711 sampler stats: {hx.get_sampler().stats()}")
+        hx.get_sampler().stop()
+        GPIO.cleanup()
+        catalog_service.stop()
+        if history_refresher:
+            history_refresher.stop()
+
+def serve_customers(model, catalog_service, hx, monitor, store, publisher, tracker=None, weight_index=None):
+    # The camera, pipeline and window stay open from one customer to the next;
+    # this loop only starts over if the pipeline fails
+    while True:
+        # Step 1: Check the empty tray, re-taring only if it has drifted
+        auto_tare(hx, monitor, store, tolerance=ZERO_TOLERANCE, max_drift=AUTO_TARE_MAX)
+
+        # Step 2: Open the camera for object detection
+        cap = hardware.open_camera(CAMERA_INDEX)
+        on_demand = INFERENCE_MODE == 'on_demand'
+        pipeline = FramePipeline(cap, model, on_demand=on_demand,
+                                 preview_interval=PREVIEW_INTERVAL).start()
+        trigger = registrar = None
+        if on_demand:
+            trigger = LoadChangeTrigger(monitor, lambda weight: pipeline.request_inference()).start()
+        elif INFERENCE_MODE == 'tracking':
+            # after a pipeline restart the tray may still be loaded: start from what it holds
+            reading = monitor.wait_stable(timeout=3.0) or monitor.reading()
+            baseline = reading.weight if reading is not None else 0.0
+            registrar = TrayRegistrar(catalog_service.current, baseline=baseline)
+            trigger = LoadChangeTrigger(monitor, registrar.weight_settled)
+            trigger.baseline = baseline
+            trigger.start()
+        tracked_seq = 0  # newest frame fed to the registrar
         object_data = defaultdict(lambda: {'count': 0, 'total_weight': 0})
+        session, cart_totals = new_session_id(), {}
+        basket_scanned_at = None  # stable_since of the scale reading of the last basket added
 
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                logging.error("Error reading from camera.")
+            latest = pipeline.latest_result()
+            if pipeline.failed:
+                if trigger:
+                    trigger.stop()
+                pipeline.stop()
+                cap.release()
                 break
 
-            results = model(frame)
-            cv2.imshow("YOLOv8 Inference", results[0].plot())
+            if on_demand:
+                # show the live camera, with boxes only while they still match the tray
+                packet = pipeline.latest_frame()
+                if packet is None:
+                    cv2.waitKey(1)
+                    continue
+                if latest is not None and latest.packet.captured_at >= trigger.settled_at:
+                    display = latest.detections.plot(img=packet.frame.copy())
+                else:
+                    display = packet.frame.copy()
+            else:
+                if latest is None:
+                    # no inference finished yet, keep the window responsive
+                    cv2.waitKey(1)
+                    continue
+                display = latest.detections.plot()
+                if registrar is not None:
+                    if latest.packet.seq != tracked_seq:
+                        tracked_seq = latest.packet.seq
+                        prices = catalog_service.current()
+                        for event, track in registrar.update(latest.detections, latest.packet.captured_at):
+                            if event == 'add':
+                                add_tracked_item(track, object_data, publisher, session, prices, cart_totals)
+                            else:
+                                remove_from_cart(tracked_key(track), track.weight, object_data, publisher,
+                                                 session, prices, cart_totals)
+                                logging.info(f"Item #{track.id} removed: {track.name}")
+                    display = registrar.draw(display)
+
+            cv2.imshow("YOLOv8 Inference", pipeline.draw_stats(display))
             key = cv2.waitKey(1) & 0xFF
 
-            if key == ord('r'):
-                detection_counts = defaultdict(int)
-                for r in results:
-                    for box in r.boxes:
-                        class_name = model.names[int(box.cls[0])]
-                        detection_counts[class_name] = 1  # Count all detections of the same class as 1 item
-
-                if len(detection_counts) > 1:
-                    logging.warning("Two or more different objects detected. Remove one to add to the cart and continue.")
+            if key == ord('r') and registrar is not None:
+                logging.info("Items are added as they are put on the tray in tracking mode.")
+            elif key == ord('r'):
+                # Vote over the last frames of the tray, inferred in one batch
+                since = trigger.settled_at if on_demand else 0.0
+                packets = pipeline.recent_frames(VOTE_FRAMES, since)
+                if not packets:
+                    logging.error("Timed out waiting for camera frames.")
                     continue
+                started = time.perf_counter()
+                detections = detect_voted(model, [packet.frame for packet in packets], VOTE_MIN_RATIO)
+                logging.info(f"Votes over {detections.frames} frames in "
+                             f"{(time.perf_counter() - started) * 1000:.0f} ms: {detections.votes}")
 
-                # Get weight measurement
-                reading = hx.get_data_mean()
+                # Get weight measurement; returns at once if the scale has already settled
+                reading = monitor.wait_stable(timeout=3.0)
                 if reading is None:
                     logging.error("Failed to get weight measurement.")
                     continue
-                weight = round_to_nearest_five(reading / ratio)
-
-                # Add detected object to the cart as one item
-                for class_name, count in detection_counts.items():
-                    unique_key = f"{class_name}_{weight}"
-                    if object_data[unique_key]['count'] == 0:
-                        object_data[unique_key]['count'] = 1  # Consider multiple detections of same class as 1 item
-                    object_data[unique_key]['total_weight'] = weight
+                prices = catalog_service.current()
+
+                instance_counts = count_instances(detections)
+                if BASKET_MODE and is_basket(instance_counts, prices):
+                    # the same stable period means the same tray, in either inference mode
+                    if reading.stable_since == basket_scanned_at:
+                        logging.warning("This basket is already in the cart. Change the tray to scan more.")
+                        continue
+                    if add_basket_to_cart(instance_counts, reading.weight, object_data, publisher,
+                                          session, prices, cart_totals):
+                        basket_scanned_at = reading.stable_since
+                    continue
 
-                logging.info(f"Detected objects: {detection_counts}, weight: {weight} grams")
+                weight = round_to_nearest_five(reading.weight)
+                if weight_index is not None:
+                    detection_counts = check_weight(detections, weight, prices, weight_index)
+                else:
+                    detection_counts = count_detections(detections)
+                if detection_counts is None:
+                    continue
+                add_to_cart(detection_counts, weight, object_data, publisher, session, prices, cart_totals)
 
             if key == ord('q'):
-                # Step 4: Calculate total price, save receipt, and launch Streamlit app for payment
-                total_price, receipt = calculate_total_price_with_nearest_weight(object_data, prices)
-                save_receipt_as_json(receipt, total_price)
-
-                logging.info(f"Final object data: {json.dumps(object_data, indent=2)}")
+                # Step 3: Calculate total price and hand the receipt to the payment UI
+                prices = catalog_service.current()  # one catalog version for the whole receipt
+                total_price, receipt = calculate_total_price_with_nearest_weight(object_data, prices,
+                                                                                 weight_index)
+                hand_over_receipt(publisher, receipt, total_price, prices.version, session)
+
+                cart_log = {f"{name} ({weight} g)": data for (name, weight), data in object_data.items()}
+                logging.info(f"Final object data: {json.dumps(cart_log, indent=2)}")
                 logging.info(f"Calculated receipt: {json.dumps(receipt, indent=2)}")
 
-                # Release resources before launching Streamlit
-                cap.release()
-                GPIO.cleanup()
-                cv2.destroyAllWindows()
-
-                # Step 5: Run Streamlit app synchronously
-                run_streamlit_app()
+                logging.info(f"HX711 sampler stats: {hx.get_sampler().stats()}")
+                if tracker:
+                    logging.info(f"Zero tracking: {tracker.metrics()}")
+                else:
+                    # only if the tray is already empty and settled, never wait here
+                    auto_tare(hx, monitor, store, tolerance=ZERO_TOLERANCE,
+                              max_drift=AUTO_TARE_MAX, timeout=0.0)
 
-                # After Streamlit app closes, reset object data for the next customer
+                # Step 4: Reset object data for the next customer while the customer pays
                 object_data = defaultdict(lambda: {'count': 0, 'total_weight': 0})
-
-                # Re-initialize the camera
-                cap = cv2.VideoCapture(0)
-
+                session, cart_totals = new_session_id(), {}
+                basket_scanned_at = None
+                if registrar is not None:
+                    logging.info(f"Weight changes without a matching item: {registrar.unmatched_weight}")
+                    registrar.reset()
                 logging.info("Returning to object detection for new customers.")
 
-                break  # Exit detection loop and return to main loop for new customer
-
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Self-checkout station")
+    parser.add_argument('--recalibrate', action='store_true',
+                        help=f"calibrate interactively instead of using {CALIBRATION_FILE}")
+    main(recalibrate=parser.parse_args().recalibrate)
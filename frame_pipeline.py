@@ -0,0 +1,365 @@
+"""
+Threaded camera -> detector -> display pipeline used by the checkout loop.
+
+Capture, inference and rendering run on separate threads connected by
+bounded queues that drop the oldest entry when full, so the display never
+waits on the detector and the detector always works on the newest frame.
+"""
+import collections
+import logging
+import threading
+import time
+
+
+class LatestQueue:
+    """
+    Bounded queue with drop-oldest semantics.
+
+    put() never blocks: when the queue is full the oldest item is discarded
+    and counted in `dropped`.
+    """
+
+    def __init__(self, maxsize=1):
+        self._items = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Pop the oldest item, waiting up to `timeout` seconds.
+
+        Returns: the item, or None if the queue stayed empty.
+        """
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def wake(self):
+        """Release any thread blocked in get()."""
+        with self._cond:
+            self._cond.notify_all()
+
+
+class RateMeter:
+    """
+    Exponentially smoothed events-per-second counter.
+    """
+
+    def __init__(self, smoothing=0.9):
+        self._smoothing = smoothing
+        self._last = None
+        self.rate = 0.0
+
+    def tick(self, now=None):
+        now = time.perf_counter() if now is None else now
+        if self._last is not None:
+            dt = now - self._last
+            if dt > 0:
+                inst = 1.0 / dt
+                if self.rate:
+                    self.rate = self._smoothing * self.rate + (1 - self._smoothing) * inst
+                else:
+                    self.rate = inst
+        self._last = now
+
+
+class FramePacket:
+    """
+    A captured frame together with its sequence number and capture time.
+    """
+    __slots__ = ('seq', 'frame', 'captured_at')
+
+    def __init__(self, seq, frame, captured_at):
+        self.seq = seq
+        self.frame = frame
+        self.captured_at = captured_at
+
+
+class InferenceResult:
+    """
+    Detector output for one FramePacket.
+    """
+    __slots__ = ('packet', 'detections', 'inferred_at')
+
+    def __init__(self, packet, detections, inferred_at):
+        self.packet = packet
+        self.detections = detections
+        self.inferred_at = inferred_at
+
+
+class FramePipeline:
+    """
+    FramePipeline owns the capture thread and the inference worker.
+
+    The render loop (the caller's thread, which also owns cv2.imshow) pulls
+    results with latest_result() and annotates them with draw_stats().
+
+    In on-demand mode the worker stays idle until request_inference() is
+    called (by the scale trigger or the operator), optionally running a
+    low-rate preview inference every `preview_interval` seconds.
+
+    `failed` is set, and the pipeline stops, when the camera cannot be read
+    or the detector raises.
+    """
+
+    def __init__(self, cap, model, frame_queue_size=1, result_queue_size=1,
+                 on_demand=False, preview_interval=None, frame_history=8):
+        """
+        Args:
+            cap(cv2.VideoCapture): opened camera handle.
+            model(callable): detector, called as model(frame).
+            frame_queue_size(int): frames buffered between capture and inference.
+            result_queue_size(int): results buffered between inference and display.
+            on_demand(bool): Optional, by default False. Only infer when requested.
+            preview_interval(float): Optional. Seconds between preview
+                inferences in on-demand mode. None disables the preview.
+            frame_history(int): newest captured frames kept for recent_frames().
+        """
+        self._cap = cap
+        self._model = model
+        self._frames = LatestQueue(frame_queue_size)
+        self._results = LatestQueue(result_queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        self._seq = 0
+        self._latest = None
+        self._newest_packet = None
+        self._history = collections.deque(maxlen=frame_history)
+        self._captured = threading.Condition()
+        self._on_demand = on_demand
+        self._preview_interval = preview_interval
+        self._requested = threading.Event()
+        self._request_after = 0.0
+        self._inferred = threading.Condition()
+        self._last_inferred = None
+        self.inference_count = 0
+        self._capture_rate = RateMeter()
+        self._inference_rate = RateMeter()
+        self._render_rate = RateMeter()
+        self._frame_age = 0.0
+        self.failed = False
+
+        # keep the driver from queueing stale frames behind our back
+        import cv2
+
+        self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='capture', daemon=True),
+            threading.Thread(target=self._inference_loop, name='inference', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        self._requested.set()
+        with self._inferred:
+            self._inferred.notify_all()
+        with self._captured:
+            self._captured.notify_all()
+        self._frames.wake()
+        self._results.wake()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            ret, frame = self._cap.read()
+            if not ret:
+                logging.error("Error reading from camera.")
+                self.failed = True
+                self._stop.set()
+                self._frames.wake()
+                return
+            now = time.perf_counter()
+            self._capture_rate.tick(now)
+            self._seq += 1
+            packet = FramePacket(self._seq, frame, now)
+            self._newest_packet = packet
+            with self._captured:
+                self._history.append(packet)
+                self._captured.notify_all()
+            self._frames.put(packet)
+
+    def _wait_for_turn(self):
+        """
+        _wait_for_turn blocks the worker in on-demand mode until an inference
+        was requested or the next preview is due.
+
+        Returns: bool True if the worker should infer the next frame.
+        """
+        if self._preview_interval:
+            last = self._last_inferred.inferred_at if self._last_inferred else 0.0
+            due_in = last + self._preview_interval - time.perf_counter()
+            if due_in <= 0:
+                return True
+            timeout = min(due_in, 0.1)
+        else:
+            timeout = 0.1
+        if self._requested.wait(timeout):
+            self._requested.clear()
+            return True
+        return False
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            if self._on_demand and not self._wait_for_turn():
+                continue
+            packet = self._frames.get(timeout=0.1)
+            # a requested inference must see a frame taken after the request
+            while (packet is not None and not self._stop.is_set()
+                   and packet.captured_at < self._request_after):
+                packet = self._frames.get(timeout=0.1)
+            if packet is None:
+                if self._on_demand:
+                    self._requested.set()  # retry with the next frame
+                continue
+            try:
+                detections = self._model(packet.frame)
+            except Exception:
+                logging.exception("Inference failed, stopping the pipeline.")
+                self.failed = True
+                self._stop.set()
+                with self._inferred:
+                    self._inferred.notify_all()
+                with self._captured:
+                    self._captured.notify_all()
+                self._results.wake()
+                return
+            now = time.perf_counter()
+            self._inference_rate.tick(now)
+            result = InferenceResult(packet, detections, now)
+            with self._inferred:
+                self._last_inferred = result
+                self.inference_count += 1
+                self._inferred.notify_all()
+            self._results.put(result)
+
+    def request_inference(self):
+        """
+        request_inference asks the worker to run the detector on the next
+        captured frame. In continuous mode every frame is inferred anyway.
+
+        Returns: float perf_counter timestamp of the request, for wait_for_result().
+        """
+        now = time.perf_counter()
+        self._request_after = now
+        self._requested.set()
+        return now
+
+    def wait_for_result(self, since, timeout=5.0):
+        """
+        wait_for_result blocks until a frame captured at or after `since`
+        has been inferred.
+
+        Args:
+            since(float): perf_counter timestamp, e.g. from request_inference().
+            timeout(float): seconds to wait.
+
+        Returns: InferenceResult or None on timeout.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._inferred:
+            while (self._last_inferred is None
+                   or self._last_inferred.packet.captured_at < since):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self._stop.is_set():
+                    return None
+                self._inferred.wait(remaining)
+            return self._last_inferred
+
+    def latest_frame(self):
+        """
+        Returns: the newest captured FramePacket (not consumed), or None.
+        """
+        return self._newest_packet
+
+    def recent_frames(self, count, since=0.0, timeout=1.0):
+        """
+        recent_frames returns the newest captured frames, e.g. to run the
+        detector over several frames of the same tray at once.
+
+        Args:
+            count(int): frames wanted, at most `frame_history`.
+            since(float): perf_counter timestamp; only frames captured at or
+                after it are returned.
+            timeout(float): seconds to wait for `count` such frames.
+
+        Returns: list of up to `count` FramePackets, oldest first; fewer if
+            the timeout expired first.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._captured:
+            while True:
+                packets = [packet for packet in self._history if packet.captured_at >= since]
+                remaining = deadline - time.perf_counter()
+                if len(packets) >= count or remaining <= 0 or self._stop.is_set():
+                    return packets[-count:]
+                self._captured.wait(remaining)
+
+    def latest_result(self, timeout=0.01):
+        """
+        latest_result returns the newest InferenceResult.
+
+        If no new result arrives within `timeout` seconds the previous one is
+        returned again, so the display keeps refreshing at its own pace.
+
+        Returns: InferenceResult or None if nothing was inferred yet.
+        """
+        result = self._results.get(timeout)
+        if result is not None:
+            self._latest = result
+        if self._latest is not None:
+            now = time.perf_counter()
+            self._render_rate.tick(now)
+            self._frame_age = now - self._latest.packet.captured_at
+        return self._latest
+
+    def stats(self):
+        """
+        Returns: dict with capture/inference/render FPS, the age in ms of the
+            frame currently displayed and how many frames/results were dropped.
+        """
+        return {
+            'capture_fps': self._capture_rate.rate,
+            'inference_fps': self._inference_rate.rate,
+            'render_fps': self._render_rate.rate,
+            'frame_age_ms': self._frame_age * 1000.0,
+            'inferences': self.inference_count,
+            'frames_dropped': self._frames.dropped,
+            'results_dropped': self._results.dropped,
+        }
+
+    def draw_stats(self, image):
+        """
+        draw_stats overlays the stage counters on `image` in place.
+        """
+        import cv2
+
+        s = self.stats()
+        lines = [
+            f"capture {s['capture_fps']:5.1f} fps",
+            f"infer   {s['inference_fps']:5.1f} fps",
+            f"age     {s['frame_age_ms']:5.0f} ms",
+        ]
+        if self._on_demand:
+            lines.append(f"runs    {s['inferences']:5d}")
+        for i, text in enumerate(lines):
+            cv2.putText(image, text, (10, 20 + 20 * i), cv2.FONT_HERSHEY_SIMPLEX,
+                        0.5, (0, 255, 0), 1, cv2.LINE_AA)
+        return image
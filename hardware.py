@@ -0,0 +1,392 @@
+"""
+Hardware access layer: GPIO, load cell and camera.
+
+Modules import GPIO from here instead of RPi.GPIO. On the Pi this is the
+real RPi.GPIO module, and failing to import it is an error: a till must
+never price items from simulated weights. With RETAIL_HARDWARE=sim it is
+SimulatedGPIO, which emulates HX711 chips at the pin level, so HX711, the
+sampling engine and the checkout loop run unchanged on any Linux box:
+
+    RETAIL_HARDWARE=sim RETAIL_SIM_TRACE=sim_traces/basic_checkout.csv \
+        RETAIL_SIM_CAMERA=checkout.mp4 python3 final.py
+
+A trace is a CSV file with a header and rows of `t,grams[,label]`: seconds
+since start, load on the tray and optionally the product on it. It drives
+the simulated load cell and, through detector.TraceDetector, the simulated
+detections.
+"""
+import csv
+import logging
+import os
+import random
+import time
+
+HARDWARE = os.environ.get('RETAIL_HARDWARE', 'pi')  # 'pi' or 'sim'
+SIM_TRACE = os.environ.get('RETAIL_SIM_TRACE')  # CSV trace replayed by the simulated scale
+SIM_CAMERA = os.environ.get('RETAIL_SIM_CAMERA')  # video file or image folder replayed as the camera
+SIM_NOISE = float(os.environ.get('RETAIL_SIM_NOISE', '0.5'))  # load cell noise, grams std
+SIM_DRIFT = float(os.environ.get('RETAIL_SIM_DRIFT', '0.0'))  # zero drift, grams per hour
+SIM_SEED = int(os.environ.get('RETAIL_SIM_SEED', '0'))
+
+_start = time.monotonic()
+
+
+def sim_clock():
+    """
+    Returns: float seconds since the simulation started, shared by the
+        simulated scale, camera and detector.
+    """
+    return time.monotonic() - _start
+
+
+class Trace:
+    """
+    Piecewise constant (grams, label) timeline loaded from a trace CSV.
+    """
+
+    def __init__(self, rows, loop=True):
+        """
+        Args:
+            rows([(float, float, str)]): (t, grams, label) sorted by t.
+            loop(bool): Optional, by default True. Replay from the start
+                after the last row.
+        """
+        self._times = [row[0] for row in rows]
+        self._rows = rows
+        self._loop = loop
+        self.duration = rows[-1][0] + 1.0 if rows else 0.0
+
+    @classmethod
+    def load(cls, path, loop=True):
+        rows = []
+        with open(path, newline='') as f:
+            for record in csv.DictReader(f):
+                rows.append((float(record['t']), float(record['grams']),
+                             (record.get('label') or '').strip()))
+        rows.sort(key=lambda row: row[0])
+        return cls(rows, loop)
+
+    def labels(self):
+        """
+        Returns: sorted list of the distinct non-empty labels in the trace.
+        """
+        return sorted({row[2] for row in self._rows if row[2]})
+
+    def at(self, t):
+        """
+        Returns: (grams, label) on the tray at time `t`.
+        """
+        if not self._rows:
+            return 0.0, ''
+        if self._loop and self.duration:
+            t %= self.duration
+        lo, hi = 0, len(self._times)
+        while lo < hi:  # last row with time <= t
+            mid = (lo + hi) // 2
+            if self._times[mid] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0.0, ''
+        _, grams, label = self._rows[lo - 1]
+        return grams, label
+
+
+class SimulatedLoadCell:
+    """
+    SimulatedLoadCell produces raw HX711 counts for the weight in a trace,
+    with gaussian noise and a linear zero drift.
+    """
+
+    def __init__(self, trace=None, offset=84000, ratio=420.0, noise=SIM_NOISE,
+                 drift=SIM_DRIFT, seed=SIM_SEED):
+        """
+        Args:
+            trace(Trace): Optional, by default an empty tray.
+            offset(int): raw counts of the empty tray.
+            ratio(float): raw counts per gram.
+            noise(float): standard deviation of the noise in grams.
+            drift(float): zero drift in grams per hour.
+            seed(int): random seed, for reproducible runs.
+        """
+        self.trace = trace or Trace([])
+        self.offset = offset
+        self.ratio = ratio
+        self.noise = noise
+        self.drift = drift
+        self.override = None  # grams forced by set_weight(), bypassing the trace
+        self._rng = random.Random(seed)
+
+    def set_weight(self, grams):
+        """
+        set_weight pins the load to `grams`; None resumes the trace.
+        """
+        self.override = grams
+
+    def grams(self, t):
+        if self.override is not None:
+            return self.override
+        return self.trace.at(t)[0]
+
+    def raw(self, t=None):
+        """
+        Returns: int raw conversion, clamped to the 24 bit range of the HX711.
+        """
+        t = sim_clock() if t is None else t
+        grams = self.grams(t) + self.drift * t / 3600.0 + self._rng.gauss(0.0, self.noise)
+        value = int(round(self.offset + grams * self.ratio))
+        return max(-0x7fffff, min(0x7ffffe, value))
+
+
+class SimulatedHX711Chip:
+    """
+    Pin level model of an HX711: DOUT goes low when a conversion is ready
+    (at `rate` samples per second), rising PD_SCK edges shift out 24 bits
+    MSB first, and DOUT goes high again after the 25th pulse. Holding
+    PD_SCK high for 60 us or more powers the chip down and aborts the
+    conversion, like the real one.
+    """
+
+    def __init__(self, dout_pin, pd_sck_pin, load_cell, rate=10):
+        self.dout_pin = dout_pin
+        self.pd_sck_pin = pd_sck_pin
+        self.load_cell = load_cell
+        self.period = 1.0 / rate
+        self._next_ready = time.monotonic() + self.period
+        self._pulses = 0
+        self._data = None
+        self._dout = 1
+        self._rose_at = 0.0
+
+    def _ready(self):
+        if self._pulses or time.monotonic() < self._next_ready:
+            return False
+        if self._data is None:
+            # latch the conversion when it becomes ready, not on the first clock
+            self._data = self.load_cell.raw() & 0xffffff
+        return True
+
+    def input(self):
+        if self._pulses == 0:
+            return 0 if self._ready() else 1
+        return self._dout
+
+    def clock(self, level):
+        now = time.perf_counter()
+        if not level:
+            if self._rose_at and now - self._rose_at >= 0.00006:
+                # power down: the conversion in progress is lost
+                self._pulses = 0
+                self._data = None
+                self._dout = 1
+                self._next_ready = time.monotonic() + self.period
+            self._rose_at = 0.0
+            return
+        self._rose_at = now
+        if self._pulses == 0 and not self._ready():
+            return
+        self._pulses += 1
+        if self._pulses <= 24:
+            self._dout = (self._data >> (24 - self._pulses)) & 1
+        else:
+            # gain pulses: conversion finished, the next one is a period away
+            self._dout = 1
+            self._pulses = 0
+            self._data = None
+            self._next_ready = time.monotonic() + self.period
+
+
+class SimulatedGPIO:
+    """
+    Drop-in replacement for the parts of RPi.GPIO used in this project.
+    """
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        self._chips_by_dout = {}
+        self._chips_by_sck = {}
+        self._levels = {}
+
+    def attach_hx711(self, chip):
+        self._chips_by_dout[chip.dout_pin] = chip
+        self._chips_by_sck[chip.pd_sck_pin] = chip
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, **kwargs):
+        self._levels.setdefault(pin, 0)
+
+    def output(self, pin, level):
+        level = 1 if level else 0
+        self._levels[pin] = level
+        chip = self._chips_by_sck.get(pin)
+        if chip is not None:
+            chip.clock(level)
+
+    def input(self, pin):
+        chip = self._chips_by_dout.get(pin)
+        if chip is not None:
+            return chip.input()
+        return self._levels.get(pin, 0)
+
+    def cleanup(self):
+        self._levels.clear()
+
+
+def _load_gpio():
+    if HARDWARE == 'sim':
+        return SimulatedGPIO()
+    try:
+        import RPi.GPIO as rpi_gpio
+    except (ImportError, RuntimeError) as e:
+        raise ImportError(f"RPi.GPIO cannot be loaded ({e}). Fix the installation, or set "
+                          f"RETAIL_HARDWARE=sim to run on simulated hardware.") from e
+    return rpi_gpio
+
+
+GPIO = _load_gpio()
+
+
+def is_simulated():
+    return isinstance(GPIO, SimulatedGPIO)
+
+
+def read_temperature(zone='/sys/class/thermal/thermal_zone0/temp'):
+    """
+    read_temperature reads the SoC temperature, the closest thing to the
+    load cell temperature on a Pi without an extra sensor.
+
+    Returns: float degrees Celsius, or None if not available (e.g. in simulation).
+    """
+    if is_simulated():
+        return None
+    try:
+        with open(zone) as f:
+            return int(f.read().strip()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def attach_simulated_scale(dout_pin, pd_sck_pin, trace_path=SIM_TRACE, rate=10):
+    """
+    attach_simulated_scale wires a simulated load cell to the given pins.
+    Does nothing on real hardware.
+
+    Returns: SimulatedLoadCell or None on real hardware
+    """
+    if not is_simulated():
+        return None
+    trace = Trace.load(trace_path) if trace_path else None
+    load_cell = SimulatedLoadCell(trace)
+    GPIO.attach_hx711(SimulatedHX711Chip(dout_pin, pd_sck_pin, load_cell, rate))
+    logging.info(f"Simulated HX711 on DOUT {dout_pin}/SCK {pd_sck_pin}"
+                 + (f" replaying {trace_path}" if trace_path else ""))
+    return load_cell
+
+
+class FileCamera:
+    """
+    FileCamera replays a video file or a folder of images at `fps`, looping
+    forever, with the cv2.VideoCapture methods FramePipeline uses.
+    """
+
+    def __init__(self, source, fps=30.0):
+        import cv2
+
+        self._cv2 = cv2
+        self._period = 1.0 / fps
+        self._next = time.monotonic()
+        self._images = None
+        self._index = 0
+        self._video = None
+        if os.path.isdir(source):
+            from evaluation import list_images
+            self._images = [cv2.imread(path) for path in list_images(source)]
+            if not self._images:
+                raise ValueError(f"No images in {source}")
+        else:
+            self._video = cv2.VideoCapture(source)
+            if not self._video.isOpened():
+                raise ValueError(f"Cannot open video {source}")
+
+    def set(self, prop, value):
+        return True
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        # pace like a real camera
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next = max(self._next + self._period, time.monotonic())
+
+        if self._images is not None:
+            frame = self._images[self._index % len(self._images)]
+            self._index += 1
+            return True, frame.copy()
+        ret, frame = self._video.read()
+        if not ret:
+            self._video.set(self._cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._video.read()
+        return ret, frame
+
+    def release(self):
+        if self._video is not None:
+            self._video.release()
+
+
+class SyntheticCamera:
+    """
+    SyntheticCamera produces plain grey frames at `fps`, for simulation runs
+    that only exercise timing (e.g. with detector.TraceDetector).
+    """
+
+    def __init__(self, width=640, height=480, fps=30.0):
+        import numpy as np
+
+        self._frame = np.full((height, width, 3), 114, dtype=np.uint8)
+        self._period = 1.0 / fps
+        self._next = time.monotonic()
+
+    def set(self, prop, value):
+        return True
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next = max(self._next + self._period, time.monotonic())
+        return True, self._frame.copy()
+
+    def release(self):
+        pass
+
+
+def open_camera(index=0, fps=30.0):
+    """
+    open_camera opens the camera at `index`. In simulation it replays the
+    video file / image folder in RETAIL_SIM_CAMERA, or synthesises frames.
+
+    Returns: cv2.VideoCapture, FileCamera or SyntheticCamera
+    """
+    if is_simulated():
+        if SIM_CAMERA:
+            return FileCamera(SIM_CAMERA, fps)
+        return SyntheticCamera(fps=fps)
+    import cv2
+    return cv2.VideoCapture(index)
@@ -6,7 +6,10 @@ This file holds HX711 class
 import statistics as stat
 import time
 
-import RPi.GPIO as GPIO
+import numpy as np
+
+from hardware import GPIO
+from hx711_filters import OutliersMean
 
 
 class HX711:
@@ -56,6 +59,9 @@ class HX711:
         self._scale_ratio_B = 1  # scale ratio for channel B
         self._debug_mode = False
         self._data_filter = self.outliers_filter  # default it is used outliers_filter
+        self._mean_filter = OutliersMean()  # same filter, vectorised together with the mean
+        self._buffer = np.empty(100, dtype=np.float64)  # reused by get_raw_data_mean
+        self._sampler = None  # optional hx711_sampler.SamplingEngine owning the pins
 
         GPIO.setup(self._pd_sck, GPIO.OUT)  # pin _pd_sck is output only
         GPIO.setup(self._dout, GPIO.IN)  # pin _dout is input only
@@ -82,8 +88,7 @@ class HX711:
                              'Received: {}'.format(channel))
         # after changing channel or gain it has to wait 50 ms to allow adjustment.
         # the data before is garbage and cannot be used.
-        self._read()
-        time.sleep(0.5)
+        self._settle_after_change()
 
     def set_gain_A(self, gain):
         """
@@ -104,8 +109,30 @@ class HX711:
                              'Received: {}'.format(gain))
         # after changing channel or gain it has to wait 50 ms to allow adjustment.
         # the data before is garbage and cannot be used.
-        self._read()
-        time.sleep(0.5)
+        self._settle_after_change()
+
+    def _settle_after_change(self):
+        """
+        _settle_after_change discards the conversion that still uses the
+        previous channel and gain.
+        """
+        if self._sampler is not None:
+            self._sampler.flush()
+        else:
+            self._read()
+            time.sleep(0.5)
+
+    def set_sampler(self, sampler):
+        """
+        set_sampler hands the pins over to a background sampling engine.
+        Afterwards get_raw_data_mean takes fresh samples from the engine
+        instead of reading the HX711 itself.
+
+        Args:
+            sampler(SamplingEngine): running engine built on this HX711,
+                or None to read directly again.
+        """
+        self._sampler = sampler
 
     def zero(self, readings=30):
         """
@@ -253,10 +280,31 @@ class HX711:
         """
         if callable(data_filter):
             self._data_filter = data_filter
+            self._mean_filter = None  # use the list based filter from now on
         else:
             raise TypeError('Parameter "data_filter" must be a function. '
                             'Received: {}'.format(data_filter))
 
+    def set_mean_filter(self, mean_filter):
+        """
+        set_mean_filter sets a filter that reduces the readings to their
+        filtered mean in one pass, see hx711_filters. It takes precedence
+        over the list based data filter.
+
+        Args:
+            mean_filter(callable): takes a numpy array of readings and returns
+                a float, or None if no reading is usable. None switches back
+                to the list based data filter.
+
+        Raises:
+            TypeError: if mean_filter is not a function or None.
+        """
+        if mean_filter is None or callable(mean_filter):
+            self._mean_filter = mean_filter
+        else:
+            raise TypeError('Parameter "mean_filter" must be a function. '
+                            'Received: {}'.format(mean_filter))
+
     def set_debug_mode(self, flag=False):
         """
         set_debug_mode method is for turning on and off
@@ -437,22 +485,39 @@ class HX711:
         # do backup of current channel befor reading for later use
         backup_channel = self._current_channel
         backup_gain = self._gain_channel_A
-        data_list = []
-        # do required number of readings
-        for _ in range(readings):
-            data_list.append(self._read())
+        if readings > len(self._buffer):
+            self._buffer = np.empty(readings, dtype=np.float64)
+        if self._sampler is not None:
+            # the sampling engine already reads continuously; take fresh samples
+            values = self._sampler.take_into(self._buffer, readings)
+        else:
+            # do required number of readings, keeping only the valid ones
+            count = 0
+            for _ in range(readings):
+                data = self._read()
+                if data is not False:
+                    self._buffer[count] = data
+                    count += 1
+            values = self._buffer[:count]
+        if not len(values):
+            return False
+
         data_mean = False
-        if readings > 2 and self._data_filter:
-            filtered_data = self._data_filter(data_list)
+        if readings > 2 and self._mean_filter is not None:
+            # filter and mean in one pass over the buffer
+            data_mean = self._mean_filter(values)
+            if data_mean is None:
+                return False
+        elif readings > 2 and self._data_filter:
+            filtered_data = self._data_filter(values.astype(int).tolist())
             if not filtered_data:
                 return False
-            if self._debug_mode:
-                print('data_list: {}'.format(data_list))
-                print('filtered_data list: {}'.format(filtered_data))
-                print('data_mean:', stat.mean(filtered_data))
             data_mean = stat.mean(filtered_data)
         else:
-            data_mean = stat.mean(data_list)
+            data_mean = float(values.mean())
+        if self._debug_mode:
+            print('data_list: {}'.format(values))
+            print('data_mean:', data_mean)
         self._save_last_raw_data(backup_channel, backup_gain, data_mean)
         return int(data_mean)
 
@@ -519,6 +584,14 @@ class HX711:
         """
         return self._data_filter
 
+    def get_sampler(self):
+        """
+        get sampler.
+
+        Returns: self._sampler or None if the HX711 is read directly
+        """
+        return self._sampler
+
     def get_current_gain_A(self):
         """
         get current gain A returns the value of current gain on channel A
@@ -668,25 +741,26 @@ class HX711:
 
         Args:
             data_list([int]): List of int. It can contain Bool False that is removed.
+                As before, readings equal to -1, 0 (== False) or 1 (== True) are removed too.
         
-        Returns: list of filtered data. Excluding outliers.
+        Returns: list of filtered data, the kept items of `data_list`
+            unchanged. Excluding outliers. A single reading is returned
+            as is.
         """
         # filter out -1 which indicates no signal
         # filter out booleans
-        data = [num for num in data_list if (num != -1 and num != False and num != True)] 
+        data = [num for num in data_list if (num != -1 and num != False and num != True)]
         if not data:
             return []
 
         median = stat.median(data)
-        dists_from_median = [(abs(measurement - median)) for measurement in data]
-        stdev = stat.stdev(dists_from_median)
-        if stdev:
-            ratios_to_stdev = [(dist / stdev) for dist in dists_from_median]
-        else:
+        if len(data) < 2:
+            return [median]
+        # the distances and their deviation are computed vectorised
+        dists_from_median = np.abs(np.asarray(data, dtype=np.float64) - median)
+        stdev = dists_from_median.std(ddof=1)
+        if not stdev:
             # stdev is 0. Therefore return just the median
             return [median]
-        filtered_data = []
-        for i in range(len(data)):
-            if ratios_to_stdev[i] < stdev_thresh:
-                filtered_data.append(data[i])
-        return filtered_data
+        keep = dists_from_median / stdev < stdev_thresh
+        return [num for num, kept in zip(data, keep) if kept]
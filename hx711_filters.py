@@ -0,0 +1,202 @@
+"""
+Array based filters that reduce a batch of HX711 readings to one value.
+
+Each filter is a callable taking a 1-D numpy array of raw readings and
+returning the filtered mean as a float, or None if nothing is left. The
+filtering and the mean happen in one pass over preallocated scratch
+buffers, so a call does not build any Python lists.
+
+Use them with HX711.set_mean_filter(), e.g.
+
+    hx.set_mean_filter(TrimmedMean(0.2))
+"""
+import numpy as np
+
+
+class _Scratch:
+    """
+    Grow-only scratch buffers shared by the calls of one filter instance.
+    """
+
+    def __init__(self, size=100):
+        self._alloc(size)
+
+    def _alloc(self, size):
+        self.size = size
+        self.a = np.empty(size, dtype=np.float64)
+        self.b = np.empty(size, dtype=np.float64)
+        self.mask = np.empty(size, dtype=bool)
+
+    def ensure(self, size):
+        if size > self.size:
+            self._alloc(size)
+
+
+class OutliersMean:
+    """
+    OutliersMean is the vectorised equivalent of HX711.outliers_filter
+    followed by the mean: readings of -1, 0 or 1 (no signal, and False /
+    True, which outliers_filter drops) are ignored, readings whose distance
+    from the median is `stdev_thresh` standard deviations (of those
+    distances) or more are dropped and the rest averaged.
+    """
+
+    def __init__(self, stdev_thresh=1.0):
+        self.stdev_thresh = stdev_thresh
+        self._scratch = _Scratch()
+
+    def __call__(self, values):
+        invalid = np.isin(values, (-1, 0, 1))
+        if invalid.any():
+            values = values[~invalid]  # rare, a copy is fine
+        n = len(values)
+        if n == 0:
+            return None
+        if n < 2:
+            return float(values[0])
+        s = self._scratch
+        s.ensure(n)
+        work, dists, mask = s.a[:n], s.b[:n], s.mask[:n]
+
+        np.copyto(work, values)
+        median = _median_inplace(work)
+        np.subtract(values, median, out=dists)
+        np.abs(dists, out=dists)
+
+        mean_dist = dists.sum() / n
+        np.subtract(dists, mean_dist, out=work)
+        stdev = np.sqrt(np.dot(work, work) / (n - 1))
+        if not stdev:
+            # all readings are equally far from the median
+            return float(median)
+
+        np.less(dists, stdev * self.stdev_thresh, out=mask)
+        kept = np.count_nonzero(mask)
+        if not kept:
+            return None
+        np.multiply(values, mask, out=work)
+        return float(work.sum() / kept)
+
+
+class MedianOfN:
+    """
+    MedianOfN returns the median of the batch.
+    """
+
+    def __init__(self):
+        self._scratch = _Scratch()
+
+    def __call__(self, values):
+        n = len(values)
+        if n == 0:
+            return None
+        self._scratch.ensure(n)
+        work = self._scratch.a[:n]
+        np.copyto(work, values)
+        return float(_median_inplace(work))
+
+
+class TrimmedMean:
+    """
+    TrimmedMean drops the lowest and highest `proportion` of the readings
+    and averages the rest.
+    """
+
+    def __init__(self, proportion=0.2):
+        if not 0 <= proportion < 0.5:
+            raise ValueError('Parameter "proportion" has to be in range 0 up to 0.5. '
+                             'Received: {}'.format(proportion))
+        self.proportion = proportion
+        self._scratch = _Scratch()
+
+    def __call__(self, values):
+        n = len(values)
+        if n == 0:
+            return None
+        cut = int(n * self.proportion)
+        self._scratch.ensure(n)
+        work = self._scratch.a[:n]
+        np.copyto(work, values)
+        if cut:
+            work.partition((cut, n - cut - 1))
+        return float(work[cut:n - cut].sum() / (n - 2 * cut))
+
+
+class ExponentialFilter:
+    """
+    ExponentialFilter is an exponential moving average. update() feeds the
+    state one reading at a time; a call (as a mean filter) starts from a
+    fresh state, so a batch read after a load change is not pulled towards
+    the previous weight.
+    """
+
+    def __init__(self, alpha=0.3):
+        if not 0 < alpha <= 1:
+            raise ValueError('Parameter "alpha" has to be in range (0, 1]. '
+                             'Received: {}'.format(alpha))
+        self.alpha = alpha
+        self.state = None
+
+    def update(self, value):
+        if self.state is None:
+            self.state = float(value)
+        else:
+            self.state += self.alpha * (value - self.state)
+        return self.state
+
+    def __call__(self, values):
+        self.reset()
+        for value in values:
+            self.update(value)
+        return self.state
+
+    def reset(self):
+        self.state = None
+
+
+class KalmanFilter:
+    """
+    KalmanFilter is a scalar Kalman filter for a constant load: the weight
+    is modelled as a random walk with `process_variance` per reading and
+    observed with `measurement_variance` noise (both in raw counts^2).
+    Like ExponentialFilter, a call starts from a fresh state; use update()
+    to keep it across readings.
+    """
+
+    def __init__(self, process_variance=1.0, measurement_variance=400.0):
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.state = None
+        self.variance = None
+
+    def update(self, value):
+        if self.state is None:
+            self.state = float(value)
+            self.variance = self.measurement_variance
+            return self.state
+        self.variance += self.process_variance
+        gain = self.variance / (self.variance + self.measurement_variance)
+        self.state += gain * (value - self.state)
+        self.variance *= 1 - gain
+        return self.state
+
+    def __call__(self, values):
+        self.reset()
+        for value in values:
+            self.update(value)
+        return self.state
+
+    def reset(self):
+        self.state = None
+        self.variance = None
+
+
+def _median_inplace(work):
+    # partition instead of sort, and no copy unlike np.median
+    n = len(work)
+    half = n // 2
+    if n % 2:
+        work.partition(half)
+        return work[half]
+    work.partition((half - 1, half))
+    return (work[half - 1] + work[half]) / 2
@@ -0,0 +1,441 @@
+"""
+Background sampling engine for the HX711.
+
+A single thread owns the HX711 clock line and pushes every conversion into
+a ring buffer, instead of each caller bit-banging 30 conversions in a row.
+The low level read is pluggable:
+
+    RPiGPIOBackend  RPi.GPIO bit-banging, timing checked per clock pulse
+    PigpioBackend   clock pulses generated by the pigpio daemon (DMA timed),
+                    immune to the Python thread being preempted
+
+Failed conversions are counted by cause and retried on the next conversion,
+so the counters show how many reads are lost under CPU load.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from hardware import GPIO
+
+# HX711 powers down if PD_SCK stays high for 60 us or more
+MAX_PULSE_SECONDS = 0.00006
+
+
+class SampleRing:
+    """
+    Fixed-size ring buffer of (timestamp, raw value) samples.
+
+    `seq` counts every sample ever appended, so readers can wait for
+    samples newer than the ones they have already seen.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._times = np.zeros(size, dtype=np.float64)
+        self._values = np.zeros(size, dtype=np.float64)
+        self._cond = threading.Condition()
+        self.seq = 0
+
+    def append(self, value, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._cond:
+            i = self.seq % self.size
+            self._times[i] = timestamp
+            self._values[i] = value
+            self.seq += 1
+            self._cond.notify_all()
+
+    def last(self, n):
+        """
+        last returns the newest `n` samples in chronological order.
+
+        Returns: (timestamps, values) numpy arrays, at most `n` long.
+        """
+        with self._cond:
+            return self._last_locked(n)
+
+    def _last_locked(self, n):
+        n = min(n, self.seq, self.size)
+        end = self.seq % self.size
+        idx = (np.arange(end - n, end)) % self.size
+        return self._times[idx].copy(), self._values[idx].copy()
+
+    def last_into(self, n, out):
+        """
+        last_into copies the newest `n` values into `out` without allocating.
+
+        Returns: numpy.ndarray view of `out` holding at most `n` values.
+        """
+        with self._cond:
+            n = min(n, self.seq, self.size, len(out))
+            end = self.seq % self.size
+            start = end - n
+            if start >= 0:
+                out[:n] = self._values[start:end]
+            else:
+                out[:-start] = self._values[start:]
+                out[-start:n] = self._values[:end]
+            return out[:n]
+
+    def wait_for(self, seq, timeout):
+        """
+        wait_for blocks until at least `seq` samples have been appended.
+
+        Returns: bool True if they arrived before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.seq < seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+
+def _gain_pulses(hx):
+    # number of extra clock pulses selecting the channel/gain of the next conversion
+    if hx._wanted_channel == 'A' and hx._gain_channel_A == 128:
+        return 1
+    elif hx._wanted_channel == 'A' and hx._gain_channel_A == 64:
+        return 3
+    return 2
+
+
+def _to_signed(data_in):
+    if data_in & 0x800000:
+        return -((data_in ^ 0xffffff) + 1)
+    return data_in
+
+
+class ReadError(Exception):
+    """
+    A conversion was lost. `reason` is one of 'not_ready', 'timing', 'invalid'.
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class RPiGPIOBackend:
+    """
+    RPiGPIOBackend clocks the HX711 from Python with RPi.GPIO.
+
+    Unlike HX711._read it never recurses into get_raw_data_mean on a slow
+    pulse: the conversion is reported as a 'timing' error and the engine
+    simply retries on the next one.
+    """
+
+    def __init__(self, hx, ready_timeout=0.5):
+        self._hx = hx
+        self._ready_timeout = ready_timeout
+        self._wrong_gain = False  # the next conversion is at A/128, not the wanted setting
+
+    def read(self):
+        """
+        Returns: int signed raw conversion.
+
+        Raises:
+            ReadError: if the conversion was lost.
+        """
+        try:
+            value = self._read()
+        except ReadError as e:
+            if e.reason != 'invalid':
+                self._reset()
+            else:
+                self._wrong_gain = False  # its gain pulses were sent all the same
+            raise
+        if self._wrong_gain:
+            # converted at A/128 after the reset; its gain pulses selected
+            # the wanted setting for the next conversion
+            self._wrong_gain = False
+            raise ReadError('timing')
+        return value
+
+    def _reset(self):
+        # A lost read can leave the chip halfway through shifting out a
+        # conversion, with DOUT holding a data bit instead of signalling
+        # ready. Powering it down (PD_SCK high > 60 us) restarts it cleanly,
+        # but at channel A, gain 128.
+        GPIO.output(self._hx._pd_sck, True)
+        time.sleep(0.0001)
+        GPIO.output(self._hx._pd_sck, False)
+        self._wrong_gain = _gain_pulses(self._hx) != 1
+
+    def _read(self):
+        hx = self._hx
+        sck, dout = hx._pd_sck, hx._dout
+        output, read_pin, clock = GPIO.output, GPIO.input, time.perf_counter
+
+        output(sck, False)
+        deadline = clock() + self._ready_timeout
+        while read_pin(dout):
+            if clock() > deadline:
+                raise ReadError('not_ready')
+            time.sleep(0.001)
+
+        data_in = 0
+        for _ in range(24):
+            start = clock()
+            output(sck, True)
+            output(sck, False)
+            if clock() - start >= MAX_PULSE_SECONDS:
+                raise ReadError('timing')
+            data_in = (data_in << 1) | read_pin(dout)
+
+        for _ in range(_gain_pulses(hx)):
+            start = clock()
+            output(sck, True)
+            output(sck, False)
+            if clock() - start >= MAX_PULSE_SECONDS:
+                # the data is fine, but the chip reset to A/128 for the next one
+                raise ReadError('timing')
+
+        if data_in in (0x7fffff, 0x800000):
+            raise ReadError('invalid')
+        hx._current_channel = hx._wanted_channel
+        return _to_signed(data_in)
+
+    def close(self):
+        pass
+
+
+class PigpioBackend:
+    """
+    PigpioBackend lets the pigpio daemon generate the clock pulses as a DMA
+    timed waveform, so a pulse can never be stretched past 60 us by the
+    Python scheduler. DOUT is sampled from pigpio's edge notifications,
+    which carry hardware timestamps and arrive in order.
+
+    Requires the pigpiod daemon to be running.
+    """
+
+    PULSE_US = 5
+
+    def __init__(self, hx, host=None, ready_timeout=0.5):
+        import pigpio
+
+        self._pigpio = pigpio
+        self._hx = hx
+        self._ready_timeout = ready_timeout
+        self._pi = pigpio.pi(host) if host else pigpio.pi()
+        if not self._pi.connected:
+            raise RuntimeError('Cannot connect to pigpiod')
+        self._sck, self._dout = hx._pd_sck, hx._dout
+        self._pi.set_mode(self._sck, pigpio.OUTPUT)
+        self._pi.set_mode(self._dout, pigpio.INPUT)
+        self._pi.write(self._sck, 0)
+        self._waves = {}
+        self._bits = []
+        self._expected = 0
+        self._done = threading.Event()
+        self._data_level = self._pi.read(self._dout)
+        self._callbacks = [
+            self._pi.callback(self._dout, pigpio.EITHER_EDGE, self._on_data),
+            self._pi.callback(self._sck, pigpio.FALLING_EDGE, self._on_clock),
+        ]
+
+    def _wave(self, pulses):
+        wave_id = self._waves.get(pulses)
+        if wave_id is None:
+            mask = 1 << self._sck
+            self._pi.wave_add_generic(
+                [self._pigpio.pulse(mask, 0, self.PULSE_US),
+                 self._pigpio.pulse(0, mask, self.PULSE_US)] * pulses)
+            wave_id = self._waves[pulses] = self._pi.wave_create()
+        return wave_id
+
+    def _on_data(self, gpio, level, tick):
+        self._data_level = level
+
+    def _on_clock(self, gpio, level, tick):
+        # DOUT settles 0.1 us after the rising edge, before this falling edge
+        if len(self._bits) < self._expected:
+            self._bits.append(self._data_level)
+            if len(self._bits) == self._expected:
+                self._done.set()
+
+    def read(self):
+        deadline = time.perf_counter() + self._ready_timeout
+        while self._pi.read(self._dout):
+            if time.perf_counter() > deadline:
+                raise ReadError('not_ready')
+            time.sleep(0.001)
+
+        pulses = 24 + _gain_pulses(self._hx)
+        self._bits = []
+        self._expected = pulses
+        self._done.clear()
+        self._pi.wave_send_once(self._wave(pulses))
+        if not self._done.wait(0.05):
+            raise ReadError('timing')
+
+        data_in = 0
+        for bit in self._bits[:24]:
+            data_in = (data_in << 1) | bit
+        if data_in in (0x7fffff, 0x800000):
+            raise ReadError('invalid')
+        self._hx._current_channel = self._hx._wanted_channel
+        return _to_signed(data_in)
+
+    def close(self):
+        for callback in self._callbacks:
+            callback.cancel()
+        for wave_id in self._waves.values():
+            self._pi.wave_delete(wave_id)
+        self._pi.stop()
+
+
+BACKENDS = {
+    'rpi': RPiGPIOBackend,
+    'pigpio': PigpioBackend,
+}
+
+
+class SamplingEngine:
+    """
+    SamplingEngine reads the HX711 continuously on a dedicated thread and
+    stores every good conversion in a SampleRing.
+    """
+
+    def __init__(self, backend, ring_size=256, realtime_priority=None, max_retries=5):
+        """
+        Args:
+            backend: object with read() -> int raising ReadError, e.g. RPiGPIOBackend.
+            ring_size(int): samples kept in the ring buffer.
+            realtime_priority(int): Optional. SCHED_FIFO priority (1..99) for
+                the sampling thread. Needs CAP_SYS_NICE; ignored with a
+                warning if not permitted.
+            max_retries(int): consecutive failures before backing off 100 ms.
+        """
+        self._backend = backend
+        self.ring = SampleRing(ring_size)
+        self._realtime_priority = realtime_priority
+        self._max_retries = max_retries
+        self._stop = threading.Event()
+        self._thread = None
+        self._skip = 0
+        self._listeners = []
+        self.counters = {
+            'reads': 0,
+            'failed': 0,
+            'retried': 0,
+            'not_ready': 0,
+            'timing': 0,
+            'invalid': 0,
+            'skipped': 0,
+        }
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='hx711-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._backend.close()
+
+    def _set_realtime(self):
+        if not self._realtime_priority:
+            return
+        try:
+            # pid 0 is the calling thread
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self._realtime_priority))
+            logging.info(f"HX711 sampler running with SCHED_FIFO priority {self._realtime_priority}")
+        except (AttributeError, PermissionError, OSError) as e:
+            logging.warning(f"Cannot set real-time priority for the HX711 sampler: {e}")
+
+    def _run(self):
+        self._set_realtime()
+        failures = 0
+        while not self._stop.is_set():
+            self.counters['reads'] += 1
+            try:
+                value = self._backend.read()
+            except ReadError as e:
+                self.counters['failed'] += 1
+                self.counters[e.reason] += 1
+                failures += 1
+                if failures >= self._max_retries:
+                    time.sleep(0.1)
+                    failures = 0
+                continue
+            if failures:
+                self.counters['retried'] += 1
+                failures = 0
+            if self._skip:
+                self._skip -= 1
+                self.counters['skipped'] += 1
+                continue
+            timestamp = time.monotonic()
+            self.ring.append(value, timestamp)
+            for listener in self._listeners:
+                try:
+                    listener(timestamp, value)
+                except Exception:
+                    logging.exception("HX711 sample listener failed")
+
+    def add_listener(self, listener):
+        """
+        add_listener registers `listener(timestamp, raw_value)`, called on the
+        sampling thread for every good conversion. Keep it short.
+        """
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def flush(self, samples=1):
+        """
+        flush drops the next `samples` conversions, e.g. after a channel or
+        gain change when the first conversion still uses the old setting.
+        """
+        self._skip = samples
+
+    def take(self, readings, timeout=None):
+        """
+        take waits for `readings` conversions newer than the call.
+
+        Args:
+            readings(int): number of samples wanted.
+            timeout(float): Optional, by default 0.2 s per reading + 1 s.
+
+        Returns: list of int samples, possibly shorter on timeout.
+        """
+        if timeout is None:
+            timeout = 0.2 * readings + 1.0
+        start = self.ring.seq
+        self.ring.wait_for(start + readings, timeout)
+        fresh = min(self.ring.seq - start, readings)
+        return [int(v) for v in self.ring.last(fresh)[1]]
+
+    def take_into(self, out, readings, timeout=None):
+        """
+        take_into is take() writing into the preallocated array `out`.
+
+        Returns: numpy.ndarray view of `out`, possibly shorter on timeout.
+        """
+        if timeout is None:
+            timeout = 0.2 * readings + 1.0
+        start = self.ring.seq
+        self.ring.wait_for(start + readings, timeout)
+        fresh = min(self.ring.seq - start, readings)
+        return self.ring.last_into(fresh, out)
+
+    def stats(self):
+        """
+        Returns: dict copy of the read counters plus the ring buffer fill.
+        """
+        stats = dict(self.counters)
+        stats['samples'] = self.ring.seq
+        return stats
@@ -0,0 +1,266 @@
+"""
+Micro-batching of detector calls from several checkout lanes.
+
+One loaded detector is shared by all lanes of the checkout server
+(lane_server.py). Each lane gets a LaneClient, a callable with the
+detector interface, so its FramePipeline works unchanged; the calls of
+all lanes are queued and a single worker thread runs them through the
+model together (detector.infer_batch), so N lanes cost one forward pass
+of N frames instead of N passes.
+
+A batch is dispatched as soon as it is full (`max_batch`, or a frame from
+every lane), when the oldest request has waited `max_wait` seconds, or
+earlier if waiting any longer would make that request miss its lane's
+latency SLO. Per-lane latencies are kept in LaneStats.
+"""
+import collections
+import logging
+import threading
+import time
+
+
+class LaneStats:
+    """
+    Latency of the detector calls of one lane against its SLO.
+    """
+
+    def __init__(self, slo, window=200):
+        """
+        Args:
+            slo(float): target seconds from submitting a frame to its detections.
+            window(int): recent calls the percentiles are computed over.
+        """
+        self.slo = slo
+        self._latencies = collections.deque(maxlen=window)
+        self._waits = collections.deque(maxlen=window)
+        self.calls = 0
+        self.violations = 0
+
+    def record(self, latency, wait):
+        self._latencies.append(latency)
+        self._waits.append(wait)
+        self.calls += 1
+        if latency > self.slo:
+            self.violations += 1
+
+    def percentile(self, q):
+        """
+        Returns: float q-th percentile (0..100) of the recent latencies in seconds, 0.0 if none.
+        """
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100.0))]
+
+    def summary(self):
+        """
+        Returns: dict with the call count, p50/p95/max latency and mean queue
+            wait in ms, the SLO in ms and how many calls missed it.
+        """
+        waits = list(self._waits)
+        return {
+            'calls': self.calls,
+            'p50_ms': self.percentile(50) * 1000.0,
+            'p95_ms': self.percentile(95) * 1000.0,
+            'max_ms': max(self._latencies, default=0.0) * 1000.0,
+            'wait_ms': sum(waits) / len(waits) * 1000.0 if waits else 0.0,
+            'slo_ms': self.slo * 1000.0,
+            'violations': self.violations,
+        }
+
+
+class _Request:
+    __slots__ = ('lane', 'frame', 'submitted_at', 'deadline', 'done', 'result', 'error')
+
+    def __init__(self, lane, frame, submitted_at, deadline):
+        self.lane = lane
+        self.frame = frame
+        self.submitted_at = submitted_at
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LaneClient:
+    """
+    LaneClient is the detector as seen by one lane: calling it submits the
+    frame to the shared MicroBatcher and blocks until its batch has run.
+    """
+
+    def __init__(self, batcher, lane):
+        self._batcher = batcher
+        self.lane = lane
+        self.names = batcher.names
+
+    def __call__(self, frame):
+        return self._batcher.submit(self.lane, frame)
+
+    def infer_batch(self, frames):
+        return self._batcher.submit_many(self.lane, frames)
+
+
+class MicroBatcher:
+    """
+    MicroBatcher runs the frames submitted by all lanes through one shared
+    detector in batches.
+    """
+
+    def __init__(self, model, max_batch=8, max_wait=0.01, slo=0.3):
+        """
+        Args:
+            model(callable): detector; batched through its infer_batch(frames) if it has one.
+            max_batch(int): most frames in one forward pass.
+            max_wait(float): longest seconds a frame waits for others to join its batch.
+            slo(float): default per-lane latency target in seconds.
+        """
+        self._model = model
+        self.names = model.names
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._slo = slo
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lanes = {}
+        self._batch_time = None  # smoothed seconds per forward pass, to plan around the SLO
+        self.batches = 0
+        self.frames = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._cond:
+            while self._pending:
+                request = self._pending.popleft()
+                request.error = RuntimeError("Inference batcher stopped")
+                request.done.set()
+
+    def client(self, lane, slo=None):
+        """
+        client registers a lane.
+
+        Args:
+            lane(str): lane id.
+            slo(float): Optional. Latency target of this lane in seconds,
+                by default the batcher's.
+
+        Returns: LaneClient to use as the lane's detector.
+        """
+        self._lanes[lane] = LaneStats(self._slo if slo is None else slo)
+        return LaneClient(self, lane)
+
+    def submit(self, lane, frame):
+        """
+        submit queues one frame of `lane` and waits for its detections.
+
+        Returns: Detections
+
+        Raises:
+            Exception: whatever the detector raised for the batch.
+        """
+        return self.submit_many(lane, [frame])[0]
+
+    def submit_many(self, lane, frames):
+        """
+        submit_many queues several frames of `lane` at once, so they share
+        batches, and waits for all their detections.
+
+        Returns: list of Detections, one per frame.
+        """
+        now = time.perf_counter()
+        deadline = now + self._lanes[lane].slo
+        requests = [_Request(lane, frame, now, deadline) for frame in frames]
+        with self._cond:
+            if self._stop.is_set():
+                raise RuntimeError("Inference batcher stopped")
+            self._pending.extend(requests)
+            self._cond.notify_all()
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+        return [request.result for request in requests]
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._stop.is_set():
+                    return []
+                if not self._pending:
+                    self._cond.wait(0.1)
+                    continue
+                if len(self._pending) >= min(self._max_batch, len(self._lanes)):
+                    break  # full, or every lane is waiting already
+                oldest = self._pending[0]
+                dispatch_at = oldest.submitted_at + self._max_wait
+                if self._batch_time is not None:
+                    # leave the oldest frame enough time to be inferred within its SLO
+                    dispatch_at = min(dispatch_at, oldest.deadline - self._batch_time)
+                remaining = dispatch_at - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(self._max_batch, len(self._pending)))]
+
+    def _infer(self, frames):
+        batched = getattr(self._model, 'infer_batch', None)
+        if batched is not None:
+            return batched(frames)
+        return [self._model(frame) for frame in frames]
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = self._infer([request.frame for request in batch])
+            except Exception as e:
+                logging.exception(f"Batched inference of {len(batch)} frames failed")
+                results, error = [None] * len(batch), e
+            else:
+                error = None
+            finished = time.perf_counter()
+            elapsed = finished - started
+            self._batch_time = elapsed if self._batch_time is None else 0.8 * self._batch_time + 0.2 * elapsed
+            self.batches += 1
+            self.frames += len(batch)
+            for request, result in zip(batch, results):
+                request.result = result
+                request.error = error
+                self._lanes[request.lane].record(finished - request.submitted_at,
+                                                 started - request.submitted_at)
+                request.done.set()
+
+    def stats(self):
+        """
+        Returns: dict with the batch count, mean batch size, smoothed batch
+            time in ms and the LaneStats summary of every lane.
+        """
+        return {
+            'batches': self.batches,
+            'mean_batch': self.frames / self.batches if self.batches else 0.0,
+            'batch_ms': (self._batch_time or 0.0) * 1000.0,
+            'lanes': {lane: stats.summary() for lane, stats in self._lanes.items()},
+        }
+
+    def slo_misses(self, q=95):
+        """
+        Returns: list of (lane, p-q latency in seconds, slo) for the lanes whose
+            recent q-th percentile latency is above their SLO.
+        """
+        return [(lane, stats.percentile(q), stats.slo) for lane, stats in self._lanes.items()
+                if stats.calls and stats.percentile(q) > stats.slo]
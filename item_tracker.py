@@ -0,0 +1,353 @@
+"""
+Hands-free checkout: items are added to the cart as they enter the tray.
+
+IouTracker follows the detections from frame to frame and gives every
+item a stable track id. It is a NumPy-only, ByteTrack style tracker:
+confident detections are matched to the tracks first, by class-aware IoU,
+and the low-confidence ones are then only used to keep unmatched tracks
+alive (an item partly covered by a hand), never to start new ones.
+
+TrayRegistrar pairs the tracks with the settled weight changes of the
+scale. An item is registered (added to the cart) only when a new track
+and a positive weight change that matches its catalog weight come within
+`match_window` seconds of each other, and deregistered when its track is
+lost together with a matching negative change. A track registers at most
+once and every weight change is used at most once, so an item that is
+lost and found again by the detector, or held over the tray without
+being put down, is never counted twice.
+"""
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+from basket import solve_basket
+
+
+def iou_matrix(a, b):
+    """
+    Args:
+        a(numpy.ndarray): Nx4 xyxy boxes.
+        b(numpy.ndarray): Mx4 xyxy boxes.
+
+    Returns: NxM numpy.ndarray of the IoU of every pair.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def _greedy_match(iou, threshold):
+    """
+    Returns: list of (row, col) pairs, highest IoU first, each row and
+        column used once and every pair above `threshold`.
+    """
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    iou = iou.copy()
+    while True:
+        row, col = np.unravel_index(iou.argmax(), iou.shape)
+        if iou[row, col] <= threshold:
+            return pairs
+        pairs.append((int(row), int(col)))
+        iou[row, :] = 0
+        iou[:, col] = 0
+
+
+class Track:
+    """
+    One item followed across frames.
+
+    confirmed(bool): seen in `min_hits` frames, i.e. not a one-frame blip.
+    entry(CatalogEntry): variant it was registered as, None until registered.
+    weight(float): grams it was registered with.
+    """
+    __slots__ = ('id', 'cls', 'name', 'box', 'conf', 'hits', 'misses', 'confirmed',
+                 'confirmed_at', 'last_seen', 'lost_at', 'entry', 'weight')
+
+    def __init__(self, track_id, cls, name, box, conf, now):
+        self.id = track_id
+        self.cls = cls
+        self.name = name
+        self.box = box
+        self.conf = conf
+        self.hits = 1
+        self.misses = 0
+        self.confirmed = False
+        self.confirmed_at = None
+        self.last_seen = now
+        self.lost_at = None
+        self.entry = None
+        self.weight = None
+
+    @property
+    def registered(self):
+        return self.entry is not None
+
+    def __repr__(self):
+        return f"Track({self.id}, {self.name!r})"
+
+
+class IouTracker:
+    """
+    IouTracker assigns stable ids to the detections of consecutive frames.
+    """
+
+    def __init__(self, iou_threshold=0.3, high_conf=0.5, min_hits=3, max_unseen=1.0):
+        """
+        Args:
+            iou_threshold(float): min IoU for a detection to continue a track.
+            high_conf(float): detections at or above this start and match
+                tracks first; lower ones only keep existing tracks alive.
+            min_hits(int): frames a track must be seen in to be confirmed.
+            max_unseen(float): seconds a confirmed track survives without a
+                detection; in seconds, not frames, so removals are reported
+                as quickly at 3 FPS as at 30.
+        """
+        self._iou_threshold = iou_threshold
+        self._high_conf = high_conf
+        self._min_hits = min_hits
+        self.max_unseen = max_unseen
+        self._next_id = 1
+        self.tracks = []
+
+    def _match(self, tracks, boxes, classes):
+        if not tracks or not len(boxes):
+            return []
+        iou = iou_matrix(np.array([track.box for track in tracks]), boxes)
+        iou[np.array([track.cls for track in tracks])[:, None] != classes[None, :]] = 0.0
+        return _greedy_match(iou, self._iou_threshold)
+
+    def update(self, detections, now=None):
+        """
+        update advances the tracks by one frame.
+
+        Args:
+            detections(detector.Detections): boxes of the frame.
+            now(float): Optional. time.perf_counter() the frame was captured at.
+
+        Returns: ([Track] confirmed in this frame, [Track] confirmed tracks lost in this frame)
+        """
+        now = time.perf_counter() if now is None else now
+        xyxy = np.asarray(detections.xyxy, np.float32).reshape(-1, 4)
+        conf = np.asarray(detections.conf, np.float32)
+        cls = np.asarray(detections.cls, np.int64)
+        high = conf >= self._high_conf
+
+        matched = set()
+        unmatched = list(self.tracks)
+        for stage in (high, ~high):
+            index = np.flatnonzero(stage)
+            pairs = self._match(unmatched, xyxy[index], cls[index])
+            for row, col in pairs:
+                track, d = unmatched[row], index[col]
+                track.box, track.conf = xyxy[d], float(conf[d])
+                track.hits += 1
+                track.misses = 0
+                track.last_seen = now
+                matched.add(int(d))
+            taken = {row for row, _ in pairs}
+            unmatched = [track for i, track in enumerate(unmatched) if i not in taken]
+
+        born, lost = [], []
+        for track in self.tracks:
+            if not track.confirmed and track.hits >= self._min_hits:
+                track.confirmed = True
+                track.confirmed_at = now
+                born.append(track)
+        for track in unmatched:
+            track.misses += 1
+            if not track.confirmed:
+                track.hits = 0  # a tentative track must be seen in consecutive frames
+        alive = []
+        for track in self.tracks:
+            if now - track.last_seen > self.max_unseen or (not track.confirmed and track.hits == 0):
+                if track.confirmed:
+                    track.lost_at = now
+                    lost.append(track)
+                continue
+            alive.append(track)
+        for d in np.flatnonzero(high):
+            if int(d) not in matched:
+                alive.append(Track(self._next_id, int(cls[d]), detections.names[int(cls[d])],
+                                   xyxy[d], float(conf[d]), now))
+                self._next_id += 1
+        self.tracks = alive
+        return born, lost
+
+
+class TrayRegistrar:
+    """
+    TrayRegistrar decides from the tracks and the scale which items enter
+    and leave the cart.
+
+    update() is called with every inferred frame and weight_settled() with
+    every settled weight (it may be called from the sampling thread); the
+    cart changes come back from update() as ('add', Track) and
+    ('remove', Track) events.
+    """
+
+    def __init__(self, prices, tracker=None, match_window=3.0, tolerance=2.0, item_tolerance=2.0,
+                 baseline=0.0):
+        """
+        Args:
+            prices(callable): returns the current PriceCatalog.
+            tracker(IouTracker): Optional, by default one with default settings.
+            match_window(float): max seconds between a track change and its weight change.
+            tolerance(float): grams of weighing error (one sigma), see basket.solve_basket.
+            item_tolerance(float): grams of packaging error per item (one sigma).
+            baseline(float): settled weight on the tray when the registrar starts.
+
+        Raises:
+            ValueError: if the tracker keeps unseen tracks longer than `match_window`
+        """
+        self._prices = prices
+        self.tracker = tracker or IouTracker()
+        if self.tracker.max_unseen >= match_window:
+            raise ValueError(f'Parameter "match_window" ({match_window} s) has to be longer than '
+                             f'the tracker\'s max_unseen ({self.tracker.max_unseen} s).')
+        self._match_window = match_window
+        self._tolerance = tolerance
+        self._item_tolerance = item_tolerance
+        self._settled = deque()  # (time, weight) from weight_settled(), any thread
+        self._baseline = baseline
+        self._deltas = []  # [time, grams] not matched yet
+        self._lost = []  # registered tracks lost, waiting for their weight to go
+        self.unmatched_weight = 0  # weight changes no track accounted for (possible mis-scans)
+
+    def weight_settled(self, weight):
+        self._settled.append((time.perf_counter(), weight))
+
+    def reset(self):
+        """
+        reset starts a new cart: items still on the tray are not in it.
+        """
+        for track in self.tracker.tracks:
+            track.entry = track.weight = None
+            # already on the tray: not the next customer's, and never registered later
+            track.confirmed, track.confirmed_at = True, None
+        self._deltas = []
+        self._lost = []
+
+    def _pending(self):
+        # tracks that appeared and were not matched to a weight change yet
+        return [track for track in self.tracker.tracks
+                if track.confirmed and not track.registered and track.confirmed_at is not None]
+
+    def update(self, detections, now=None):
+        """
+        update feeds one inferred frame to the tracker and matches the
+        track and weight changes.
+
+        Args:
+            detections(detector.Detections): boxes of the frame.
+            now(float): Optional. time.perf_counter() the frame was captured at.
+
+        Returns: list of ('add', Track) and ('remove', Track) cart events.
+        """
+        now = time.perf_counter() if now is None else now
+        _, lost = self.tracker.update(detections, now)
+        while self._settled:
+            at, weight = self._settled.popleft()
+            self._deltas.append([at, weight - self._baseline])
+            self._baseline = weight
+        self._lost.extend(track for track in lost if track.registered)
+
+        events = []
+        for delta in list(self._deltas):
+            at, grams = delta
+            if grams > 0:
+                tracks = self._register(grams, at)
+                events.extend(('add', track) for track in tracks)
+            else:
+                tracks = self._deregister(-grams, at)
+                events.extend(('remove', track) for track in tracks)
+            if tracks:
+                self._deltas.remove(delta)
+            elif grams <= 0 and self._unseen_registered():
+                continue  # an item in the cart is out of sight: it may be the one taken off
+            elif now - at > self._match_window:
+                self._deltas.remove(delta)
+                self.unmatched_weight += 1
+                logging.warning(f"Weight changed by {grams:+.0f} g without a matching item on camera")
+        self._lost = [track for track in self._lost if now - track.lost_at <= self._match_window]
+        return events
+
+    def _unseen_registered(self):
+        # registered tracks missing from the last frames but not declared lost yet
+        return any(track.registered and track.misses for track in self.tracker.tracks)
+
+    def _register(self, grams, at):
+        pending = self._pending()
+        recent = [track for track in pending if abs(track.confirmed_at - at) <= self._match_window]
+        prices = self._prices()
+        # the items that just appeared, all together (put down at once) and
+        # each on its own, then any other unregistered one (held over the
+        # tray for a while before it was put down)
+        groups = [recent] if recent else []
+        if len(recent) > 1:
+            groups += [[track] for track in recent]
+        groups += [[track] for track in pending if track not in recent]
+        for group in groups:
+            matched = self._match_weight(group, grams, prices)
+            if matched:
+                return matched
+        return []
+
+    def _match_weight(self, tracks, grams, prices):
+        if len(tracks) == 1:
+            variants = prices.variants(tracks[0].name)
+            if variants is not None and variants.entries[0].sold_by_weight:
+                tracks[0].entry, tracks[0].weight = variants.entries[0], grams
+                return tracks
+        counts = {}
+        for track in tracks:
+            counts[track.name] = counts.get(track.name, 0) + 1
+        try:
+            solution = solve_basket(counts, grams, prices, count_slack=0, tolerance=self._tolerance,
+                                    item_tolerance=self._item_tolerance)
+        except ValueError:
+            return []
+        if solution is None or solution.ambiguous:
+            return []
+        entries = {}
+        for entry, count in solution.lines:
+            entries.setdefault(entry.name, []).extend([entry] * count)
+        for track in tracks:
+            track.entry = entries[track.name].pop()
+            track.weight = track.entry.weight
+        return tracks
+
+    def _deregister(self, grams, at):
+        sigma = (self._tolerance ** 2 + self._item_tolerance ** 2) ** 0.5
+        candidates = [track for track in self._lost if abs(track.lost_at - at) <= self._match_window
+                      and abs(track.weight - grams) <= 3 * sigma]
+        if not candidates:
+            return []
+        track = min(candidates, key=lambda track: abs(track.weight - grams))
+        self._lost.remove(track)
+        return [track]
+
+    def draw(self, image):
+        """
+        draw labels every tracked item with its id, marking the ones in the cart.
+        """
+        import cv2
+
+        for track in self.tracker.tracks:
+            if not track.confirmed:
+                continue
+            x1, y1 = int(track.box[0]), int(track.box[3])
+            label = f"#{track.id}" + (" in cart" if track.registered else "")
+            cv2.putText(image, label, (x1, y1 + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (0, 255, 0) if track.registered else (0, 200, 255), 1, cv2.LINE_AA)
+        return image
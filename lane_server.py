@@ -0,0 +1,381 @@
+"""
+Checkout server: one process driving several camera + scale stations.
+
+final.py runs one lane with its own copy of the detector. lane_server.py
+runs every lane in STATIONS concurrently and shares a single loaded
+detector between them: the frames of all lanes go through an
+inference_batcher.MicroBatcher, which runs them in one batched forward
+pass and keeps per-lane latency against LANE_SLO.
+
+Lanes run hands-free. When the load on a lane's scale settles higher
+than before, the items the detector sees (voting over the frames taken
+since the load settled) in addition to those already on the tray are
+added to the lane's cart, priced at the weight they added. Taking items
+off changes neither the cart nor the items counted on the tray until the
+tray is empty again. The receipt is handed over to the lane's payment UI
+once the tray has stayed empty for CHECKOUT_IDLE seconds. Each lane has
+its own calibration file and cart socket.
+
+    python3 lane_server.py
+    RETAIL_HARDWARE=sim RETAIL_SIM_TRACE=sim_traces/basic_checkout.csv python3 lane_server.py --lanes 4
+"""
+import argparse
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+
+import hardware
+import final
+from calibration import CalibrationStore, auto_tare
+from cart_channel import CartPublisher, DEFAULT_SOCKET
+from catalog import CatalogService
+from detector import RoiDetector, detect_voted, load_detector
+from frame_pipeline import FramePipeline
+from inference_batcher import MicroBatcher
+from scale_monitor import ScaleMonitor
+from scale_trigger import LoadChangeTrigger
+from zero_tracker import ZeroTracker
+
+MAX_BATCH = 8  # most frames in one forward pass of the shared detector
+MAX_WAIT = 0.01  # seconds a frame may wait for the other lanes' frames
+LANE_SLO = 0.3  # target seconds from a frame to its detections, per lane
+CHECKOUT_IDLE = 15.0  # seconds the tray must stay empty before the receipt is handed over
+EMPTY_TRAY = 5.0  # grams below which the tray counts as empty
+STATS_INTERVAL = 30.0  # seconds between lane latency reports
+
+
+class Station:
+    """
+    Station is the hardware of one checkout lane.
+    """
+
+    def __init__(self, lane, camera_index, dout_pin, pd_sck_pin, roi=None, slo=None,
+                 ui_port=None):
+        """
+        Args:
+            lane(str): lane id, used in file and socket names.
+            camera_index(int): camera of the lane.
+            dout_pin(int): BCM pin of the HX711 DOUT.
+            pd_sck_pin(int): BCM pin of the HX711 PD_SCK.
+            roi((int, int, int, int)): Optional. x, y, width, height of the tray in camera pixels.
+            slo(float): Optional. Latency target in seconds, by default LANE_SLO.
+            ui_port(int): Optional. Port of the lane's payment UI.
+        """
+        self.lane = str(lane)
+        self.camera_index = camera_index
+        self.dout_pin = dout_pin
+        self.pd_sck_pin = pd_sck_pin
+        self.roi = roi
+        self.slo = LANE_SLO if slo is None else slo
+        self.ui_port = ui_port
+        self.calibration_file = f"calibration_lane{self.lane}.json"
+        self.cart_socket = f"{os.path.splitext(DEFAULT_SOCKET)[0]}_lane{self.lane}.sock"
+        self.receipt_file = f"receipt_lane{self.lane}.json"
+
+
+# Replace with your lanes: one camera and one HX711 each
+STATIONS = [
+    Station('1', camera_index=0, dout_pin=27, pd_sck_pin=17, ui_port=8501),
+    Station('2', camera_index=1, dout_pin=22, pd_sck_pin=23, ui_port=8502),
+]
+
+
+class Lane:
+    """
+    Lane runs the checkout of one Station on its own thread, with the
+    shared detector behind a MicroBatcher client.
+    """
+
+    def __init__(self, station, detector, catalog_service):
+        """
+        Args:
+            station(Station): hardware of the lane.
+            detector(callable): the lane's client of the shared detector.
+            catalog_service(CatalogService): shared price list.
+        """
+        self.station = station
+        self._detector = detector
+        if station.roi is not None:
+            self._detector = RoiDetector(detector, station.roi)
+        self._catalog_service = catalog_service
+        self._settled = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hx = None
+        self.monitor = None
+        self.store = None
+        self.tracker = None
+        self.publisher = None
+        self.payment_ui = None
+        self.receipts = 0
+        self.items = 0
+
+    def setup(self, recalibrate=False):
+        """
+        setup opens the scale and the cart channel, and calibrates the scale
+        (interactively if it has no saved calibration).
+
+        Returns: bool True if the lane is ready.
+        """
+        station = self.station
+        self.hx = final.initialize_hx711(station.dout_pin, station.pd_sck_pin)
+        self.monitor = ScaleMonitor(self.hx).start()
+        self.store = CalibrationStore.load(station.calibration_file)
+        logging.info(f"Lane {station.lane}: calibrating")
+        if not final.load_calibration(self.hx, self.store, recalibrate):
+            logging.error(f"Lane {station.lane}: calibration failed, lane disabled")
+            return False
+        if final.ZERO_TRACKING:
+            self.tracker = ZeroTracker(self.hx, self.monitor, self.store).start()
+        self.publisher = CartPublisher(station.cart_socket, station.receipt_file,
+                                       on_message=final.on_cart_message).start()
+        return True
+
+    def start_payment_ui(self):
+        if self.station.ui_port is None:
+            return
+        env = dict(os.environ, RETAIL_CART_SOCKET=self.station.cart_socket,
+                   RETAIL_RECEIPT_FILE=self.station.receipt_file)
+        try:
+            self.payment_ui = subprocess.Popen(
+                final.PAYMENT_UI + ["--server.port", str(self.station.ui_port)], env=env)
+        except OSError as e:
+            logging.error(f"Lane {self.station.lane}: cannot start the payment UI: {e}")
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"lane-{self.station.lane}",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        if self.payment_ui:
+            self.payment_ui.terminate()
+        if self.publisher:
+            self.publisher.stop()
+        if self.tracker:
+            self.tracker.stop()
+        if self.monitor:
+            self.monitor.stop()
+        if self.hx:
+            self.hx.get_sampler().stop()
+
+    def _run(self):
+        while not self._stop.is_set():
+            auto_tare(self.hx, self.monitor, self.store, tolerance=final.ZERO_TOLERANCE,
+                      max_drift=final.AUTO_TARE_MAX)
+            cap = hardware.open_camera(self.station.camera_index)
+            pipeline = FramePipeline(cap, self._detector, on_demand=True).start()
+            reading = self.monitor.wait_stable(timeout=3.0) or self.monitor.reading()
+            baseline = reading.weight if reading is not None else 0.0
+            trigger = LoadChangeTrigger(
+                self.monitor, lambda weight: self._settled.put((time.perf_counter(), weight)))
+            trigger.baseline = baseline
+            trigger.start()
+            try:
+                self._serve(pipeline, baseline)
+            finally:
+                trigger.stop()
+                pipeline.stop()
+                cap.release()
+            if not self._stop.is_set():
+                logging.error(f"Lane {self.station.lane}: camera failed, reopening")
+                self._stop.wait(1.0)
+
+    def _serve(self, pipeline, baseline=0.0):
+        """
+        _serve adds the items put on the tray to the cart until the lane
+        stops or the camera fails.
+
+        Args:
+            pipeline(FramePipeline): the lane's running camera pipeline.
+            baseline(float): settled weight on the tray when serving starts.
+        """
+        object_data = defaultdict(lambda: {'count': 0, 'total_weight': 0})
+        session, cart_totals = final.new_session_id(), {}
+        empty_since = None
+        on_tray = Counter()  # instances seen on the tray since it was last empty
+        while not self._stop.is_set() and not pipeline.failed:
+            try:
+                settled_at, weight = self._settled.get(timeout=0.2)
+            except queue.Empty:
+                weight = None
+
+            if weight is not None:
+                added_weight, baseline = weight - baseline, weight
+                if weight < EMPTY_TRAY:
+                    empty_since = time.monotonic()
+                    on_tray = Counter()
+                else:
+                    empty_since = None
+                    if added_weight >= EMPTY_TRAY:
+                        self._add(pipeline, settled_at, added_weight, on_tray, object_data, session,
+                                  cart_totals)
+                    else:
+                        logging.info(f"Lane {self.station.lane}: load went down by {-added_weight:.0f} g, "
+                                     f"the cart is unchanged")
+                continue
+
+            if object_data and empty_since is not None and time.monotonic() - empty_since >= CHECKOUT_IDLE:
+                prices = self._catalog_service.current()
+                total_price, receipt = final.calculate_total_price_with_nearest_weight(object_data, prices)
+                final.hand_over_receipt(self.publisher, receipt, total_price, prices.version, session)
+                self.receipts += 1
+                object_data = defaultdict(lambda: {'count': 0, 'total_weight': 0})
+                session, cart_totals = final.new_session_id(), {}
+                empty_since = None
+
+    def _add(self, pipeline, settled_at, added_weight, on_tray, object_data, session, cart_totals):
+        """
+        _add adds the items the detector sees on the tray in addition to
+        `on_tray`, priced at the weight they added, and counts them into
+        `on_tray` if they were added.
+        """
+        packets = pipeline.recent_frames(final.VOTE_FRAMES, settled_at)
+        if not packets:
+            logging.error(f"Lane {self.station.lane}: timed out waiting for camera frames.")
+            return
+        # the frames go to the shared detector together, as one batch
+        detections = detect_voted(self._detector, [packet.frame for packet in packets],
+                                  final.VOTE_MIN_RATIO)
+        prices = self._catalog_service.current()
+        counts = Counter(final.count_instances(detections))
+        new_counts = dict(counts - on_tray)
+        if not new_counts:
+            logging.warning(f"Lane {self.station.lane}: {added_weight:.0f} g put down, but no new item "
+                            f"on camera")
+            on_tray |= counts
+            return
+        if final.BASKET_MODE and final.is_basket(new_counts, prices):
+            if final.add_basket_to_cart(new_counts, added_weight, object_data, self.publisher,
+                                        session, prices, cart_totals):
+                on_tray |= counts
+                self.items += sum(new_counts.values())
+            return
+        if len(new_counts) > 1:
+            logging.warning("Two or more different objects detected. Remove one to add to the cart and continue.")
+            return
+        final.add_to_cart({next(iter(new_counts)): 1}, final.round_to_nearest_five(added_weight), object_data,
+                          self.publisher, session, prices, cart_totals)
+        on_tray |= counts
+        self.items += 1
+
+
+class CheckoutServer:
+    """
+    CheckoutServer runs the lanes of several stations with one shared detector.
+    """
+
+    def __init__(self, stations, model, catalog_service, max_batch=MAX_BATCH, max_wait=MAX_WAIT,
+                 slo=LANE_SLO):
+        """
+        Args:
+            stations([Station]): the lanes to run.
+            model(callable): the loaded detector, shared by all lanes.
+            catalog_service(CatalogService): shared price list.
+            max_batch(int): most frames in one forward pass.
+            max_wait(float): seconds a frame may wait for other lanes' frames.
+            slo(float): default per-lane latency target in seconds.
+        """
+        self.batcher = MicroBatcher(model, max_batch=max_batch, max_wait=max_wait, slo=slo)
+        self.lanes = [Lane(station, self.batcher.client(station.lane, station.slo), catalog_service)
+                      for station in stations]
+        self._stop = threading.Event()
+        self._reporter = None
+
+    def start(self, recalibrate=False, payment_ui=False):
+        """
+        start calibrates every lane, one after the other, then runs them.
+
+        Returns: list of the Lanes that started.
+        """
+        self.batcher.start()
+        ready = [lane for lane in self.lanes if lane.setup(recalibrate)]
+        for lane in ready:
+            if payment_ui:
+                lane.start_payment_ui()
+            lane.start()
+        self._stop.clear()
+        self._reporter = threading.Thread(target=self._report, name='lane-stats', daemon=True)
+        self._reporter.start()
+        logging.info(f"Serving {len(ready)} of {len(self.lanes)} lanes")
+        return ready
+
+    def stop(self):
+        self._stop.set()
+        for lane in self.lanes:
+            lane.stop()
+        self.batcher.stop()
+        if self._reporter:
+            self._reporter.join(2.0)
+            self._reporter = None
+
+    def _report(self):
+        while not self._stop.wait(STATS_INTERVAL):
+            self.log_stats()
+
+    def log_stats(self):
+        stats = self.batcher.stats()
+        logging.info(f"Shared detector: {stats['batches']} batches, mean size {stats['mean_batch']:.1f}, "
+                     f"{stats['batch_ms']:.0f} ms per batch")
+        for lane, summary in stats['lanes'].items():
+            logging.info(f"Lane {lane}: {summary['calls']} inferences, p50 {summary['p50_ms']:.0f} ms, "
+                         f"p95 {summary['p95_ms']:.0f} ms (SLO {summary['slo_ms']:.0f} ms, "
+                         f"{summary['violations']} missed)")
+        for lane, p95, slo in self.batcher.slo_misses():
+            logging.warning(f"Lane {lane} misses its latency SLO: p95 {p95 * 1000:.0f} ms > {slo * 1000:.0f} ms")
+
+
+def load_shared_model():
+    if hardware.is_simulated() and hardware.SIM_TRACE:
+        return load_detector('trace', hardware.SIM_TRACE)
+    # the lane ROIs are cropped before batching, the shared model sees the crops
+    return load_detector(final.DETECTOR_BACKEND, final.MODEL_PATH, num_threads=final.DETECTOR_THREADS,
+                         dynamic_batch=True)
+
+
+def simulated_stations(count):
+    """
+    Returns: list of `count` Stations on distinct pins, for simulation runs.
+    """
+    return [Station(str(i + 1), camera_index=i, dout_pin=2 * i + 2, pd_sck_pin=2 * i + 3)
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-lane checkout server")
+    parser.add_argument('--recalibrate', action='store_true',
+                        help="calibrate every lane interactively instead of using its saved calibration")
+    parser.add_argument('--payment-ui', action='store_true', help="start a payment UI per lane")
+    parser.add_argument('--lanes', type=int, help="simulate this many lanes instead of STATIONS")
+    args = parser.parse_args()
+    if args.lanes and not hardware.is_simulated():
+        parser.error("--lanes needs RETAIL_HARDWARE=sim")
+
+    stations = simulated_stations(args.lanes) if args.lanes else STATIONS
+    catalog_service = CatalogService(final.CATALOG_XML, poll_interval=final.CATALOG_POLL_INTERVAL).start()
+    server = CheckoutServer(stations, load_shared_model(), catalog_service)
+    try:
+        server.start(args.recalibrate, args.payment_ui)
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.log_stats()
+        server.stop()
+        hardware.GPIO.cleanup()
+        catalog_service.stop()
+
+
+if __name__ == "__main__":
+    main()
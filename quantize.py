@@ -0,0 +1,162 @@
+"""
+INT8 post-training quantization of the checkout detector.
+
+Quantizes an FP32 OpenVINO export with NNCF using a calibration folder of
+shelf images, writes the INT8 model next to the FP32 one and reports
+per-class mAP, per-frame latency and memory for both models.
+
+    python3 quantize.py --calib path/to/shelf/images
+    python3 quantize.py --calib calib/ --eval val/images --report int8_report.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+
+import cv2
+
+from detector import OpenVINODetector, load_metadata, letterbox
+from evaluation import evaluate, list_images
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'models', 'best_openvino_model')
+
+
+def _model_xml(model_dir):
+    xml_files = [f for f in os.listdir(model_dir) if f.endswith('.xml')]
+    if not xml_files:
+        raise FileNotFoundError(f"No OpenVINO .xml model in {model_dir}")
+    return os.path.join(model_dir, xml_files[0])
+
+
+def _head_ignored_scope(ov_model):
+    """
+    The YOLOv8 detection head decodes boxes with Add/Sub/Mul/Div and a DFL
+    softmax; quantizing those ops costs a lot of box accuracy for no speed,
+    so they stay in FP32, as the ultralytics exporter does.
+    """
+    import nncf
+
+    indices = [int(m) for op in ov_model.get_ops()
+               for m in re.findall(r'model\.(\d+)', op.get_friendly_name())]
+    head = f"model.{max(indices)}" if indices else "model.22"
+    head = re.escape(head)
+    return nncf.IgnoredScope(
+        patterns=[f".*{head}/.*/Add", f".*{head}/.*/Sub*", f".*{head}/.*/Mul*",
+                  f".*{head}/.*/Div*", f".*{head}\\.dfl.*"],
+        types=["Sigmoid"],
+        validate=False,
+    )
+
+
+def quantize(model_dir, calib_dir, output_dir=None, subset_size=300):
+    """
+    quantize writes an INT8 copy of the OpenVINO model in `model_dir`.
+
+    Args:
+        model_dir(str): FP32 *_openvino_model directory.
+        calib_dir(str): folder of calibration images.
+        output_dir(str): Optional, by default `<model_dir>` with `_int8` added
+            before `_openvino_model`, e.g. models/best_int8_openvino_model.
+        subset_size(int): max calibration images used.
+
+    Returns: str the output directory
+    """
+    import nncf
+    import openvino as ov
+
+    metadata = load_metadata(model_dir)
+    images = list_images(calib_dir)
+    if not images:
+        raise ValueError(f"No calibration images in {calib_dir}")
+
+    def transform(path):
+        padded, _, _ = letterbox(cv2.imread(path), metadata['imgsz'])
+        return cv2.dnn.blobFromImage(padded, scalefactor=1 / 255.0, swapRB=True)
+
+    core = ov.Core()
+    fp32_model = core.read_model(_model_xml(model_dir))
+    logging.info(f"Quantizing {model_dir} with {min(len(images), subset_size)} calibration images")
+    int8_model = nncf.quantize(
+        fp32_model,
+        nncf.Dataset(images, transform),
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=min(len(images), subset_size),
+        ignored_scope=_head_ignored_scope(fp32_model),
+    )
+
+    if output_dir is None:
+        base = os.path.normpath(model_dir)
+        output_dir = base.replace('_openvino_model', '_int8_openvino_model')
+        if output_dir == base:
+            output_dir = base + '_int8'
+    os.makedirs(output_dir, exist_ok=True)
+    ov.save_model(int8_model, os.path.join(output_dir, os.path.basename(_model_xml(model_dir))))
+    shutil.copy(os.path.join(model_dir, 'metadata.yaml'), os.path.join(output_dir, 'metadata.yaml'))
+    logging.info(f"INT8 model saved to {output_dir}")
+    return output_dir
+
+
+def _evaluate_in_process(model_dir, images, num_threads):
+    # runs in a fresh process so RSS reflects one model only
+    return evaluate(OpenVINODetector(model_dir, num_threads=num_threads), images)
+
+
+def compare(fp32_dir, int8_dir, images, num_threads=None):
+    """
+    compare evaluates both models, each in its own process.
+
+    Returns: dict {'fp32': report, 'int8': report}
+    """
+    ctx = multiprocessing.get_context('spawn')
+    report = {}
+    for name, model_dir in (('fp32', fp32_dir), ('int8', int8_dir)):
+        with ctx.Pool(1) as pool:
+            report[name] = pool.apply(_evaluate_in_process, (model_dir, images, num_threads))
+    return report
+
+
+def format_report(report):
+    fp32, int8 = report['fp32'], report['int8']
+    lines = [
+        f"{'':<20}{'FP32':>12}{'INT8':>12}",
+        f"{'mean latency (ms)':<20}{fp32['mean_ms']:>12.1f}{int8['mean_ms']:>12.1f}",
+        f"{'p95 latency (ms)':<20}{fp32['p95_ms']:>12.1f}{int8['p95_ms']:>12.1f}",
+        f"{'peak RSS (MB)':<20}{fp32['peak_rss_mb']:>12.1f}{int8['peak_rss_mb']:>12.1f}",
+        f"speedup: {fp32['mean_ms'] / int8['mean_ms']:.2f}x",
+    ]
+    if 'per_class' in fp32:
+        lines.append(f"{'mAP50':<20}{fp32['map50']:>12.3f}{int8['map50']:>12.3f}")
+        lines.append(f"{'mAP50-95':<20}{fp32['map50_95']:>12.3f}{int8['map50_95']:>12.3f}")
+        for name, fp32_class in fp32['per_class'].items():
+            int8_ap = int8['per_class'].get(name, {}).get('ap50_95', 0.0)
+            lines.append(f"  {name:<18}{fp32_class['ap50_95']:>12.3f}{int8_ap:>12.3f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--model', default=DEFAULT_MODEL_DIR, help='FP32 OpenVINO model directory')
+    parser.add_argument('--calib', required=True, help='folder of calibration images')
+    parser.add_argument('--eval', help='folder of evaluation images (default: the calibration folder)')
+    parser.add_argument('--output', help='INT8 model directory')
+    parser.add_argument('--subset-size', type=int, default=300)
+    parser.add_argument('--threads', type=int, help='inference threads during evaluation')
+    parser.add_argument('--report', default='quantization_report.json')
+    args = parser.parse_args()
+
+    int8_dir = quantize(args.model, args.calib, args.output, args.subset_size)
+    report = compare(args.model, int8_dir, list_images(args.eval or args.calib), args.threads)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(format_report(report))
+    logging.info(f"Report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Non-blocking weight readings from the continuously sampled HX711.
+
+ScaleMonitor listens to the hx711_sampler.SamplingEngine and keeps the
+filtered weight, its variance and how long it has been stable up to date
+on every conversion, so the checkout loop can read a settled weight
+without waiting for fresh conversions.
+"""
+import threading
+import time
+
+import numpy as np
+
+
+class WeightReading:
+    """
+    Snapshot of the scale state.
+
+    weight(float): filtered weight in grams.
+    variance(float): variance in grams^2 over the filter window.
+    stable(bool): True if the standard deviation is within tolerance.
+    stable_since(float): time.monotonic() since which the weight has been
+        stable, None while unstable.
+    timestamp(float): time.monotonic() of the newest sample.
+    """
+    __slots__ = ('weight', 'variance', 'stable', 'stable_since', 'timestamp')
+
+    def __init__(self, weight, variance, stable, stable_since, timestamp):
+        self.weight = weight
+        self.variance = variance
+        self.stable = stable
+        self.stable_since = stable_since
+        self.timestamp = timestamp
+
+    def stable_for(self, now=None):
+        """
+        Returns: float seconds the weight has been stable, 0.0 if unstable.
+        """
+        if self.stable_since is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return now - self.stable_since
+
+
+class ScaleMonitor:
+    """
+    ScaleMonitor turns the raw sample stream of an HX711 into WeightReadings.
+    """
+
+    def __init__(self, hx, window=10, stable_tolerance=2.0):
+        """
+        Args:
+            hx(HX711): calibrated scale with a running sampler (see set_sampler).
+            window(int): samples in the moving filter window.
+            stable_tolerance(float): max standard deviation in grams, and max
+                drift of the stable weight, for the scale to count as stable.
+        """
+        self._hx = hx
+        self._sampler = hx.get_sampler()
+        self.window = window
+        self._tolerance = stable_tolerance
+        self._cond = threading.Condition()
+        self._reading = None
+        self._anchor = None  # weight when the current stable period began
+        self._listeners = []
+
+    def start(self):
+        self._sampler.add_listener(self._on_sample)
+        return self
+
+    def stop(self):
+        self._sampler.remove_listener(self._on_sample)
+
+    def add_listener(self, listener):
+        """
+        add_listener registers `listener(reading)`, called on the sampling
+        thread after every update.
+        """
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def _to_grams(self, raw):
+        return (raw - self._hx.get_current_offset()) / self._hx.get_current_scale_ratio()
+
+    def _on_sample(self, timestamp, raw):
+        _, values = self._sampler.ring.last(self.window)
+        grams = self._to_grams(values)
+        weight = float(grams.mean())
+        variance = float(grams.var()) if len(grams) > 1 else 0.0
+        stable = len(grams) == self.window and variance <= self._tolerance ** 2
+
+        previous = self._reading
+        stable_since = None
+        if stable:
+            if (previous is not None and previous.stable
+                    and abs(weight - self._anchor) <= self._tolerance):
+                stable_since = previous.stable_since
+            else:
+                stable_since = timestamp
+                self._anchor = weight
+
+        reading = WeightReading(weight, variance, stable, stable_since, timestamp)
+        with self._cond:
+            self._reading = reading
+            self._cond.notify_all()
+        for listener in self._listeners:
+            listener(reading)
+
+    def reading(self):
+        """
+        Returns: the latest WeightReading, or None before the first sample.
+        """
+        return self._reading
+
+    def wait_stable(self, timeout=3.0, min_duration=0.0):
+        """
+        wait_stable returns as soon as the weight is stable, immediately if
+        it already is.
+
+        Args:
+            timeout(float): max seconds to wait.
+            min_duration(float): seconds the weight must have been stable.
+
+        Returns: WeightReading or None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                reading = self._reading
+                if reading is not None and reading.stable_for() >= min_duration and reading.stable:
+                    return reading
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def raw_mean(self, readings):
+        """
+        Returns: float mean of the newest `readings` raw samples, or None.
+        """
+        _, values = self._sampler.ring.last(readings)
+        return float(np.mean(values)) if len(values) else None
@@ -0,0 +1,50 @@
+"""
+Reports settled load changes on the scale.
+"""
+import logging
+import time
+
+
+class LoadChangeTrigger:
+    """
+    LoadChangeTrigger calls `on_settled(weight)` once the load has changed
+    by at least `change_threshold` grams and the scale has become stable
+    again. It is driven by the ScaleMonitor updates, so it costs no extra
+    HX711 conversions.
+    """
+
+    def __init__(self, monitor, on_settled, change_threshold=10.0):
+        """
+        Args:
+            monitor(ScaleMonitor): running scale monitor.
+            on_settled(callable): called with the settled weight in grams.
+            change_threshold(float): grams the load must move to count as a change.
+        """
+        self._monitor = monitor
+        self._on_settled = on_settled
+        self._change_threshold = change_threshold
+        self.baseline = 0.0
+        self.settled_at = 0.0  # perf_counter time of the last settled change
+
+    def start(self):
+        self._monitor.add_listener(self.update)
+        return self
+
+    def stop(self):
+        self._monitor.remove_listener(self.update)
+
+    def update(self, reading):
+        """
+        update checks one WeightReading for a settled change.
+
+        Returns: float settled weight if this reading completed a change, else None.
+        """
+        if not reading.stable:
+            return None
+        if abs(reading.weight - self.baseline) < self._change_threshold:
+            return None
+        logging.info(f"Load settled at {reading.weight:.1f} g (was {self.baseline:.1f} g)")
+        self.baseline = reading.weight
+        self.settled_at = time.perf_counter()
+        self._on_settled(reading.weight)
+        return reading.weight
@@ -1,26 +1,42 @@
-import json
 import streamlit as st
 import pandas as pd
 import qrcode
 from io import BytesIO
-from PIL import Image
 import plotly.graph_objects as go
-import os
-import subprocess
+import time
 from datetime import datetime
 import logging
-from twilio.rest import Client
-import traceback
+import os
+from cart_channel import CartSubscriber, DEFAULT_SOCKET
+from whatsapp_outbox import Outbox, OutboxWorker, TwilioSender, TWILIO_API_BASE
+from transaction_store import TransactionStore
 
 # Twilio Credentials (Replace placeholders with your actual credentials)
 TWILIO_ACCOUNT_SID = 'AC21e0482fbd35d389f7c8555699319c8c'  # Replace with your Account SID
 TWILIO_AUTH_TOKEN = '90d26056e98a492f289c3845197df0ba'     # Replace with your Auth Token
 TWILIO_WHATSAPP_FROM = 'whatsapp:+14155238886'             # Twilio Sandbox WhatsApp number
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE', TWILIO_API_BASE)  # point at a stub server for testing
+
+# Receipts are queued here and delivered in the background
+WHATSAPP_OUTBOX = "whatsapp_outbox.db"
+
+# Sales are stored here; an old transactions.log is imported into a new store
+TRANSACTIONS_DB = "transactions.db"
+TRANSACTIONS_LOG = "transactions.log"
 
 # UPI ID configuration
 UPI_ID = "sairam30524@oksbi"  # Replace with your actual UPI ID
 PAYEE_NAME = "SA Supermart"   # Replace with your actual payee name
 
+# Receipts are pushed by final.py, which keeps running between customers;
+# lane_server.py starts one app per lane with its own socket and file
+CART_SOCKET = os.environ.get('RETAIL_CART_SOCKET', DEFAULT_SOCKET)
+RECEIPT_FILE = os.environ.get('RETAIL_RECEIPT_FILE', "receipt.json")  # polled instead while the socket is not available
+LIVE_CART_REFRESH = 0.5  # seconds between refreshes of the live cart while the customer scans
+
+# st.fragment is called st.experimental_fragment before Streamlit 1.37
+fragment = getattr(st, 'fragment', None) or st.experimental_fragment
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -29,29 +45,74 @@ def create_pie_chart(df):
     fig.update_layout(title_text="Distribution of Expenses")
     return fig
 
-def send_whatsapp_message(to_number, message_body):
-    account_sid = TWILIO_ACCOUNT_SID
-    auth_token = TWILIO_AUTH_TOKEN
-    from_whatsapp_number = TWILIO_WHATSAPP_FROM
-    client = Client(account_sid, auth_token)
-
-    # Debugging statements
-    logging.info("Attempting to send WhatsApp message...")
-    logging.info(f"To: {to_number}")
-    logging.info(f"Message Body:\n{message_body}")
-
-    try:
-        message = client.messages.create(
-            from_=from_whatsapp_number,
-            body=message_body,
-            to=f'whatsapp:{to_number}'
-        )
-        logging.info(f"Message SID: {message.sid}")
-        return message.sid
-    except Exception as e:
-        error_message = f"Failed to send WhatsApp message: {e}\n{traceback.format_exc()}"
-        logging.error(error_message)
-        return None
+# The renders below are memoized on the cart contents and amount, so reruns
+# caused by other widgets (e.g. typing the WhatsApp number) reuse them.
+
+@st.cache_data(max_entries=32)
+def build_summary_table(items):
+    df = pd.DataFrame(items)
+    columns = ['Item', 'Quantity', 'Price per Unit (Rs)', 'Total Price (Rs)']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    def column(name, default):
+        return df[name] if name in df else pd.Series(default, index=df.index)
+
+    sold_by_weight = column('sold_by_weight', False).fillna(False).astype(bool)
+    price_per_unit = column('price_per_gram', 0.0).where(sold_by_weight, column('price_per_item', 0.0))
+    weight = column('weight', None).fillna(column('detected_weight', 0)).fillna(0)
+    count = column('count', 0).fillna(0).astype(int)
+    # the column is float as soon as a counted item leaves a NaN in it, so format it as the grams were given
+    quantity = weight.map('{:g} g'.format).where(sold_by_weight, count)
+
+    table = pd.DataFrame({
+        'Item': df['name'],
+        'Quantity': quantity,
+        'Price per Unit (Rs)': price_per_unit.astype(float),
+        'Total Price (Rs)': df['total_price'],
+    })
+    return table[columns]
+
+@st.cache_data(max_entries=32)
+def cached_pie_chart(labels, values):
+    return create_pie_chart({'Item': list(labels), 'Total Price (Rs)': list(values)})
+
+@st.cache_data(max_entries=8)
+def upi_qr_png(upi_payment_string):
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(upi_payment_string)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+@st.cache_resource
+def get_whatsapp_outbox():
+    """One outbox and delivery worker per Streamlit server, shared by all reruns."""
+    outbox = Outbox(WHATSAPP_OUTBOX)
+    sender = TwilioSender(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_FROM,
+                          base_url=TWILIO_API_BASE_URL)
+    OutboxWorker(outbox, sender).start()
+    return outbox
+
+@st.cache_resource
+def get_transaction_store():
+    """One transaction store per Streamlit server, shared by all reruns."""
+    store = TransactionStore(TRANSACTIONS_DB)
+    if store.count() == 0 and os.path.exists(TRANSACTIONS_LOG):
+        store.import_log(TRANSACTIONS_LOG)
+    return store
+
+def send_whatsapp_message(to_number, message_body, idempotency_key):
+    """
+    send_whatsapp_message queues the message for delivery and returns at
+    once; the outbox worker sends it, retrying if needed.
+
+    Returns: bool True if it was queued, False if it already was.
+    """
+    logging.info(f"Queueing WhatsApp message {idempotency_key} to {to_number}")
+    return get_whatsapp_outbox().enqueue(to_number, message_body, idempotency_key)
 
 def format_receipt_message(receipt_data, payee_name):
     total_price_updated = receipt_data.get("total_price", 0.0)
@@ -89,6 +150,43 @@ def format_receipt_message(receipt_data, payee_name):
     message_body = '\n'.join(message_lines)
     return message_body
 
+@st.cache_resource
+def get_cart_subscriber():
+    """One subscriber per Streamlit server, shared by all reruns."""
+    return CartSubscriber(CART_SOCKET, RECEIPT_FILE).start()
+
+def format_cart_line(line):
+    name = line['name']
+    total = line.get('total_price', 0.0)
+    if line.get('message'):
+        return f"**{name}** ({line.get('weight', 0)} g): {line['message']}"
+    if line.get('sold_by_weight', False):
+        return f"**{name}**: {line.get('weight', 0)} g x Rs. {line['price_per_gram']}/g = **Rs. {total:.2f}**"
+    return f"**{name}**: {line['count']} pcs x Rs. {line['price_per_item']} = **Rs. {total:.2f}**"
+
+@fragment(run_every=LIVE_CART_REFRESH)
+def live_cart(subscriber):
+    """
+    live_cart shows the cart while the customer is still scanning. Only
+    this fragment re-runs on refresh, and the line changed by the last
+    scan is highlighted; the full page takes over once the receipt is
+    handed over.
+    """
+    if subscriber.pending() is not None:
+        st.rerun()  # scanning finished, show the payment page
+    cart = subscriber.scanning()
+    if cart is None:
+        st.info("Waiting for the next customer...")
+        return
+    st.subheader("Items in Your Cart")
+    for key, line in cart['lines'].items():
+        if key == cart.get('changed'):
+            st.success(format_cart_line(line))
+        else:
+            st.markdown(format_cart_line(line))
+    st.markdown(f"<p class='total-price big-font'>Running total: {cart.get('total_price', 0.0):.2f} Rs</p>",
+                unsafe_allow_html=True)
+
 def main():
     # Set page configuration
     st.set_page_config(
@@ -125,13 +223,18 @@ def main():
     # Debug: Print session state
     st.write(f"Debug: generate_qr = {st.session_state.generate_qr}, payment_done = {st.session_state.payment_done}")
 
-    # Load receipt data from JSON file
-    if os.path.exists("receipt.json"):
-        with open("receipt.json", "r") as f:
-            receipt_data = json.load(f)
-    else:
-        st.error("No receipt data found.")
+    # Take the oldest receipt pushed by final.py, or follow the cart being scanned
+    subscriber = get_cart_subscriber()
+    receipt_data = subscriber.pending()
+    if receipt_data is None:
+        live_cart(subscriber)
         return
+    session = receipt_data.get("session", "")
+    if st.session_state.get('session') != session:
+        # a new receipt: start its payment from scratch
+        st.session_state.session = session
+        st.session_state.generate_qr = False
+        st.session_state.payment_done = False
 
     # Retrieve items from the receipt data
     items = receipt_data.get("items", [])
@@ -160,6 +263,8 @@ def main():
             total_price_item = item.get('total_price', 0.0)
 
             st.markdown(f"<div class='item-name big-font'>{item_name}</div>", unsafe_allow_html=True)
+            if item.get('weight_warning'):
+                st.warning(item['weight_warning'])
             st.markdown('<div class="item-details">', unsafe_allow_html=True)
 
             if sold_by_weight:
@@ -176,7 +281,7 @@ def main():
                     f"Quantity for {item_name}",
                     min_value=0,
                     value=int(item.get('count', 1)),
-                    key=f"item_{index}_count",
+                    key=f"{session}_item_{index}_count",
                     step=1,
                     format="%d"
                 )
@@ -196,24 +301,8 @@ def main():
 
     # Summary Table for Cross-Checking
     st.subheader("Summary Table")
-    # Create a DataFrame for the table
-    df = pd.DataFrame(edited_items)
-
-    # Prepare data for the table
-    df_table = df.copy()
-    df_table['Price per Unit (Rs)'] = df_table.apply(
-        lambda row: row['price_per_gram'] if row.get('sold_by_weight', False) else row['price_per_item'],
-        axis=1
-    )
-    df_table['Quantity'] = df_table.apply(
-        lambda row: f"{row.get('weight', row.get('detected_weight', 0))} g" if row.get('sold_by_weight', False) else int(row['count']),
-        axis=1
-    )
-    df_table = df_table[['name', 'Quantity', 'Price per Unit (Rs)', 'total_price']]
-    df_table = df_table.rename(columns={
-        'name': 'Item',
-        'total_price': 'Total Price (Rs)'
-    })
+    # Create the table from the edited cart (cached on its contents)
+    df_table = build_summary_table(edited_items)
 
     # Display the table
     st.markdown('<div class="receipt-container">', unsafe_allow_html=True)
@@ -225,7 +314,7 @@ def main():
 
     # Create and display pie chart
     st.subheader("Expense Distribution")
-    fig = create_pie_chart(df_table)
+    fig = cached_pie_chart(tuple(df_table['Item']), tuple(df_table['Total Price (Rs)']))
     st.plotly_chart(fig)
 
     # Payment section
@@ -246,18 +335,11 @@ def main():
         # UPI QR code format
         upi_payment_string = f"upi://pay?pa={UPI_ID}&pn={PAYEE_NAME}&am={total_price_updated:.2f}&cu=INR"
 
-        # Generate the QR code with the UPI payment string
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(upi_payment_string)
-        qr.make(fit=True)
-
-        # Create an image for the QR code
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
+        # Generate the QR code with the UPI payment string (cached on the amount)
+        qr_png = upi_qr_png(upi_payment_string)
 
         # Display the QR code
-        st.image(Image.open(buffered), caption="Scan this QR code to pay via UPI", width=300)
+        st.image(qr_png, caption="Scan this QR code to pay via UPI", width=300)
 
         # Show the "Payment Done" button after the QR code is generated
         if st.button("Payment Done", key="payment_done", help="Click if payment is completed"):
@@ -267,42 +349,41 @@ def main():
         st.balloons()
         st.success("Payment Confirmed! Thank you for shopping with us.")
 
-        # Log the transaction
+        # Record the transaction; keyed on the receipt, so a rerun does not record it twice
         transaction_log = {
             "datetime": datetime.now().isoformat(),
             "total_price": total_price_updated,
             "payment_method": payment_method,
-            "items": edited_items
+            "items": edited_items,
+            "catalog_version": receipt_data.get('catalog_version')
         }
-        with open("transactions.log", "a") as log_file:
-            log_file.write(json.dumps(transaction_log) + "\n")
+        get_transaction_store().record(transaction_log, key=f"receipt-{session}")
 
         # Save the updated receipt data
         receipt_data = {
+            'session': session,
+            'status': 'paid',
             'total_price': total_price_updated,
-            'items': edited_items
+            'items': edited_items,
+            'catalog_version': receipt_data.get('catalog_version')
         }
-        with open("receipt.json", "w") as f:
-            json.dump(receipt_data, f, indent=2)
+        subscriber.paid(receipt_data)
 
-            # Send WhatsApp message
+        # Queue the WhatsApp message; a rerun of this page cannot send it twice
         if customer_whatsapp.strip() != "":
             message_body = format_receipt_message(receipt_data, PAYEE_NAME)
-            message_sid = send_whatsapp_message(customer_whatsapp.strip(), message_body)
-            if message_sid:
-                st.success("Receipt sent via WhatsApp.")
-            else:
-                st.error("Failed to send receipt via WhatsApp.")
+            number = customer_whatsapp.strip()
+            send_whatsapp_message(number, message_body, f"receipt-{session}-{number}")
+            st.success("Receipt will be sent via WhatsApp.")
         else:
             st.warning("No WhatsApp number provided. Receipt not sent via WhatsApp.")
 
         st.warning("Returning to object detection for new customers...")
-        # Reset the session state for the next customer
+        # Reset the session state for the next customer; final.py is still running
         st.session_state.generate_qr = False
         st.session_state.payment_done = False
-        # Stop the Streamlit app
-        subprocess.run(["python3", "/home/rpi/Desktop/Project/Weight_sensor/final.py"])
-        st.stop()
+        time.sleep(3)
+        st.rerun()
 
     # Footer
     st.markdown(f'<div class="footer">© 2023 {PAYEE_NAME}</div>', unsafe_allow_html=True)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# hardware (imported by hx711) refuses to fall back to simulated GPIO otherwise
+os.environ.setdefault('RETAIL_HARDWARE', 'sim')
@@ -0,0 +1,83 @@
+import pytest
+
+from basket import MAX_INSTANCES, solve_basket
+from catalog import CatalogEntry, PriceCatalog
+
+
+@pytest.fixture
+def catalog():
+    return PriceCatalog([
+        CatalogEntry('Thumsup', 320, 40.0, False),
+        CatalogEntry('Parachute', 55, 20.0, False),
+        CatalogEntry('Parachute', 44, 10.0, False),
+        CatalogEntry('Biscuit', 50, 10.0, False),
+        CatalogEntry('Biscuit', 51, 12.0, False),
+        CatalogEntry('Soap', 100, 30.0, False),
+        CatalogEntry('Soap', 101, 30.0, False),
+        CatalogEntry('Apple', 1, 0.75, True),
+    ])
+
+
+def _lines(solution):
+    return sorted((entry.name, entry.weight, count) for entry, count in solution.lines)
+
+
+def test_exact_basket(catalog):
+    solution = solve_basket({'Parachute': 3, 'Thumsup': 1}, 320 + 55 + 2 * 44, catalog)
+
+    assert _lines(solution) == [('Parachute', 44, 2), ('Parachute', 55, 1), ('Thumsup', 320, 1)]
+    assert solution.expected_weight == 463.0
+    assert solution.residual == 0
+    assert solution.recounted == {}
+    assert not solution.ambiguous
+    assert solution.price() == 80.0
+
+
+def test_weighing_error_within_tolerance(catalog):
+    solution = solve_basket({'Parachute': 2}, 101.5, catalog)
+    assert _lines(solution) == [('Parachute', 44, 1), ('Parachute', 55, 1)]
+    assert solution.residual == pytest.approx(2.5)
+    assert not solution.ambiguous
+
+
+def test_ambiguous_basket(catalog):
+    # 50 g at 10.00 and 51 g at 12.00 explain 50.5 g equally well
+    solution = solve_basket({'Biscuit': 1}, 50.5, catalog)
+    assert solution is not None
+    assert solution.ambiguous
+
+
+def test_variants_of_the_same_price_are_not_ambiguous(catalog):
+    solution = solve_basket({'Soap': 1, 'Thumsup': 1}, 320 + 100.5, catalog)
+    assert solution.price() == 70.0
+    assert not solution.ambiguous
+
+
+def test_missed_instance_is_recounted(catalog):
+    solution = solve_basket({'Parachute': 1, 'Thumsup': 1}, 320 + 55 + 44, catalog)
+    assert _lines(solution) == [('Parachute', 44, 1), ('Parachute', 55, 1), ('Thumsup', 320, 1)]
+    assert solution.recounted == {'Parachute': 2}
+
+
+def test_recount_is_bounded_by_count_slack(catalog):
+    assert solve_basket({'Parachute': 1}, 3 * 44, catalog) is None
+    solution = solve_basket({'Parachute': 1}, 3 * 44, catalog, count_slack=2)
+    assert solution.recounted == {'Parachute': 3}
+
+
+def test_no_combination_fits(catalog):
+    assert solve_basket({'Thumsup': 1}, 400, catalog) is None
+
+
+def test_products_outside_a_basket_raise(catalog):
+    with pytest.raises(ValueError):
+        solve_basket({'Apple': 1}, 200, catalog)
+    with pytest.raises(ValueError):
+        solve_basket({'Mango': 1}, 200, catalog)
+
+
+def test_more_instances_than_enumerated_raise(catalog):
+    # within the slack the count is corrected down to MAX_INSTANCES, beyond it nothing is enumerated
+    assert solve_basket({'Soap': MAX_INSTANCES + 1}, MAX_INSTANCES * 100, catalog) is not None
+    with pytest.raises(ValueError, match=f'More than {MAX_INSTANCES} of product "Soap"'):
+        solve_basket({'Soap': MAX_INSTANCES + 2}, (MAX_INSTANCES + 2) * 100, catalog)
@@ -0,0 +1,114 @@
+import json
+import socket
+import time
+
+import pytest
+
+from cart_channel import PAID_SUFFIX, CartPublisher, CartSubscriber
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix sockets')
+
+
+class BrokenSocket:
+    """
+    Stands in for the subscriber's connection: sending fails, shutting
+    down shuts the connection down.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def sendall(self, data):
+        raise BrokenPipeError(32, 'Broken pipe')
+
+    def shutdown(self, how):
+        self._sock.shutdown(how)
+
+
+def _until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def channel(tmp_path):
+    messages = []
+    socket_path, fallback_file = str(tmp_path / 'cart.sock'), str(tmp_path / 'receipt.json')
+    publisher = CartPublisher(socket_path, fallback_file, on_message=messages.append).start()
+    subscriber = CartSubscriber(socket_path, fallback_file, poll_interval=0.05).start()
+    assert _until(lambda: subscriber._sock is not None and publisher._clients)
+    yield publisher, subscriber, messages
+    subscriber.stop()
+    publisher.stop()
+
+
+def _cart(session, total):
+    return {'session': session, 'status': 'pending', 'total_price': total, 'items': []}
+
+
+def test_payment_reported_over_the_socket(channel):
+    publisher, subscriber, messages = channel
+    publisher.publish(_cart('s1', 10.0))
+    assert _until(lambda: subscriber.pending() is not None)
+
+    subscriber.paid(subscriber.pending())
+    assert _until(lambda: messages)
+    assert messages[0]['type'] == 'paid' and messages[0]['session'] == 's1'
+    assert not publisher._open
+
+
+def test_payment_survives_a_socket_broken_during_paid(channel):
+    publisher, subscriber, messages = channel
+    publisher.publish(_cart('s1', 10.0))
+    assert _until(lambda: subscriber.pending() is not None)
+
+    connection = subscriber._sock
+    subscriber._sock = BrokenSocket(connection)
+    subscriber.paid(subscriber.pending())
+    assert subscriber.pending() is None
+    with open(publisher.fallback_file + PAID_SUFFIX) as f:
+        assert [message['session'] for message in json.load(f)['paid']] == ['s1']
+
+    # the UI reconnects: the checkout reads the payment instead of resending the cart
+    seq = subscriber.seq
+    connection.shutdown(socket.SHUT_RDWR)
+    assert _until(lambda: messages)
+    assert [(message['type'], message['session']) for message in messages] == [('paid', 's1')]
+    assert not publisher._open
+
+    publisher.publish(_cart('s2', 20.0))
+    assert _until(lambda: subscriber.seq > seq and subscriber.pending() is not None)
+    assert subscriber.pending()['session'] == 's2'
+
+
+def test_payment_in_the_paid_file_is_read_on_the_next_publish(channel):
+    publisher, subscriber, messages = channel
+    publisher.publish(_cart('s1', 10.0))
+    assert _until(lambda: subscriber.pending() is not None)
+
+    subscriber._sock = BrokenSocket(subscriber._sock)  # the connection itself stays up
+    subscriber.paid(subscriber.pending())
+    publisher.publish(_cart('s2', 20.0))
+
+    assert [(message['type'], message['session']) for message in messages] == [('paid', 's1')]
+    assert list(publisher._open) == ['s2']
+    # confirmed on the socket, so the UI stops reporting it
+    assert _until(lambda: not subscriber._paid)
+    with open(publisher.fallback_file + PAID_SUFFIX) as f:
+        assert json.load(f) == {'paid': []}
+    assert _until(lambda: subscriber.pending() is not None)
+    assert subscriber.pending()['session'] == 's2'
+
+
+def test_resent_paid_cart_is_not_shown_again(tmp_path):
+    subscriber = CartSubscriber(str(tmp_path / 'none.sock'), str(tmp_path / 'receipt.json'))
+    subscriber._paid['s1'] = {'type': 'paid', 'session': 's1'}
+    subscriber._received(dict(_cart('s1', 10.0), type='cart', version=1))
+    subscriber._received({'type': 'delta', 'version': 2, 'session': 's1', 'key': 'Apple|250',
+                          'line': {}, 'total_price': 1.0})
+    assert subscriber.pending() is None
+    assert subscriber.scanning() is None
@@ -0,0 +1,90 @@
+import os
+import pickle
+
+import pytest
+
+from catalog import SNAPSHOT_SUFFIX, load_catalog_snapshot
+
+ITEMS = ('<items><item name="Parachute" weight="55" price="{price}" sold_by_weight="False" />'
+         '<item name="Parachute" weight="44" price="10.00" sold_by_weight="False" />'
+         '<item name="Apple" weight="1" price="0.750" sold_by_weight="True" /></items>')
+
+
+@pytest.fixture
+def xml_file(tmp_path):
+    path = tmp_path / 'items.xml'
+    path.write_text(ITEMS.format(price='20.00'))
+    return str(path)
+
+
+def _set_mtime(path, mtime):
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_snapshot_is_written_then_used(xml_file):
+    catalog, warm = load_catalog_snapshot(xml_file)
+    assert not warm
+    assert os.path.exists(xml_file + SNAPSHOT_SUFFIX)
+
+    catalog, warm = load_catalog_snapshot(xml_file)
+    assert warm
+    assert catalog.nearest('Parachute', 50).price == 20.0
+    assert catalog.variants('Parachute').weights == [44, 55]
+    assert catalog.variants('Apple').entries[0].sold_by_weight
+
+
+def test_changed_size_invalidates_snapshot(xml_file):
+    load_catalog_snapshot(xml_file)
+    with open(xml_file, 'w') as f:
+        f.write(ITEMS.format(price='200.00'))
+
+    catalog, warm = load_catalog_snapshot(xml_file)
+    assert not warm
+    assert catalog.nearest('Parachute', 55).price == 200.0
+    assert load_catalog_snapshot(xml_file)[1]
+
+
+def test_same_size_new_content_invalidates_snapshot(xml_file):
+    load_catalog_snapshot(xml_file)
+    mtime = os.stat(xml_file).st_mtime_ns
+    with open(xml_file, 'w') as f:
+        f.write(ITEMS.format(price='30.00'))  # same length as 20.00
+    _set_mtime(xml_file, mtime + 10 ** 9)
+
+    catalog, warm = load_catalog_snapshot(xml_file)
+    assert not warm
+    assert catalog.nearest('Parachute', 55).price == 30.0
+
+
+def test_touched_file_with_same_content_keeps_snapshot(xml_file):
+    load_catalog_snapshot(xml_file)
+    mtime = os.stat(xml_file).st_mtime_ns
+    _set_mtime(xml_file, mtime + 10 ** 9)
+
+    catalog, warm = load_catalog_snapshot(xml_file)
+    assert warm  # the SHA-256 still matches
+    assert catalog.source['mtime_ns'] == mtime + 10 ** 9
+    with open(xml_file + SNAPSHOT_SUFFIX, 'rb') as f:
+        assert pickle.load(f)['source']['mtime_ns'] == mtime + 10 ** 9
+
+
+def test_snapshot_of_other_version_is_ignored(xml_file):
+    load_catalog_snapshot(xml_file)
+    snapshot_file = xml_file + SNAPSHOT_SUFFIX
+    with open(snapshot_file, 'rb') as f:
+        snapshot = pickle.load(f)
+    snapshot['version'] = -1
+    with open(snapshot_file, 'wb') as f:
+        pickle.dump(snapshot, f)
+
+    assert not load_catalog_snapshot(xml_file)[1]
+
+
+def test_corrupt_snapshot_is_ignored(xml_file):
+    load_catalog_snapshot(xml_file)
+    with open(xml_file + SNAPSHOT_SUFFIX, 'wb') as f:
+        f.write(b'not a pickle')
+
+    catalog, warm = load_catalog_snapshot(xml_file)
+    assert not warm
+    assert len(catalog) == 3
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hx711_sampler import ReadError, RPiGPIOBackend
+
+
+def _backend(channel, gain, results):
+    """
+    Returns: RPiGPIOBackend whose conversions are `results`, ints or ReadError reasons.
+    """
+    hx = SimpleNamespace(_pd_sck=5, _dout=6, _wanted_channel=channel, _gain_channel_A=gain)
+    backend = RPiGPIOBackend(hx)
+    results = list(results)
+
+    def read():
+        result = results.pop(0)
+        if isinstance(result, str):
+            raise ReadError(result)
+        return result
+    backend._read = read
+    return backend
+
+
+def _reads(backend, count):
+    out = []
+    for _ in range(count):
+        try:
+            out.append(backend.read())
+        except ReadError as e:
+            out.append(e.reason)
+    return out
+
+
+@pytest.mark.parametrize('channel, gain', [('B', 128), ('A', 64)])
+def test_conversion_after_a_reset_is_dropped_when_not_at_a128(channel, gain):
+    backend = _backend(channel, gain, [1, 'timing', 2, 3, 'not_ready', 4, 5])
+    assert _reads(backend, 7) == [1, 'timing', 'timing', 3, 'not_ready', 'timing', 5]
+
+
+def test_conversion_after_a_reset_is_kept_at_a128():
+    backend = _backend('A', 128, [1, 'timing', 2, 3])
+    assert _reads(backend, 4) == [1, 'timing', 2, 3]
+
+
+def test_invalid_conversion_after_a_reset_selects_the_gain_all_the_same():
+    backend = _backend('B', 128, ['timing', 'invalid', 2])
+    assert _reads(backend, 3) == ['timing', 'invalid', 2]
@@ -0,0 +1,150 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from catalog import CatalogEntry, PriceCatalog
+from item_tracker import IouTracker, TrayRegistrar
+
+NAMES = {0: 'Thumsup', 1: 'Parachute'}
+CATALOG = PriceCatalog([
+    CatalogEntry('Thumsup', 320, 40.0, False),
+    CatalogEntry('Parachute', 55, 20.0, False),
+    CatalogEntry('Parachute', 44, 10.0, False),
+])
+THUMSUP = (0, 0.9, (10, 10, 60, 110))
+PARACHUTE = (1, 0.9, (200, 10, 240, 60))
+FRAME = 0.1  # seconds between inferred frames
+
+
+def _frame(*boxes):
+    """
+    Args:
+        boxes: (class id, confidence, xyxy) of every box in the frame.
+
+    Returns: object with the attributes of detector.Detections the tracker reads.
+    """
+    return SimpleNamespace(xyxy=np.array([box for _, _, box in boxes], np.float32).reshape(-1, 4),
+                           conf=np.array([conf for _, conf, _ in boxes], np.float32),
+                           cls=np.array([cls for cls, _, _ in boxes], np.int64),
+                           names=NAMES)
+
+
+class Tray:
+    """
+    Feeds a TrayRegistrar frames at FRAME intervals, starting now (the
+    registrar stamps settled weights with time.perf_counter()).
+    """
+
+    def __init__(self, registrar):
+        self.registrar = registrar
+        self.now = time.perf_counter()
+        self.events = []
+
+    def frames(self, count, *boxes):
+        for _ in range(count):
+            self.now += FRAME
+            self.events += self.registrar.update(_frame(*boxes), self.now)
+        return self.events
+
+    def settle(self, weight):
+        self.registrar.weight_settled(weight)
+
+
+def _names(events):
+    return [(kind, track.name, track.weight) for kind, track in events]
+
+
+def test_tracker_confirms_after_min_hits_and_keeps_ids():
+    tracker = IouTracker(min_hits=3)
+    now = 0.0
+    for i in range(3):
+        now += FRAME
+        box = (10 + 2 * i, 10, 60 + 2 * i, 110)
+        born, lost = tracker.update(_frame((0, 0.9, box)), now)
+    assert [track.name for track in born] == ['Thumsup']
+    assert [track.id for track in tracker.tracks] == [1]
+
+    # a low-confidence detection keeps the track alive, but starts none
+    now += FRAME
+    born, lost = tracker.update(_frame((0, 0.2, (16, 10, 66, 110)), (1, 0.2, PARACHUTE[2])), now)
+    assert born == lost == []
+    assert [track.id for track in tracker.tracks] == [1]
+
+
+def test_tracker_loses_tracks_after_max_unseen_seconds():
+    tracker = IouTracker(max_unseen=1.0)
+    for i in range(3):
+        tracker.update(_frame(THUMSUP), FRAME * (i + 1))
+    assert tracker.update(_frame(), 1.2)[1] == []
+    born, lost = tracker.update(_frame(), 1.4)
+    assert [track.id for track in lost] == [1]
+    assert lost[0].lost_at == 1.4
+    assert tracker.tracks == []
+
+
+def test_item_put_down_is_registered_once():
+    tray = Tray(TrayRegistrar(lambda: CATALOG))
+    tray.frames(3, THUMSUP)
+    tray.settle(321.0)
+    assert _names(tray.frames(1, THUMSUP)) == [('add', 'Thumsup', 320)]
+
+    tray.frames(20, THUMSUP)
+    assert len(tray.events) == 1
+    assert tray.registrar.unmatched_weight == 0
+
+
+def test_item_taken_off_is_deregistered():
+    tray = Tray(TrayRegistrar(lambda: CATALOG))
+    tray.frames(3, THUMSUP, PARACHUTE)
+    tray.settle(320 + 44)
+    tray.frames(1, THUMSUP, PARACHUTE)
+    assert sorted(_names(tray.events)) == [('add', 'Parachute', 44), ('add', 'Thumsup', 320)]
+
+    # the weight settles before the tracker gives the item up: the change is held
+    tray.frames(2, THUMSUP)
+    tray.settle(320)
+    tray.frames(15, THUMSUP)
+    assert _names(tray.events[2:]) == [('remove', 'Parachute', 44)]
+    assert tray.registrar.unmatched_weight == 0
+
+
+def test_item_held_over_the_tray_is_not_registered():
+    tray = Tray(TrayRegistrar(lambda: CATALOG))
+    tray.frames(10, PARACHUTE)
+    tray.frames(15)
+    assert tray.events == []
+
+
+def test_weight_change_without_an_item_is_unmatched():
+    tray = Tray(TrayRegistrar(lambda: CATALOG, match_window=1.5))
+    tray.settle(500.0)
+    tray.frames(20)
+    assert tray.events == []
+    assert tray.registrar.unmatched_weight == 1
+
+
+def test_baseline_is_the_weight_already_on_the_tray():
+    tray = Tray(TrayRegistrar(lambda: CATALOG, baseline=320.0))
+    tray.frames(3, PARACHUTE)
+    tray.settle(320 + 55)
+    assert _names(tray.frames(1, PARACHUTE)) == [('add', 'Parachute', 55)]
+
+
+def test_reset_leaves_items_on_the_tray_out_of_the_next_cart():
+    tray = Tray(TrayRegistrar(lambda: CATALOG))
+    tray.frames(3, THUMSUP)
+    tray.settle(320)
+    assert _names(tray.frames(1, THUMSUP)) == [('add', 'Thumsup', 320)]
+    tray.registrar.reset()
+    tray.events = []
+
+    tray.frames(3, THUMSUP, PARACHUTE)
+    tray.settle(320 + 55)
+    assert _names(tray.frames(1, THUMSUP, PARACHUTE)) == [('add', 'Parachute', 55)]
+
+
+def test_match_window_has_to_outlast_max_unseen():
+    with pytest.raises(ValueError):
+        TrayRegistrar(lambda: CATALOG, tracker=IouTracker(max_unseen=2.0), match_window=2.0)
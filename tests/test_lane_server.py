@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import hardware
+from catalog import CatalogEntry, PriceCatalog
+from detector import Detections
+from lane_server import Lane, Station
+
+NAMES = {0: 'Thumsup', 1: 'Parachute'}
+IDS = {name: i for i, name in NAMES.items()}
+
+
+class TraceCamera:
+    """
+    TraceCamera stands in for both the lane's FramePipeline and its
+    detector: every frame carries its capture time, and the detector
+    reports the '+'-separated labels the trace has on the tray then.
+    """
+
+    def __init__(self, lane, rows):
+        self._lane = lane
+        self._trace = hardware.Trace(rows, loop=False)
+        self.names = NAMES
+
+    @property
+    def failed(self):
+        # stops _serve once every settled load of the trace is handled
+        return self._lane._settled.empty()
+
+    def recent_frames(self, count, since=0.0, timeout=1.0):
+        return [SimpleNamespace(frame=np.full((2, 2), since))] * count
+
+    def __call__(self, frame):
+        _, label = self._trace.at(frame[0, 0])
+        names = [name for name in label.split('+') if name]
+        xyxy = np.array([[i * 20, 0, i * 20 + 10, 10] for i in range(len(names))], np.float32).reshape(-1, 4)
+        return Detections(xyxy, np.full(len(names), 0.9, np.float32),
+                          np.array([IDS[name] for name in names], np.int64), NAMES, frame)
+
+
+class Publisher:
+    def __init__(self):
+        self.lines = []
+
+    def publish_delta(self, session, key, line, total):
+        self.lines.append(key)
+
+
+@pytest.fixture
+def catalog():
+    return PriceCatalog([
+        CatalogEntry('Thumsup', 320, 40.0, False),
+        CatalogEntry('Parachute', 55, 20.0, False),
+        CatalogEntry('Parachute', 44, 10.0, False),
+    ])
+
+
+def _serve(rows, catalog):
+    """
+    _serve plays the (t, grams, labels) rows of a trace to a lane as
+    settled loads.
+
+    Returns: the cart keys the lane published, in order, and the lane.
+    """
+    lane = Lane(Station(1, 0, 27, 17), None, SimpleNamespace(current=lambda: catalog))
+    camera = TraceCamera(lane, rows)
+    lane._detector = camera
+    lane.publisher = Publisher()
+    for t, grams, _ in rows:
+        lane._settled.put((t, grams))
+    lane._serve(camera)
+    return lane.publisher.lines, lane
+
+
+def test_second_item_is_priced_at_the_weight_it_added(catalog):
+    lines, lane = _serve([(1, 320, 'Thumsup'), (2, 375, 'Thumsup+Parachute')], catalog)
+    assert lines == ['Thumsup|320', 'Parachute|55']
+    assert lane.items == 2
+
+
+def test_taking_an_item_off_changes_nothing(catalog):
+    lines, lane = _serve([(1, 320, 'Thumsup'), (2, 375, 'Thumsup+Parachute'), (3, 320, 'Thumsup'),
+                          (4, 364, 'Thumsup+Parachute')], catalog)
+    # the Parachute taken off still counts as on the tray, the one put back is not added again
+    assert lines == ['Thumsup|320', 'Parachute|55']
+    assert lane.items == 2
+
+
+def test_basket_put_down_next_to_an_item_is_solved_from_its_own_weight(catalog):
+    lines, lane = _serve([(1, 320, 'Thumsup'), (2, 419, 'Thumsup+Parachute+Parachute')], catalog)
+    assert lines == ['Thumsup|320', 'Parachute|44', 'Parachute|55']
+    assert lane.items == 3
+
+
+def test_empty_tray_forgets_the_items_on_it(catalog):
+    lines, lane = _serve([(1, 55, 'Parachute'), (2, 0, ''), (3, 44, 'Parachute')], catalog)
+    assert lines == ['Parachute|55', 'Parachute|45']
+    assert lane.items == 2
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from transaction_store import TransactionStore
+
+
+def _sale(when, total, method, items):
+    return {'datetime': when, 'total_price': total, 'payment_method': method, 'items': items}
+
+
+def _item(name, total, count=1, weight=None, **extra):
+    return dict(name=name, count=count, weight=weight, total_price=total, **extra)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TransactionStore(str(tmp_path / 'transactions.db'), flush_interval=0.01)
+    yield store
+    store.close()
+
+
+def test_triggers_keep_daily_totals(store):
+    store.record(_sale('2026-03-01T10:00:00', 60.0, 'Cash',
+                       [_item('Thumsup', 40.0, weight=321), _item('Parachute', 20.0, weight=55)]), key='a')
+    store.record(_sale('2026-03-01T11:00:00', 80.0, 'UPI', [_item('Thumsup', 80.0, count=2)]), key='b')
+    store.record(_sale('2026-03-01T12:00:00', 10.0, 'Cash', [_item('Parachute', 10.0, weight=44)]), key='c')
+    store.record(_sale('2026-03-02T09:00:00', 40.0, None, [_item('Thumsup', 40.0, weight=320)]), key='d')
+    store.flush()
+
+    assert store.count() == 4
+    assert store.daily_sales('2026-03-01', '2026-03-02') == [('2026-03-01', 3, 150.0), ('2026-03-02', 1, 40.0)]
+    assert store.daily_sales('2026-03-02') == [('2026-03-02', 1, 40.0)]
+    assert store.payment_breakdown('2026-03-01') == [('UPI', 1, 80.0), ('Cash', 2, 70.0)]
+    assert store.payment_breakdown('2026-03-02') == [('', 1, 40.0)]
+    assert store.item_sales('2026-03-01', '2026-03-02') == [('Thumsup', 4, 160.0), ('Parachute', 2, 30.0)]
+    assert store.item_sales('2026-03-01', '2026-03-02', limit=1) == [('Thumsup', 4, 160.0)]
+
+
+def test_totals_match_the_stored_transactions(store):
+    for i in range(50):
+        store.record(_sale(f'2026-03-{1 + i % 3:02d}T10:{i:02d}:00', float(i), ('Cash', 'UPI')[i % 2],
+                           [_item('Thumsup', float(i))]), key=str(i))
+    store.flush()
+
+    daily = store._query('SELECT day, COUNT(*), SUM(total_price) FROM transactions GROUP BY day ORDER BY day')
+    assert store.daily_sales('2026-03-01', '2026-03-31') == daily
+    items = store._query('SELECT name, SUM(count), SUM(total_price) FROM transaction_items GROUP BY name')
+    assert store.item_sales('2026-03-01', '2026-03-31') == items
+
+
+def test_duplicate_sale_is_counted_once(store):
+    sale = _sale('2026-03-01T10:00:00', 40.0, 'Cash', [_item('Thumsup', 40.0, weight=320)])
+    store.record(sale, key='session-1')
+    store.record(sale, key='session-1')
+    store.flush()
+    store.record(sale, key='session-1')
+    store.record(sale)  # keyed by its content
+    store.record(dict(sale))
+    store.flush()
+
+    assert store.count() == 2
+    assert store.daily_sales('2026-03-01') == [('2026-03-01', 2, 80.0)]
+    assert store.item_sales('2026-03-01') == [('Thumsup', 2, 80.0)]
+
+
+def test_imported_log_adds_to_the_totals_once(store, tmp_path):
+    log = tmp_path / 'transactions.log'
+    lines = [json.dumps(_sale('2026-03-01T10:00:00', 40.0, 'Cash', [_item('Thumsup', 40.0)])),
+             json.dumps(_sale('2026-03-01T11:00:00', 20.0, 'UPI', [_item('Parachute', 20.0)])),
+             'not json']
+    log.write_text('\n'.join(lines) + '\n')
+
+    assert store.import_log(str(log)) == (2, 1)
+    assert store.import_log(str(log)) == (0, 1)
+    assert store.daily_sales('2026-03-01') == [('2026-03-01', 2, 60.0)]
+
+
+def test_item_weights_leave_out_catalog_weights(store):
+    store.record(_sale('2026-03-01T10:00:00', 100.0, 'Cash', [
+        _item('Thumsup', 40.0, weight=322),
+        _item('Thumsup', 40.0, weight=320, weighed=False),  # basket line
+        _item('Thumsup', 80.0, count=2, weight=640),
+        _item('Apple', 15.0, weight=200, sold_by_weight=True, weighed=True)]), key='a')
+    store.flush()
+
+    assert sorted(store.item_weights('2026-03-01')) == [('Apple', 200.0), ('Thumsup', 322.0)]
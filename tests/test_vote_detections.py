@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from detector import Detections, vote_detections
+
+NAMES = {0: 'Thumsup', 1: 'Parachute', 2: 'Apple'}
+
+
+def _frame(*boxes):
+    """
+    Args:
+        boxes: (class id, confidence, x offset) of every box in the frame.
+    """
+    xyxy = np.array([[x, 0, x + 10, 10] for _, _, x in boxes], np.float32).reshape(-1, 4)
+    conf = np.array([c for _, c, _ in boxes], np.float32)
+    cls = np.array([k for k, _, _ in boxes], np.int64)
+    return Detections(xyxy, conf, cls, NAMES)
+
+
+def test_one_frame_miss_and_false_positive_do_not_change_the_outcome():
+    frames = [_frame((0, 0.9, 0)), _frame(), _frame((0, 0.8, 0), (1, 0.7, 50)), _frame((0, 0.9, 0))]
+    voted = vote_detections(frames)
+
+    assert voted.class_names() == ['Thumsup']
+    assert voted.frames == 4
+    assert voted.votes['Thumsup'] == (3, pytest.approx((0.9 + 0.8 + 0.9) / 4))
+    assert voted.votes['Parachute'] == (1, pytest.approx(0.7 / 4))
+
+
+def test_min_ratio_threshold_is_inclusive():
+    frames = [_frame((0, 0.9, 0)), _frame((0, 0.9, 0)), _frame(), _frame()]
+    assert vote_detections(frames, min_ratio=0.5).class_names() == ['Thumsup']
+    assert len(vote_detections(frames, min_ratio=0.75)) == 0
+
+
+def test_min_confidence_counts_misses_as_zero():
+    frames = [_frame((0, 0.6, 0)), _frame((0, 0.6, 0)), _frame()]
+    assert vote_detections(frames, min_confidence=0.4).class_names() == ['Thumsup']
+    # 0.6 in every frame it was seen in, but 0.4 over all three
+    assert len(vote_detections(frames, min_confidence=0.5)) == 0
+
+
+def test_best_box_per_frame_counts_once():
+    frames = [_frame((0, 0.9, 0), (0, 0.3, 50)), _frame(), _frame()]
+    voted = vote_detections(frames, min_ratio=0.0)
+    assert voted.votes['Thumsup'] == (1, pytest.approx(0.9 / 3))
+
+
+def test_boxes_come_from_the_newest_frame_a_class_was_seen_in():
+    frames = [_frame((0, 0.9, 0), (1, 0.9, 100)), _frame((0, 0.9, 10), (0, 0.8, 30)), _frame((1, 0.9, 200))]
+    voted = vote_detections(frames)
+
+    by_class = {name: voted.xyxy[voted.cls == k][:, 0].tolist() for k, name in NAMES.items()}
+    assert by_class == {'Thumsup': [10, 30], 'Parachute': [200], 'Apple': []}
+    assert sorted(voted.conf.tolist()) == pytest.approx([0.8, 0.9, 0.9])
+
+
+def test_nothing_voted_has_empty_arrays():
+    voted = vote_detections([_frame((0, 0.9, 0)), _frame(), _frame()])
+    assert len(voted) == 0
+    assert voted.xyxy.shape == (0, 4)
+
+
+def test_no_frames_raises():
+    with pytest.raises(ValueError):
+        vote_detections([])
@@ -0,0 +1,71 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from transaction_store import TransactionStore, connect_read_only
+from weight_index import load_weight_history
+
+TODAY = date.today().isoformat()
+
+
+def _tables(path):
+    db = sqlite3.connect(path)
+    try:
+        return {name: [row[1] for row in db.execute(f'PRAGMA table_info({name})')]
+                for name, in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        db.close()
+
+
+def test_history_is_read_while_the_store_is_open(tmp_path):
+    path = str(tmp_path / 'transactions.db')
+    store = TransactionStore(path, flush_interval=0.01)
+    try:
+        store.record({'datetime': f'{TODAY}T10:00:00', 'total_price': 55.0, 'payment_method': 'Cash',
+                      'items': [dict(name='Thumsup', count=1, weight=322, total_price=40.0),
+                                dict(name='Thumsup', count=1, weight=320, total_price=40.0, weighed=False),
+                                dict(name='Apple', count=1, weight=200, total_price=15.0, weighed=True)]},
+                     key='a')
+        store.flush()
+
+        history = load_weight_history(path)
+    finally:
+        store.close()
+
+    assert sorted(history) == ['Apple', 'Thumsup']
+    assert history['Thumsup'].tolist() == [322.0]
+    assert history['Apple'].tolist() == [200.0]
+
+
+def test_old_store_is_read_without_being_migrated(tmp_path):
+    path = str(tmp_path / 'transactions.db')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE transaction_items (transaction_id INTEGER, day TEXT, name TEXT, count INTEGER, '
+               'weight REAL, unit_price REAL, total_price REAL, sold_by_weight INTEGER)')
+    db.execute('INSERT INTO transaction_items VALUES (1, ?, ?, 1, 321, 40.0, 40.0, 0)', (TODAY, 'Thumsup'))
+    db.commit()
+    db.close()
+    tables = _tables(path)
+
+    history = load_weight_history(path)
+
+    assert history['Thumsup'].tolist() == [321.0]
+    assert _tables(path) == tables
+
+
+def test_no_store_means_no_history(tmp_path):
+    path = tmp_path / 'transactions.db'
+    assert load_weight_history(str(path)) == {}
+    assert not path.exists()
+
+
+def test_read_only_connection_cannot_write(tmp_path):
+    path = str(tmp_path / 'transactions.db')
+    TransactionStore(path).close()
+    db = connect_read_only(path)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute('DELETE FROM transactions')
+    finally:
+        db.close()
@@ -0,0 +1,242 @@
+import base64
+import time
+
+import pytest
+
+from twilio_stub import StubTwilio
+from whatsapp_outbox import Outbox, OutboxWorker, SendError, TwilioSender
+
+ACCOUNT_SID = 'AC' + '1' * 32
+FROM = 'whatsapp:+10000000000'
+
+
+class FakeSender:
+    """
+    Records every send and fails with the queued errors first.
+    """
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []  # (to_number, body, resend) of every attempt
+        self.closed = False
+
+    def send(self, to_number, body, resend=False):
+        self.sent.append((to_number, body, resend))
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"SM{len(self.sent)}"
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    yield outbox
+    outbox.close()
+
+
+@pytest.fixture
+def stub():
+    server = StubTwilio().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sender(stub):
+    sender = TwilioSender(ACCOUNT_SID, 'secret', FROM, base_url=stub.base_url(), timeout=2.0)
+    yield sender
+    sender.close()
+
+
+def _until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _deliver_due(worker, outbox, now=None):
+    for message_id, to_number, body, key, attempts in outbox.due(now=now):
+        worker._deliver(message_id, to_number, body, key, attempts)
+
+
+def test_enqueue_is_idempotent(outbox):
+    assert outbox.enqueue('+911', 'receipt', 'session-1')
+    assert not outbox.enqueue('+911', 'receipt again', 'session-1')
+    assert outbox.counts() == {'pending': 1}
+    assert [row[2] for row in outbox.due()] == ['receipt']
+
+
+def test_sent_message_is_not_queued_again(outbox):
+    sender = FakeSender()
+    worker = OutboxWorker(outbox, sender, min_interval=0.0)
+    outbox.enqueue('+911', 'receipt', 'session-1')
+    _deliver_due(worker, outbox)
+
+    assert not outbox.enqueue('+911', 'receipt', 'session-1')
+    _deliver_due(worker, outbox)
+    assert len(sender.sent) == 1
+    assert outbox.status('session-1') == ('sent', 1, None)
+
+
+def test_transient_error_is_retried_as_a_resend(outbox):
+    sender = FakeSender([SendError('HTTP 503')])
+    worker = OutboxWorker(outbox, sender, backoff=10.0, min_interval=0.0)
+    outbox.enqueue('+911', 'receipt', 'session-1')
+
+    before = time.time()
+    _deliver_due(worker, outbox)
+    assert outbox.status('session-1') == ('pending', 1, 'HTTP 503')
+    assert outbox.due() == []  # backing off
+    next_due = outbox.next_due_at()
+    assert before + 10.0 * 0.8 <= next_due <= time.time() + 10.0 * 1.2
+
+    _deliver_due(worker, outbox, now=next_due)
+    assert outbox.status('session-1') == ('sent', 2, None)
+    assert [resend for _, _, resend in sender.sent] == [False, True]
+    assert worker.counters == {'sent': 1, 'retried': 1, 'failed': 0, 'rate_limited': 0}
+
+
+def test_permanent_error_is_not_retried(outbox):
+    sender = FakeSender([SendError('HTTP 400: invalid number', permanent=True)])
+    worker = OutboxWorker(outbox, sender, min_interval=0.0)
+    outbox.enqueue('+000', 'receipt', 'session-1')
+    _deliver_due(worker, outbox)
+
+    assert outbox.status('session-1')[:2] == ('failed', 1)
+    assert outbox.next_due_at() is None
+    assert worker.counters['failed'] == 1
+
+
+def test_message_fails_after_max_attempts(outbox):
+    sender = FakeSender([SendError('timeout')] * 3)
+    worker = OutboxWorker(outbox, sender, max_attempts=3, backoff=0.0, min_interval=0.0)
+    outbox.enqueue('+911', 'receipt', 'session-1')
+    for _ in range(5):
+        _deliver_due(worker, outbox, now=time.time() + 1.0)
+
+    assert len(sender.sent) == 3
+    assert outbox.status('session-1') == ('failed', 3, 'timeout')
+
+
+def test_rate_limit_honours_retry_after(outbox):
+    sender = FakeSender([SendError('HTTP 429', retry_after=30.0)])
+    worker = OutboxWorker(outbox, sender, backoff=1.0, min_interval=0.0)
+    outbox.enqueue('+911', 'receipt', 'session-1')
+    before = time.time()
+    _deliver_due(worker, outbox)
+
+    assert outbox.next_due_at() >= before + 30.0
+    assert worker._paused_until >= before + 30.0
+    assert worker.counters['rate_limited'] == 1
+
+
+def test_rate_limit_without_retry_after_pauses_for_the_backoff(outbox):
+    sender = FakeSender([SendError('HTTP 429', rate_limited=True)])
+    worker = OutboxWorker(outbox, sender, backoff=20.0, min_interval=0.0)
+    outbox.enqueue('+911', 'receipt', 'session-1')
+    before = time.time()
+    _deliver_due(worker, outbox)
+
+    next_due = outbox.next_due_at()
+    assert before + 20.0 * 0.8 <= next_due
+    assert worker._paused_until == pytest.approx(next_due, abs=0.1)
+    assert worker.counters['rate_limited'] == 1
+
+
+def test_worker_delivers_in_the_background(outbox):
+    sender = FakeSender([SendError('HTTP 503')])
+    worker = OutboxWorker(outbox, sender, backoff=0.01, min_interval=0.0).start()
+    try:
+        outbox.enqueue('+911', 'receipt', 'session-1')
+        deadline = time.time() + 5.0
+        while outbox.status('session-1')[0] != 'sent' and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        worker.stop()
+    assert outbox.status('session-1')[:2] == ('sent', 2)
+    assert sender.closed
+
+
+def test_sender_posts_the_form_with_basic_auth(stub, sender):
+    sid = sender.send('+919000000001', 'Total: 10.00 & thanks')
+
+    assert sid == stub.messages[0]['sid']
+    path, headers, form = stub.posts[0]
+    assert path == f"/2010-04-01/Accounts/{ACCOUNT_SID}/Messages.json"
+    assert headers['Authorization'] == 'Basic ' + base64.b64encode(f"{ACCOUNT_SID}:secret".encode()).decode()
+    assert headers['Content-Type'] == 'application/x-www-form-urlencoded'
+    assert form == {'From': FROM, 'To': 'whatsapp:+919000000001', 'Body': 'Total: 10.00 & thanks'}
+
+
+def test_sender_keeps_the_connection_alive(stub, sender):
+    for i in range(3):
+        sender.send('+919000000001', f"receipt {i}")
+    assert stub.connections == 1
+
+
+def test_sender_reconnects_after_a_lost_response(stub, sender):
+    stub.script.append('drop')
+    with pytest.raises(SendError) as error:
+        sender.send('+919000000001', 'receipt 1')
+    assert not error.value.permanent
+
+    sender.send('+919000000001', 'receipt 2')
+    assert stub.connections == 2
+    assert len(stub.messages) == 2
+
+
+def test_resend_finds_the_message_accepted_before(stub, sender):
+    stub.script.append('drop')
+    with pytest.raises(SendError):
+        sender.send('+919000000001', 'receipt 1')
+
+    assert sender.send('+919000000001', 'receipt 1', resend=True) == stub.messages[0]['sid']
+    assert len(stub.posts) == 1
+    assert stub.delivered == {('whatsapp:+919000000001', 'receipt 1'): 1}
+
+
+def test_resend_sends_what_was_not_accepted(stub, sender):
+    stub.script.append(500)
+    with pytest.raises(SendError):
+        sender.send('+919000000001', 'receipt 1')
+
+    sender.send('+919000000001', 'receipt 1', resend=True)
+    assert stub.delivered == {('whatsapp:+919000000001', 'receipt 1'): 1}
+
+
+@pytest.mark.parametrize('status, retry_after, expected', [
+    (429, '7', {'rate_limited': True, 'retry_after': 7.0, 'permanent': False}),
+    (429, None, {'rate_limited': True, 'retry_after': None, 'permanent': False}),
+    (503, None, {'rate_limited': False, 'retry_after': None, 'permanent': False}),
+    (400, None, {'rate_limited': False, 'retry_after': None, 'permanent': True}),
+])
+def test_sender_maps_error_responses(stub, sender, status, retry_after, expected):
+    stub.retry_after = retry_after
+    stub.script.append(status)
+    with pytest.raises(SendError) as error:
+        sender.send('+919000000001', 'receipt 1')
+    assert {name: getattr(error.value, name) for name in expected} == expected
+    assert stub.messages == []
+
+
+def test_worker_delivers_every_receipt_once_through_errors(stub, sender, outbox):
+    stub.script.extend([500, 'drop', 429, 'drop'])
+    stub.retry_after = None
+    worker = OutboxWorker(outbox, sender, backoff=0.05, max_backoff=0.2, min_interval=0.0).start()
+    try:
+        for i in range(5):
+            outbox.enqueue(f"+91900000000{i}", f"Receipt {i}", f"session-{i}")
+        assert _until(lambda: outbox.counts() == {'sent': 5})
+    finally:
+        worker.stop()
+
+    assert sorted(stub.delivered.values()) == [1] * 5
+    assert worker.counters['rate_limited'] == 1
+    assert worker.counters['retried'] == 4
@@ -0,0 +1,137 @@
+"""
+Local stub of the Twilio Messages API, for the outbox tests and
+benchmarks/bench_whatsapp_outbox.py.
+
+It fails a share of the requests with HTTP 500, rate limits with 429 and
+Retry-After, and drops some connections after accepting the message (a
+lost response). Like Twilio it sends every message it accepts, and lists
+them for the sender's check before a resend. Responses queued in `script`
+are served before any random one.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubTwilio(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fail_rate=0.0, drop_rate=0.0, rate_limit=1000, retry_after='1', seed=0):
+        """
+        Args:
+            fail_rate(float): share of the POSTs answered 500.
+            drop_rate(float): share of the accepted POSTs whose response is lost.
+            rate_limit(int): requests per second before answering 429.
+            retry_after(str): Retry-After of the 429 responses, None to leave it out.
+            seed(int): random seed.
+        """
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.script = deque()  # statuses (429, 500, 400, ...) or 'drop' for the next POSTs
+        self.delivered = Counter()  # (To, Body) -> deliveries
+        self.messages = []  # accepted messages as the API lists them, oldest first
+        self.posts = []  # (path, headers, form) of every POST
+        self.requests = Counter()
+        self.connections = 0
+        self._window = []
+
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _rate_limit(self):
+        server = self.server
+        headers = [('Retry-After', server.retry_after)] if server.retry_after is not None else []
+        server.requests['429'] += 1
+        self._reply(429, {'message': 'Too Many Requests'}, headers)
+
+    def _limited(self):
+        server = self.server
+        with server.lock:
+            now = time.monotonic()
+            server._window = [t for t in server._window if now - t < 1.0]
+            if len(server._window) >= server.rate_limit:
+                limited = True
+            else:
+                server._window.append(now)
+                limited = False
+        if limited:
+            self._rate_limit()
+        return limited
+
+    def do_GET(self):
+        if self._limited():
+            return
+        query = {name: values[0] for name, values in parse_qs(urlsplit(self.path).query).items()}
+        server = self.server
+        with server.lock:
+            server.requests['list'] += 1
+            messages = [message for message in reversed(server.messages)
+                        if message['to'] == query.get('To') and message['from'] == query.get('From')]
+        self._reply(200, {'messages': messages[:int(query.get('PageSize', 50))]})
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        form = {name: values[0] for name, values in form.items()}
+        server = self.server
+        with server.lock:
+            server.posts.append((self.path, dict(self.headers), form))
+            scripted = server.script.popleft() if server.script else None
+        if scripted is None and self._limited():
+            return
+        with server.lock:
+            fail = server.rng.random() < server.fail_rate
+            drop = server.rng.random() < server.drop_rate
+        if scripted == 429:
+            self._rate_limit()
+            return
+        if scripted not in (None, 'drop') or (scripted is None and fail):
+            status = scripted or 500
+            server.requests[str(status)] += 1
+            self._reply(status, {'message': f"HTTP {status}"})
+            return
+        with server.lock:
+            server.delivered[(form['To'], form['Body'])] += 1
+            sid = f"SM{len(server.messages):032d}"
+            server.messages.append({'sid': sid, 'to': form['To'], 'from': form['From'],
+                                    'body': form['Body'], 'status': 'queued'})
+            server.requests['201'] += 1
+        if scripted == 'drop' or (scripted is None and drop):
+            server.requests['dropped'] += 1
+            self.close_connection = True
+            return  # accepted, but the response is lost
+        self._reply(201, {'sid': sid, 'status': 'queued'})
@@ -0,0 +1,370 @@
+"""
+Sales transaction store.
+
+Replaces the transactions.log JSON lines with an SQLite database in WAL
+mode. Sales are written by a background thread in batched commits, so
+recording one never waits for the disk, and per-day totals are kept up to
+date by triggers, so end-of-day reports over months of sales read a few
+rows instead of re-parsing every transaction.
+
+Existing logs are imported with
+
+    python3 transaction_store.py import transactions.log
+
+and the daily report is printed with
+
+    python3 transaction_store.py report --days 7
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,          -- receipt session, or hash of an imported log line
+    datetime TEXT NOT NULL,            -- ISO 8601, local time
+    day TEXT NOT NULL,                 -- YYYY-MM-DD of datetime
+    total_price REAL NOT NULL,
+    payment_method TEXT,
+    catalog_version INTEGER
+);
+CREATE INDEX IF NOT EXISTS transactions_datetime ON transactions (datetime);
+CREATE INDEX IF NOT EXISTS transactions_day ON transactions (day);
+CREATE INDEX IF NOT EXISTS transactions_payment ON transactions (payment_method, day);
+
+CREATE TABLE IF NOT EXISTS transaction_items (
+    transaction_id INTEGER NOT NULL REFERENCES transactions (id),
+    day TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    weight REAL,
+    unit_price REAL,
+    total_price REAL NOT NULL,
+    sold_by_weight INTEGER NOT NULL,
+    weighed INTEGER                    -- 0 if weight is the catalog weight, not a reading
+);
+CREATE INDEX IF NOT EXISTS transaction_items_tx ON transaction_items (transaction_id);
+CREATE INDEX IF NOT EXISTS transaction_items_name ON transaction_items (name, day);
+
+CREATE TABLE IF NOT EXISTS daily_sales (
+    day TEXT NOT NULL,
+    payment_method TEXT NOT NULL,
+    transactions INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (day, payment_method)
+);
+CREATE TRIGGER IF NOT EXISTS daily_sales_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO daily_sales (day, payment_method, transactions, revenue)
+    VALUES (NEW.day, COALESCE(NEW.payment_method, ''), 1, NEW.total_price)
+    ON CONFLICT (day, payment_method) DO UPDATE
+    SET transactions = transactions + 1, revenue = revenue + excluded.revenue;
+END;
+
+CREATE TABLE IF NOT EXISTS daily_items (
+    day TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    revenue REAL NOT NULL,
+    PRIMARY KEY (day, name)
+);
+CREATE TRIGGER IF NOT EXISTS daily_items_insert AFTER INSERT ON transaction_items BEGIN
+    INSERT INTO daily_items (day, name, count, revenue)
+    VALUES (NEW.day, NEW.name, NEW.count, NEW.total_price)
+    ON CONFLICT (day, name) DO UPDATE
+    SET count = count + excluded.count, revenue = revenue + excluded.revenue;
+END;
+"""
+
+
+def _item_row(item):
+    sold_by_weight = bool(item.get('sold_by_weight', False))
+    weight = item.get('weight', item.get('detected_weight'))
+    unit_price = item.get('price_per_gram') if sold_by_weight else item.get('price_per_item')
+    weighed = item.get('weighed')
+    return (item['name'], int(item.get('count', 1) or 0), weight, unit_price,
+            float(item.get('total_price', 0.0)), int(sold_by_weight),
+            None if weighed is None else int(bool(weighed)))
+
+
+def _migrate(db):
+    # columns added after the first release; CREATE TABLE IF NOT EXISTS leaves old tables alone
+    columns = {row[1] for row in db.execute('PRAGMA table_info(transaction_items)')}
+    if 'weighed' not in columns:
+        try:
+            db.execute('ALTER TABLE transaction_items ADD COLUMN weighed INTEGER')
+        except sqlite3.OperationalError:
+            pass  # added by another process meanwhile
+
+
+def connect_read_only(path):
+    """
+    connect_read_only opens the store for reading only: no schema, no
+    migration and no writer thread, so readers in other processes never
+    write to it nor wait on its writer.
+
+    Raises: sqlite3.OperationalError if there is no store at `path`.
+    """
+    return sqlite3.connect(f"file:{urllib.request.pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+
+
+def read_item_weights(db, first_day, last_day=None):
+    """
+    read_item_weights is TransactionStore.item_weights on an open connection,
+    e.g. from connect_read_only().
+    """
+    sql = ('SELECT name, weight FROM transaction_items '
+           'WHERE day BETWEEN ? AND ? AND count = 1 AND weight IS NOT NULL')
+    # a store not opened since the weighed column was added has only readings
+    if 'weighed' in {row[1] for row in db.execute('PRAGMA table_info(transaction_items)')}:
+        sql += ' AND weighed IS NOT 0'
+    return db.execute(sql, (first_day, last_day or '9999-12-31')).fetchall()
+
+
+class TransactionStore:
+    """
+    TransactionStore records sales and answers the reporting queries.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=0.5):
+        """
+        Args:
+            path(str): SQLite database file.
+            batch_size(int): max sales written in one commit.
+            flush_interval(float): max seconds a recorded sale waits for its commit.
+        """
+        self.path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')  # durable across app crashes, fsync at checkpoints
+        self._db.executescript(SCHEMA)
+        _migrate(self._db)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='transaction-writer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        close writes the sales still queued and closes the database.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        with self._lock:
+            self._db.close()
+
+    def record(self, transaction, key=None):
+        """
+        record queues one sale for the next batched commit and returns at once.
+
+        Args:
+            transaction(dict): with 'datetime' (ISO), 'total_price',
+                'payment_method', 'items' as in the receipt, and optionally
+                'catalog_version'.
+            key(str): Optional. Unique id of the sale, e.g. the receipt
+                session, so recording it twice keeps one copy.
+        """
+        if key is None:
+            key = hashlib.sha1(json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+        self._queue.put((key, transaction))
+
+    def flush(self):
+        """
+        flush blocks until every sale recorded so far is committed.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, waiters, closing = [], [], False
+            deadline = None
+            while True:
+                if item is None:
+                    closing = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self._flush_interval
+                if closing or waiters or len(batch) >= self._batch_size:
+                    break
+                timeout = deadline - time.monotonic() if deadline else None
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except sqlite3.Error:
+                    logging.exception(f"Failed to store {len(batch)} transactions")
+            for waiter in waiters:
+                waiter.set()
+            if closing:
+                return
+
+    def _write(self, batch):
+        """
+        Returns: int number of new transactions written.
+        """
+        written = 0
+        with self._lock, self._db:
+            for key, transaction in batch:
+                when = transaction['datetime']
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO transactions '
+                    '(key, datetime, day, total_price, payment_method, catalog_version) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, when, when[:10], float(transaction.get('total_price', 0.0)),
+                     transaction.get('payment_method'), transaction.get('catalog_version')))
+                if cursor.rowcount != 1:
+                    continue  # already stored
+                transaction_id = cursor.lastrowid
+                self._db.executemany(
+                    'INSERT INTO transaction_items '
+                    '(transaction_id, day, name, count, weight, unit_price, total_price, sold_by_weight, '
+                    'weighed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(transaction_id, when[:10]) + _item_row(item) for item in transaction.get('items', [])])
+                written += 1
+        return written
+
+    def import_log(self, path, batch_size=5000):
+        """
+        import_log loads a transactions.log file of JSON lines. Lines are
+        keyed by their hash, so importing the same file again adds nothing.
+
+        Returns: (int imported, int skipped malformed lines)
+        """
+        imported = skipped = 0
+        batch = []
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    transaction = json.loads(line)
+                    transaction['datetime']
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+                    continue
+                batch.append(('log:' + hashlib.sha1(line).hexdigest(), transaction))
+                if len(batch) >= batch_size:
+                    imported += self._write(batch)
+                    batch = []
+        if batch:
+            imported += self._write(batch)
+        if skipped:
+            logging.warning(f"Skipped {skipped} malformed lines in {path}")
+        logging.info(f"Imported {imported} transactions from {path}")
+        return imported, skipped
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def count(self):
+        return self._query('SELECT COUNT(*) FROM transactions')[0][0]
+
+    def daily_sales(self, first_day, last_day=None):
+        """
+        Returns: list of (day, transactions, revenue) from `first_day` to
+            `last_day` (inclusive, 'YYYY-MM-DD'), days without sales omitted.
+        """
+        return self._query(
+            'SELECT day, SUM(transactions), SUM(revenue) FROM daily_sales '
+            'WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day',
+            (first_day, last_day or first_day))
+
+    def payment_breakdown(self, first_day, last_day=None):
+        """
+        Returns: list of (payment_method, transactions, revenue) in the range.
+        """
+        return self._query(
+            'SELECT payment_method, SUM(transactions), SUM(revenue) FROM daily_sales '
+            'WHERE day BETWEEN ? AND ? GROUP BY payment_method ORDER BY 3 DESC',
+            (first_day, last_day or first_day))
+
+    def item_sales(self, first_day, last_day=None, limit=None):
+        """
+        Returns: list of (name, count, revenue) in the range, best sellers first.
+        """
+        sql = ('SELECT name, SUM(count), SUM(revenue) FROM daily_items '
+               'WHERE day BETWEEN ? AND ? GROUP BY name ORDER BY 3 DESC')
+        params = (first_day, last_day or first_day)
+        if limit:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        return self._query(sql, params)
+
+    def item_weights(self, first_day, last_day=None):
+        """
+        Returns: list of (name, weight) of the receipt lines of a single
+            item whose weight was read from the scale, from `first_day` on
+            (to `last_day`, inclusive). Lines priced from the catalog weight
+            (baskets, tracked items) are left out; lines stored before this
+            was recorded are taken as weighed.
+        """
+        with self._lock:
+            return read_item_weights(self._db, first_day, last_day)
+
+    def transactions_between(self, start, end):
+        """
+        Returns: list of (datetime, total_price, payment_method) with
+            `start` <= datetime < `end` (ISO strings).
+        """
+        return self._query(
+            'SELECT datetime, total_price, payment_method FROM transactions '
+            'WHERE datetime >= ? AND datetime < ? ORDER BY datetime', (start, end))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sales transaction store")
+    parser.add_argument('--db', default='transactions.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import', help='import transactions.log files')
+    importer.add_argument('logs', nargs='+')
+    report = commands.add_parser('report', help='print daily sales')
+    report.add_argument('--days', type=int, default=1, help='days up to and including --to')
+    report.add_argument('--to', default=date.today().isoformat(), help='last day, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = TransactionStore(args.db)
+    try:
+        if args.command == 'import':
+            for path in args.logs:
+                store.import_log(path)
+            return
+        last_day = args.to
+        first_day = (date.fromisoformat(last_day) - timedelta(days=args.days - 1)).isoformat()
+        for day, transactions, revenue in store.daily_sales(first_day, last_day):
+            print(f"{day}  {transactions:5d} sales  {revenue:12.2f} Rs")
+        print("Payment methods:")
+        for method, transactions, revenue in store.payment_breakdown(first_day, last_day):
+            print(f"  {method or '-':15s} {transactions:5d} sales  {revenue:12.2f} Rs")
+        print("Best sellers:")
+        for name, count, revenue in store.item_sales(first_day, last_day, limit=10):
+            print(f"  {name:30s} {count:5d}  {revenue:12.2f} Rs")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Weight plausibility of a scan.
+
+The catalog prices a reading with the variant nearest to it however far
+off it is, so a 2 kg reading on a tray detected as Thumsup is priced as a
+320 g Thumsup. WeightIndex keeps, for every variant of items.xml, the band
+of weights it is plausibly read at, so a scan is checked with one dict
+lookup and two comparisons:
+
+- packaged products: the variant weight +- the largest of
+  `min_tolerance`, `relative` times the weight, and `sigmas` times the
+  spread of past sales of the product around their variants (a robust
+  standard deviation, so the mis-scans among them do not widen it);
+- products sold by weight: up to `headroom` times the 99th percentile of
+  the weights they were sold at, unbounded until `min_samples` sales
+  are known.
+
+Only weights read from the scale count as history: basket and tracked
+lines, priced from the catalog weight, are left out. The bands are rebuilt
+when the catalog changes (CatalogService on_reload) and when
+HistoryRefresher reloads the sales history, never while scanning.
+"""
+import logging
+import math
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from transaction_store import connect_read_only, read_item_weights
+
+
+def load_weight_history(db_path, days=90):
+    """
+    load_weight_history reads the weights single items were weighed and sold at.
+
+    Args:
+        db_path(str): SQLite transaction store.
+        days(int): how many days back to read, up to today.
+
+    Returns: dict product name -> numpy.ndarray of grams, empty if there is no store.
+    """
+    if not os.path.exists(db_path):
+        logging.info(f"No transaction store at {db_path}, checking weights against the catalog only")
+        return {}
+    # read-only: the checkout's own TransactionStore may be writing to it meanwhile
+    db = connect_read_only(db_path)
+    try:
+        rows = read_item_weights(db, (date.today() - timedelta(days=days - 1)).isoformat())
+    finally:
+        db.close()
+    history = {}
+    for name, weight in rows:
+        history.setdefault(name, []).append(weight)
+    logging.info(f"Weight history: {len(rows)} sales of {len(history)} products over {days} days")
+    return {name: np.array(weights, np.float64) for name, weights in history.items()}
+
+
+class WeightIndex:
+    """
+    WeightIndex tells whether a measured weight is plausible for the
+    catalog variant it was priced as.
+    """
+
+    def __init__(self, history=None, min_tolerance=10.0, relative=0.1, sigmas=4.0,
+                 headroom=3.0, min_samples=20):
+        """
+        Args:
+            history(dict): Optional. From load_weight_history().
+            min_tolerance(float): grams a packaged item may always be off by.
+            relative(float): share of its weight a packaged item may be off by.
+            sigmas(float): past-sales spreads a packaged item may be off by.
+            headroom(float): times the 99th percentile of past sales a
+                product sold by weight may weigh.
+            min_samples(int): past sales a product needs for its history to be used.
+        """
+        self._history = history or {}
+        self._min_tolerance = min_tolerance
+        self._relative = relative
+        self._sigmas = sigmas
+        self._headroom = headroom
+        self._min_samples = min_samples
+        self._bands = {}  # (name, catalog weight) -> (low, high) grams
+        self._catalog = None
+        self._lock = threading.Lock()  # serialises rebuilds, checks never take it
+        self.version = 0  # version of the catalog the bands were built for
+
+    def _spread(self, variants, weights):
+        """
+        Returns: float robust standard deviation (1.4826 MAD) of the past
+            sales of a packaged product around their nearest variants, 0.0
+            with too little history.
+        """
+        if weights is None or len(weights) < self._min_samples:
+            return 0.0
+        catalog_weights = np.asarray(variants.weights, np.float64)
+        i = np.searchsorted(catalog_weights, weights)
+        lower = catalog_weights[np.clip(i - 1, 0, len(catalog_weights) - 1)]
+        upper = catalog_weights[np.clip(i, 0, len(catalog_weights) - 1)]
+        deviation = weights - np.where(weights - lower <= upper - weights, lower, upper)
+        return 1.4826 * float(np.median(np.abs(deviation - np.median(deviation))))
+
+    def rebuild(self, catalog):
+        """
+        rebuild computes the bands of every variant of `catalog` and swaps
+        them in with a single assignment, so checks running meanwhile see
+        either the old or the new bands.
+        """
+        with self._lock:
+            self._catalog = catalog
+            self._rebuild()
+
+    def update_history(self, history):
+        """
+        update_history replaces the sales history and rebuilds the bands of
+        the current catalog with it.
+
+        Args:
+            history(dict): from load_weight_history().
+        """
+        with self._lock:
+            self._history = history or {}
+            if self._catalog is not None:
+                self._rebuild()
+
+    def _rebuild(self):
+        # called with the lock held
+        catalog = self._catalog
+        bands = {}
+        for name in catalog.products():
+            variants = catalog.variants(name)
+            weights = self._history.get(name)
+            if variants.entries[0].sold_by_weight:
+                high = math.inf
+                if weights is not None and len(weights) >= self._min_samples:
+                    high = self._headroom * float(np.percentile(weights, 99))
+                for entry in variants.entries:
+                    bands[(name, entry.weight)] = (0.0, high)
+                continue
+            spread = self._sigmas * self._spread(variants, weights)
+            for entry in variants.entries:
+                tolerance = max(self._min_tolerance, self._relative * entry.weight, spread)
+                bands[(name, entry.weight)] = (entry.weight - tolerance, entry.weight + tolerance)
+        self._bands = bands
+        self.version = catalog.version
+        logging.info(f"Weight bands of {len(bands)} variants built for catalog version {catalog.version}")
+
+    def band(self, entry):
+        """
+        Returns: (low, high) grams `entry` is plausibly read at, or None if
+            it is not indexed (yet).
+        """
+        return self._bands.get((entry.name, entry.weight))
+
+    def plausible(self, entry, weight):
+        """
+        plausible checks a measured weight against the variant it is priced as.
+
+        Args:
+            entry(CatalogEntry): variant, e.g. from PriceCatalog.nearest().
+            weight(float): grams measured for one item.
+
+        Returns: bool False only if `weight` is outside the variant's band.
+        """
+        band = self._bands.get((entry.name, entry.weight))
+        return band is None or band[0] <= weight <= band[1]
+
+
+class HistoryRefresher:
+    """
+    HistoryRefresher reloads the weight history of a WeightIndex from the
+    transaction store every `interval` seconds in the background, so the
+    bands follow the sales of the last days without a restart.
+    """
+
+    def __init__(self, index, db_path, days=90, interval=3600.0):
+        """
+        Args:
+            index(WeightIndex): index to refresh.
+            db_path(str): SQLite transaction store.
+            days(int): how many days back to read, see load_weight_history().
+            interval(float): seconds between reloads.
+        """
+        self._index = index
+        self._db_path = db_path
+        self._days = days
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='weight-history', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def refresh(self):
+        try:
+            history = load_weight_history(self._db_path, self._days)
+        except Exception as e:
+            logging.error(f"Cannot reload the weight history: {e}; keeping the current bands")
+            return False
+        self._index.update_history(history)
+        self.refreshes += 1
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.refresh()
@@ -0,0 +1,370 @@
+"""
+Durable outbox for WhatsApp receipts.
+
+The payment UI only enqueues a receipt message in a local SQLite database
+and returns; a background OutboxWorker delivers it through the Twilio
+Messages API. Messages survive restarts, and delivery is retried with
+exponential backoff, slowed down when Twilio answers 429 Too Many Requests
+(honouring Retry-After).
+
+The idempotency key only keeps a receipt from being queued twice: the
+Messages API has no idempotent POST, so a message whose response was lost
+may have been sent. Before resending one, TwilioSender lists the latest
+messages to the same number and takes one with the same body as sent.
+A message Twilio accepted but does not list yet is sent again, so
+delivery is at least once.
+
+The API base URL is configurable, so the worker can be pointed at a local
+stub server (see benchmarks/bench_whatsapp_outbox.py) instead of Twilio.
+"""
+import base64
+import http.client
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+TWILIO_API_BASE = 'https://api.twilio.com'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    to_number TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, sent or failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    sid TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+
+class SendError(Exception):
+    """
+    Delivery of a message failed.
+
+    retry_after(float): seconds the server asked to wait (429), or None.
+    permanent(bool): True if retrying cannot help (e.g. invalid number).
+    rate_limited(bool): True if the server answered 429, with or without
+        Retry-After.
+    """
+
+    def __init__(self, message, retry_after=None, permanent=False, rate_limited=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+        self.rate_limited = rate_limited
+
+
+class TwilioSender:
+    """
+    TwilioSender posts messages to the Twilio Messages API over one
+    keep-alive HTTP connection, reopened only after an error.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, base_url=TWILIO_API_BASE, timeout=10.0):
+        """
+        Args:
+            account_sid(str): Twilio account SID.
+            auth_token(str): Twilio auth token.
+            from_number(str): sender, e.g. 'whatsapp:+14155238886'.
+            base_url(str): Optional. API base URL, e.g. 'http://127.0.0.1:8080' for a stub.
+            timeout(float): seconds per request.
+        """
+        url = urlsplit(base_url)
+        self._https = url.scheme == 'https'
+        self._host = url.netloc
+        self._path = f"{url.path.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self._from = from_number
+        self._timeout = timeout
+        credentials = base64.b64encode(f"{account_sid}:{auth_token}".encode()).decode()
+        self._auth = f"Basic {credentials}"
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            self._conn = cls(self._host, timeout=self._timeout)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def send(self, to_number, body, resend=False):
+        """
+        Args:
+            to_number(str): recipient, e.g. '+919000000000'.
+            body(str): message text.
+            resend(bool): Optional. True if an earlier attempt may have been
+                accepted; a message to `to_number` with the same body listed
+                by Twilio is then taken as sent instead of sending it again.
+
+        Returns: str message SID.
+
+        Raises:
+            SendError: if the message was not accepted.
+        """
+        to = f"whatsapp:{to_number}"
+        if resend:
+            sid = self._find_sent(to, body)
+            if sid is not None:
+                return sid
+        form = urlencode({'From': self._from, 'To': to, 'Body': body})
+        return self._request('POST', self._path, form).get('sid')
+
+    def _find_sent(self, to, body, limit=20):
+        """
+        Returns: str SID of a message among the newest `limit` to `to` with
+            the same body, or None.
+        """
+        query = urlencode({'From': self._from, 'To': to, 'PageSize': limit})
+        for message in self._request('GET', f"{self._path}?{query}").get('messages', []):
+            if message.get('body') == body and message.get('status') not in ('failed', 'undelivered'):
+                return message.get('sid')
+        return None
+
+    def _request(self, method, path, form=None):
+        """
+        Returns: dict JSON response, empty if it is not JSON.
+
+        Raises:
+            SendError: on connection errors and non-2xx responses.
+        """
+        headers = {'Authorization': self._auth}
+        if form is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=form, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise SendError(f"connection failed: {e}")
+        if response.getheader('Connection', '').lower() == 'close':
+            self.close()
+
+        if 200 <= response.status < 300:
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return {}
+        detail = payload[:200].decode('utf-8', 'replace')
+        if response.status == 429:
+            retry_after = response.getheader('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            raise SendError(f"rate limited: {detail}", retry_after=retry_after, rate_limited=True)
+        if response.status >= 500:
+            raise SendError(f"HTTP {response.status}: {detail}")
+        raise SendError(f"HTTP {response.status}: {detail}", permanent=True)
+
+
+class Outbox:
+    """
+    Outbox is the SQLite queue of messages to deliver. It is safe to use
+    from several threads.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path(str): SQLite database file.
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._added = threading.Event()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def enqueue(self, to_number, body, idempotency_key):
+        """
+        enqueue adds a message unless one with the same key is queued or
+        sent already.
+
+        Returns: bool True if the message was added.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO outbox (idempotency_key, to_number, body, next_attempt_at, created_at) '
+                'VALUES (?, ?, ?, ?, ?)', (idempotency_key, to_number, body, now, now))
+        self.wake()
+        return cursor.rowcount == 1
+
+    def due(self, limit=10, now=None):
+        """
+        Returns: list of (id, to_number, body, idempotency_key, attempts)
+            pending messages whose next attempt is due, oldest first.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, to_number, body, idempotency_key, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, limit)).fetchall()
+
+    def next_due_at(self):
+        """
+        Returns: float time of the next pending attempt, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def mark_sent(self, message_id, sid):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'sent', sid = ?, sent_at = ?, attempts = attempts + 1, "
+                "last_error = NULL WHERE id = ?", (sid, time.time(), message_id))
+
+    def mark_retry(self, message_id, error, next_attempt_at):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ? "
+                "WHERE id = ?", (error, next_attempt_at, message_id))
+
+    def mark_failed(self, message_id, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? "
+                "WHERE id = ?", (error, message_id))
+
+    def status(self, idempotency_key):
+        """
+        Returns: (status, attempts, last_error) of a message, or None.
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT status, attempts, last_error FROM outbox WHERE idempotency_key = ?',
+                (idempotency_key,)).fetchone()
+
+    def counts(self):
+        """
+        Returns: dict of message counts by status.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall()
+        return dict(rows)
+
+    def wake(self):
+        self._added.set()
+
+    def wait_for_new(self, timeout):
+        self._added.wait(timeout)
+        self._added.clear()
+
+
+class OutboxWorker:
+    """
+    OutboxWorker delivers the messages of an Outbox on a background thread.
+    """
+
+    def __init__(self, outbox, sender, max_attempts=8, backoff=2.0, max_backoff=300.0,
+                 min_interval=1.0):
+        """
+        Args:
+            outbox(Outbox): queue to deliver.
+            sender: object with send(to_number, body, resend) -> sid,
+                raising SendError, e.g. TwilioSender. `resend` is True
+                from the second attempt on.
+            max_attempts(int): attempts before a message is marked failed.
+            backoff(float): seconds before the first retry, doubled on each one.
+            max_backoff(float): longest wait between retries.
+            min_interval(float): min seconds between two sends, to stay under
+                the account's rate limit.
+        """
+        self._outbox = outbox
+        self._sender = sender
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._min_interval = min_interval
+        self._paused_until = 0.0  # set by 429 responses, holds back every message
+        self._last_send = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self.counters = {'sent': 0, 'retried': 0, 'failed': 0, 'rate_limited': 0}
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='whatsapp-outbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._outbox.wake()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._sender.close()
+
+    def _retry_delay(self, attempts):
+        delay = min(self._max_backoff, self._backoff * 2 ** attempts)
+        return delay * random.uniform(0.8, 1.2)  # jitter, so retries do not line up
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.time()
+            if now < self._paused_until:
+                self._stop.wait(self._paused_until - now)
+                continue
+            batch = self._outbox.due()
+            if not batch:
+                next_due = self._outbox.next_due_at()
+                timeout = 60.0 if next_due is None else max(0.0, next_due - time.time())
+                self._outbox.wait_for_new(min(timeout, 60.0))
+                continue
+            for message_id, to_number, body, key, attempts in batch:
+                if self._stop.is_set() or time.time() < self._paused_until:
+                    break
+                wait = self._last_send + self._min_interval - time.monotonic()
+                if wait > 0:
+                    self._stop.wait(wait)
+                self._deliver(message_id, to_number, body, key, attempts)
+
+    def _deliver(self, message_id, to_number, body, key, attempts):
+        self._last_send = time.monotonic()
+        try:
+            sid = self._sender.send(to_number, body, resend=attempts > 0)
+        except SendError as e:
+            attempts += 1
+            if e.permanent or attempts >= self._max_attempts:
+                self._outbox.mark_failed(message_id, str(e))
+                self.counters['failed'] += 1
+                logging.error(f"WhatsApp receipt {key} failed after {attempts} attempts: {e}")
+                return
+            delay = self._retry_delay(attempts - 1)
+            if e.rate_limited or e.retry_after is not None:
+                # holds back every message, not only this one; without
+                # Retry-After for as long as this one backs off
+                self.counters['rate_limited'] += 1
+                pause = delay if e.retry_after is None else e.retry_after
+                delay = max(delay, pause)
+                self._paused_until = time.time() + pause
+            self._outbox.mark_retry(message_id, str(e), time.time() + delay)
+            self.counters['retried'] += 1
+            logging.warning(f"WhatsApp receipt {key} not delivered ({e}), retrying in {delay:.1f} s")
+            return
+        self._outbox.mark_sent(message_id, sid)
+        self.counters['sent'] += 1
+        logging.info(f"WhatsApp receipt {key} delivered, SID {sid}")
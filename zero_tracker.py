@@ -0,0 +1,178 @@
+"""
+Background zero tracking for the HX711.
+
+Load cells drift with temperature. ZeroTracker watches the ScaleMonitor
+readings for windows where the tray is empty and stable, and walks the
+channel offset towards them in small, rate limited steps, the way trade
+scales do automatic zero tracking. Every correction is kept in a history
+exposed through metrics(), so the drift of the load cell can be followed
+without ever running a blocking zero().
+"""
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import hardware
+
+
+class ZeroTracker:
+    """
+    ZeroTracker corrects the offset of the HX711 from the readings of a
+    running ScaleMonitor. It runs on the sampling thread as a monitor
+    listener and never reads the HX711 itself. Saving the corrected offset
+    and reading the temperature are handed to a thread of its own, so no
+    file I/O happens on the (possibly realtime) sampling thread.
+
+    A reading is taken as the empty tray drifted when it is stable for
+    `hold` seconds and within `zero_band` grams of zero. Readings within
+    `deadband` are left alone, and at most `max_step` grams are corrected
+    every `min_interval` seconds, so an item lighter than `zero_band` left
+    on the tray is not tared away before the next load change.
+    """
+
+    def __init__(self, hx, monitor, store=None, zero_band=5.0, deadband=0.3, hold=2.0,
+                 max_step=0.5, min_interval=1.0, save_interval=600.0, history=1000,
+                 temperature_interval=30.0):
+        """
+        Args:
+            hx(HX711): calibrated scale.
+            monitor(ScaleMonitor): running monitor of `hx`.
+            store(CalibrationStore): Optional. Saved at most every
+                `save_interval` seconds after corrections.
+            zero_band(float): grams around zero that count as an empty tray.
+            deadband(float): grams of error that are not corrected.
+            hold(float): seconds the tray must be stable before correcting.
+            max_step(float): max grams corrected at once.
+            min_interval(float): min seconds between corrections.
+            save_interval(float): min seconds between saves of `store`.
+            history(int): corrections kept for metrics().
+            temperature_interval(float): seconds between temperature reads.
+        """
+        self._hx = hx
+        self._monitor = monitor
+        self._store = store
+        self.zero_band = zero_band
+        self.deadband = deadband
+        self.hold = hold
+        self.max_step = max_step
+        self.min_interval = min_interval
+        self._save_interval = save_interval
+        self._temperature_interval = temperature_interval
+        self.history = deque(maxlen=history)
+        self.corrections = 0
+        self.net_correction = 0.0  # grams, sum of all corrections since start
+        self._last_correction = 0.0
+        self._last_save = time.monotonic()
+        self._dirty = False
+        self.temperature = None  # degrees Celsius, refreshed by the worker thread
+        self._save_wanted = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+
+    def start(self):
+        # started here, not from the sampling thread, so it does not inherit its priority
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run_worker, name='zero-tracker', daemon=True)
+        self._worker.start()
+        self._monitor.add_listener(self.update)
+        return self
+
+    def stop(self):
+        self._monitor.remove_listener(self.update)
+        if self._worker:
+            self._stop.set()
+            self._save_wanted.set()
+            self._worker.join(2.0)
+            self._worker = None
+        self.save()
+
+    def _run_worker(self):
+        while True:
+            self.temperature = hardware.read_temperature()
+            if not self._save_wanted.wait(self._temperature_interval):
+                continue
+            self._save_wanted.clear()
+            if self._stop.is_set():
+                return
+            self.save()
+
+    def save(self):
+        """
+        save writes the corrected offset to the calibration store, if any.
+        Blocks on file I/O; update() only requests it from the worker thread.
+        """
+        if self._store is None or not self._dirty:
+            return
+        self._dirty = False  # a correction made while saving marks it dirty again
+        self._store.record(self._hx, ratio=False)
+        try:
+            self._store.save()
+        except OSError as e:
+            self._dirty = True
+            logging.warning(f"Cannot save the tracked zero: {e}")
+            return
+        self._last_save = time.monotonic()
+
+    def update(self, reading):
+        """
+        update looks at one WeightReading and corrects the offset if the
+        tray is empty, stable and off zero.
+
+        Returns: float grams corrected, or None.
+        """
+        weight = reading.weight
+        if not reading.stable or abs(weight) > self.zero_band or abs(weight) <= self.deadband:
+            return None
+        now = reading.timestamp
+        if reading.stable_for(now) < self.hold or now - self._last_correction < self.min_interval:
+            return None
+
+        step = max(-self.max_step, min(self.max_step, weight))
+        hx = self._hx
+        channel, gain_A = hx.get_current_channel(), hx.get_current_gain_A()
+        offset = hx.get_current_offset(channel, gain_A)
+        ratio = hx.get_current_scale_ratio(channel, gain_A)
+        new_offset = int(round(offset + step * ratio))
+        if new_offset == offset:
+            return None
+        hx.set_offset(new_offset, channel, gain_A)
+
+        self._last_correction = now
+        self.corrections += 1
+        self.net_correction += step
+        self._dirty = True
+        self.history.append({
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'time': now,
+            'correction_g': step,
+            'offset': new_offset,
+            'temperature_c': self.temperature,
+        })
+        logging.debug(f"Zero tracking: corrected {step:+.2f} g, offset {new_offset}")
+        if self._store is not None and now - self._last_save >= self._save_interval:
+            self._last_save = now
+            self._save_wanted.set()
+        return step
+
+    def metrics(self):
+        """
+        Returns: dict with the number of corrections, the net correction in
+            grams, the drift rate in grams per hour over the kept history,
+            the current offset and the last correction.
+        """
+        drift_rate = None
+        if len(self.history) > 1:
+            first, last = self.history[0], self.history[-1]
+            hours = (last['time'] - first['time']) / 3600.0
+            if hours > 0:
+                corrected = sum(entry['correction_g'] for entry in self.history) - first['correction_g']
+                drift_rate = corrected / hours
+        return {
+            'corrections': self.corrections,
+            'net_correction_g': self.net_correction,
+            'drift_g_per_hour': drift_rate,
+            'offset': self._hx.get_current_offset(),
+            'last_correction': self.history[-1] if self.history else None,
+        }